@@ -16,10 +16,14 @@ import logging
 import tempfile
 import json
 import subprocess
-from multiprocessing import Pool
 from setproctitle import setproctitle
 from subprocess import check_output
 
+# shared tools from the hrtf scripts folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "hrtf"))
+
+import job_scheduler
+
 
 logger = logging.getLogger(__name__)
 
@@ -48,7 +52,7 @@ _APLAY_EXE = "/usr/bin/aplay"
 # HW RESOURCES
 #
 _MIN_CPU_COUNT = 1  # we need at least one CPU for each compute process
-_MIN_MEM_GB = 0.2  # min amount of memory for each compute process
+_MIN_MEM_GB = 0.2  # initial memory guess for each compute process (then measured, see job_scheduler)
 _MAX_MEM_GB = 0.2  # max amount of memory for each compute process
 
 #
@@ -282,23 +286,18 @@ def audiomux_files(args, path, cpu_cores=1):
     if(len(auralys_wav_list)>0):
         # mux them all
 
-        # compute process pool size based on CPU/MEM requirements
-        mem_bytes = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")  # e.g. 4015976448
-        mem_gib = mem_bytes / (1024.0**3)  # e.g. 3.74
-        cpu_count = min([(os.cpu_count() - 2), cpu_cores])
-        cpu_count = max([_MIN_CPU_COUNT, cpu_count])
+        # compute process pool size based on CPU requirements, tasks are started
+        # according to the measured memory of ffmpeg processes (see job_scheduler)
+        cpu_count = job_scheduler.cpu_pool_size(cpu_cores)
 
         if(cpu_count==1):
             for f in auralys_wav_list:
                 audiomux_wav_to_mkv(f)
         else:
-            max_pool_size = min(cpu_count, int(mem_gib / _MIN_MEM_GB))
-            print("Pool size: {}".format(max_pool_size))
-            cpu_pool = Pool(max_pool_size)
-            if len(auralys_wav_list) > 0:
-                result = cpu_pool.map(audiomux_wav_to_mkv, auralys_wav_list)
-            cpu_pool.close()
-            cpu_pool.join()
+            print("Pool size: {}".format(cpu_count))
+            result = job_scheduler.run_tasks(
+                audiomux_wav_to_mkv, auralys_wav_list, processes=cpu_count, mem_per_task_gb=_MIN_MEM_GB, name="mux"
+            )
 
     if(args.remove==True):
         if(len(auralys_wav_list)>0):
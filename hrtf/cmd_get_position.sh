@@ -11,6 +11,9 @@ angle=$(echo "($mks_steps * (360.0/2454840))"  | tr -d '\r' | bc -l)
 
 angle_int=$(echo "$angle" | awk '{print int($1+0.5)}')
 
-output_yaml=$(echo "$output" | sed -E "s/\"encoder\"[[:space:]]*:[[:space:]]*-?[0-9]+/\"position\": $angle_int/")
+# encoder resolution angle, for the continuous rotation log (see record_ess_map.py)
+angle_fine=$(echo "$angle" | awk '{printf "%.6f", $1}')
+
+output_yaml=$(echo "$output" | sed -E "s/\"encoder\"[[:space:]]*:[[:space:]]*-?[0-9]+/\"position\": $angle_int, \"angle\": $angle_fine/")
 
 echo "$output_yaml"
@@ -5,9 +5,7 @@ from __future__ import division
 import scipy.signal as sig
 
 import os
-import re
 import sys
-import glob
 import yaml
 import logging
 import signal
@@ -26,11 +24,18 @@ import pyfar as pf
 import soundfile as sf
 import sofar as sof
 
-import multiprocessing
-import multiprocessing.pool
 
 from setproctitle import setproctitle
 
+import job_scheduler
+import shared_array
+import sofa_stream
+import ir_bundle
+import session_index
+import session_config
+import session_discovery
+import delay_estimator
+
 from datetime import datetime
 
 
@@ -43,8 +48,6 @@ logger = logging.getLogger(__name__)
 _CTRL_EXIT_SIGNAL = 0  # driven by CTRL-C, 0 to exit threads
 
 _MIN_CPU_COUNT = 1  # we need at least one CPU for each compute process
-_MIN_MEM_GB = 2  # min amount of memory for each compute process
-_MAX_MEM_GB = 6  # max amount of memory for each compute process
 _PLOT_SAVE_GRAPH = 0  # 0:skip, 1:save, 2:show, 3:show&save plot
 
 # IR_INFO for pyfar data storage
@@ -53,6 +56,9 @@ _IR_INFO_DELAY_SAMPLES = 1
 _IR_INFO_dbFS_CALIB = 2
 _IR_INFO_SAMPLERATE = 3
 
+# zero-delay: IRs start this time before the direct path peak
+_DIRECT_PATH_OFFSET_s = 0.0001
+
 
 #
 # TOOLS
@@ -96,63 +102,9 @@ def signal_handler(sig, frame):
 #     # sofa.inspect()
 
 
-def sum_array(data=None):
-    rv = 0
-
-    items_num = len(data)
-    for val in data:
-        rv += val
-
-    return rv
-
-
-def compute_delay(data=None):
-    adata = abs(data)
-
-    peak_idx = np.argmax(adata)
-    peak = adata[peak_idx]
-
-    i = peak_idx - 4
-    while (i > 4) and (sum_array(adata[i - 4 : i]) > (peak / 4)):
-        i -= 1
-
-    return i
-
-
-def compute_delay_adj(data=None, idx=0):
-    adata = abs(data)
-
-    peak_idx = idx
-
-    if peak_idx == 0:
-        peak_idx = np.argmax(adata)
-
-    peak = adata[peak_idx]
-
-    i = peak_idx - 4
-    while (i > 4) and (sum_array(adata[i - 4 : i]) > (peak / 4)):
-        i -= 1
-
-    return i
-
-def compute_delay_offset(data=None, idx=0, sr=96000, offset=0.0001):
-    adata = abs(data)
-
-    peak_idx = idx
-
-    if peak_idx == 0:
-        peak_idx = np.argmax(adata)
-
-    # must be multiple of 2
-    offset_samples = int(offset * sr) /2
-    offset_samples = offset_samples * 2
-
-    if(offset_samples < peak_idx):
-        peak_idx = peak_idx - offset_samples
-
-    return int(peak_idx)
-
-def read_ir_delays(data=None, configs=None, folders=None, receivers_list=None):
+def read_ir_delays(data=None, configs=None, folders=None, receivers_list=None, results=None):
+    """IR delays (samples) in data, from the results of each position in the session index if
+    given (see session_index)"""
     global _CTRL_EXIT_SIGNAL
 
     err = 0
@@ -160,6 +112,15 @@ def read_ir_delays(data=None, configs=None, folders=None, receivers_list=None):
     samples_ir_window = 0
 
     for i in range(len(configs)):
+        # session index results, or one bundle for each position (if available) instead of per receiver files
+        bundle_results = None
+        bundle_filename = ir_bundle.bundle_path(folders[i], configs[i])
+        if results is not None:
+            bundle_results = results[i]["receivers"]
+            bundle_filename = folders[i] + " (session index)"
+        elif ir_bundle.has_bundle(folders[i], configs[i]):
+            bundle_results = ir_bundle.read_results(folders[i], configs[i])
+
         selection_list = range(configs[i]["setup"]["listeners"][0]["receivers_count"])
         if receivers_list != None:
             selection_list = receivers_list
@@ -170,7 +131,7 @@ def read_ir_delays(data=None, configs=None, folders=None, receivers_list=None):
             if _CTRL_EXIT_SIGNAL:
                 return (err, samples_ir, samples_ir_window)
 
-            ir_trid = configs[i]["setup"]["listeners"][0]["receivers"][ii]["track_id"]
+            ir_trid = session_config.track_ids(configs[i])[ii]
             ir_folder = folders[i] + "/ir/"
             ir_yaml_filename = (
                 configs[i]["custom"]["audio_filename"] + "_IR_rx_" + str(ii) + "_trid_" + str(ir_trid) + ".yaml"
@@ -180,12 +141,16 @@ def read_ir_delays(data=None, configs=None, folders=None, receivers_list=None):
 
             ir_yaml = []
 
-            try:
-                with open(ir_yaml_file, "r") as file:
-                    ir_yaml = yaml.safe_load(file)
-            except:
-                logger.error("ERROR while reading {}".format(ir_yaml_file))
-                ir_yaml = None
+            if bundle_results != None:
+                ir_yaml = bundle_results.get(int(ii))
+                if ir_yaml == None:
+                    logger.error("ERROR missing rx_id {} in {}".format(ii, bundle_filename))
+            else:
+                try:
+                    ir_yaml = session_config.read_yaml(ir_yaml_file)
+                except:
+                    logger.error("ERROR while reading {}".format(ir_yaml_file))
+                    ir_yaml = None
 
             if ir_yaml != None:
                 # if receivers_list != None:
@@ -222,99 +187,17 @@ def read_ir_sample(params):
     receivers_list = params[3]
     zero_delay = params[4]
     samples_ir_window = params[5]
-    sofa_data_ir = params[6]
-    sofa_data_delay = params[7]
+    sofa_data_delay = params[7]  # Data_Delay row of the position
     remove_direct_path = params[8]
 
-    selection_list = range(config["setup"]["listeners"][0]["receivers_count"])
-    if receivers_list != None:
-        selection_list = receivers_list
-
-    idx = 0
-    for ii in selection_list:  # range(configs[i]["setup"]["listeners"][0]["receivers_count"]):
-        # handle CTRL-C
-        if _CTRL_EXIT_SIGNAL:
-            return
-
-        ir_trid = config["setup"]["listeners"][0]["receivers"][ii]["track_id"]
-        ir_folder = folder + "/ir/"
-        ir_pyfar_filename = config["custom"]["audio_filename"] + "_IR_rx_" + str(ii) + "_trid_" + str(ir_trid) + ".far"
-        ir_pyfar_file = ir_folder + "/" + ir_pyfar_filename
-
-        logger.info(ir_pyfar_file)
-
-        ir_pyfar = []
-
-        try:
-            # with open(ir_pyfar_file, "r") as file:
-            ir_pyfar = pf.io.read(ir_pyfar_file)
-        except:
-            logger.error("ERROR while reading {}".format(ir_pyfar_file))
-            ir_pyfar = None
-
-        if ir_pyfar != None:
-            # fetch impulse response in time domain
-            if zero_delay == False:
-                if receivers_list != None:
-                    sofa_data_ir[i, idx, :] = ir_pyfar["ir_norm_hipass_window"].time[0][0:samples_ir_window]
-                else:
-                    sofa_data_ir[i, ii, :] = ir_pyfar["ir_norm_hipass_window"].time[0][0:samples_ir_window]
-
-            else:
-                # retrieve info from file processing, 3DTune-In requires zero-delay aligned files!!
-                ir_info = ir_pyfar["ir_info"]
-                ir_delay_samples = int(ir_info[_IR_INFO_DELAY_SAMPLES])
-                ir_samplerate = int(ir_info[_IR_INFO_SAMPLERATE])
-                ir_samples = len(ir_pyfar["ir_norm_hipass_window"].time[0])
-
-                # make sure we preserve the peak for the final IR
-                # ir_delay_samples = compute_delay_adj(ir_pyfar["ir_norm_hipass_window"].time[0], ir_delay_samples)
-                ir_delay_samples = compute_delay_offset(data=ir_pyfar["ir_norm_hipass_window"].time[0], idx=ir_delay_samples, sr=ir_samplerate, offset=0.0001)
-                ir_len = ir_pyfar["ir_norm_hipass_window"].n_samples
-
-                if ir_len > ir_delay_samples:
-                    # window/all samples count
-                    tmp = ir_len - ir_delay_samples
-                    if tmp > samples_ir_window:
-                        tmp = samples_ir_window
-
-                    if(remove_direct_path>0):
-                        # TODO: apply windowing to the crossing point
-                        ir_null_samples = ir_delay_samples + int(round(ir_samplerate*remove_direct_path))
-                        if(ir_samples < ir_null_samples):
-                            ir_null_samples = ir_samples
-                        # erase direct path wave
-                        ir_pyfar["ir_norm_hipass_window"].time[0][0:ir_null_samples] = np.zeros(ir_null_samples)
-
-                    if receivers_list != None:
-                        sofa_data_ir[i, idx, 0:tmp] = ir_pyfar["ir_norm_hipass_window"].time[0][
-                            ir_delay_samples : (ir_delay_samples + tmp)
-                        ]
-
-                        sofa_data_delay[i, idx] = ir_delay_samples                        
-                    else:
-                        sofa_data_ir[i, ii, 0:tmp] = ir_pyfar["ir_norm_hipass_window"].time[0][
-                            ir_delay_samples : (ir_delay_samples + tmp)
-                        ]
-
-                        sofa_data_delay[i, ii] = ir_delay_samples
-                else:
-                    logger.error(
-                        "ERROR: invalide delay samples for:{} rx_id:{} [{}<{}] ".format(
-                            ir_pyfar_filename, ii, ir_len, ir_delay_samples
-                        )
-                    )
-
-        idx += 1
-
-
-def read_ir_samples(data=None, data_delay=None, configs=None, folders=None, zero_delay=False, receivers_list=None, samples_ir_window=0, remove_direct_path=0.0):
-    global _CTRL_EXIT_SIGNAL
-
-    err = 0
+    # Data_IR: shared memory array handle in process mode (see shared_array), the array in thread mode
+    with shared_array.attach(params[6]) as sofa_data_ir:
+        # one bundle for each position (if available) instead of per receiver files
+        bundle_receivers = None
+        if ir_bundle.has_bundle(folder, config):
+            bundle_receivers = ir_bundle.read_receivers(folder, config)
 
-    for i in range(len(configs)):
-        selection_list = range(configs[i]["setup"]["listeners"][0]["receivers_count"])
+        selection_list = range(config["setup"]["listeners"][0]["receivers_count"])
         if receivers_list != None:
             selection_list = receivers_list
 
@@ -324,10 +207,10 @@ def read_ir_samples(data=None, data_delay=None, configs=None, folders=None, zero
             if _CTRL_EXIT_SIGNAL:
                 return
 
-            ir_trid = configs[i]["setup"]["listeners"][0]["receivers"][ii]["track_id"]
-            ir_folder = folders[i] + "/ir/"
+            ir_trid = session_config.track_ids(config)[ii]
+            ir_folder = folder + "/ir/"
             ir_pyfar_filename = (
-                configs[i]["custom"]["audio_filename"] + "_IR_rx_" + str(ii) + "_trid_" + str(ir_trid) + ".far"
+                config["custom"]["audio_filename"] + "_IR_rx_" + str(ii) + "_trid_" + str(ir_trid) + ".far"
             )
             ir_pyfar_file = ir_folder + "/" + ir_pyfar_filename
 
@@ -335,33 +218,34 @@ def read_ir_samples(data=None, data_delay=None, configs=None, folders=None, zero
 
             ir_pyfar = []
 
-            try:
-                # with open(ir_pyfar_file, "r") as file:
-                ir_pyfar = pf.io.read(ir_pyfar_file)
-            except:
-                logger.error("ERROR while reading {}".format(ir_pyfar_file))
-                ir_pyfar = None
+            if bundle_receivers != None:
+                ir_pyfar = bundle_receivers.get(int(ii))
+                if ir_pyfar == None:
+                    logger.error("ERROR missing rx_id {} in {}".format(ii, ir_bundle.bundle_path(folder, config)))
+            else:
+                try:
+                    # with open(ir_pyfar_file, "r") as file:
+                    ir_pyfar = pf.io.read(ir_pyfar_file)
+                except:
+                    logger.error("ERROR while reading {}".format(ir_pyfar_file))
+                    ir_pyfar = None
 
             if ir_pyfar != None:
                 # fetch impulse response in time domain
                 if zero_delay == False:
                     if receivers_list != None:
-                        data[i, idx, :] = ir_pyfar["ir_norm_hipass_window"].time[0][0:samples_ir_window]
+                        sofa_data_ir[i, idx, :] = ir_pyfar["ir_norm_hipass_window"].time[0][0:samples_ir_window]
                     else:
-                        data[i, ii, :] = ir_pyfar["ir_norm_hipass_window"].time[0][0:samples_ir_window]
+                        sofa_data_ir[i, ii, :] = ir_pyfar["ir_norm_hipass_window"].time[0][0:samples_ir_window]
 
                 else:
                     # retrieve info from file processing, 3DTune-In requires zero-delay aligned files!!
                     ir_info = ir_pyfar["ir_info"]
-                    ir_delay_samples = int(ir_info[_IR_INFO_DELAY_SAMPLES])
                     ir_samplerate = int(ir_info[_IR_INFO_SAMPLERATE])
                     ir_samples = len(ir_pyfar["ir_norm_hipass_window"].time[0])
 
-                    # make sure we preserve the peak for the final IR
-                    # ir_delay_samples = compute_delay(ir_pyfar["ir_norm_hipass_window"].time[0])
-                    # ir_delay_samples = compute_delay_adj(ir_pyfar["ir_norm_hipass_window"].time[0], ir_delay_samples)
-                    ir_delay_samples = compute_delay_offset(data=ir_pyfar["ir_norm_hipass_window"].time[0], idx=ir_delay_samples, sr=ir_samplerate, offset=0.0001)
-
+                    # zero-delay start, computed for all the positions at once (see compute_sofa)
+                    ir_delay_samples = int(sofa_data_delay[idx])
                     ir_len = ir_pyfar["ir_norm_hipass_window"].n_samples
 
                     if ir_len > ir_delay_samples:
@@ -378,19 +262,14 @@ def read_ir_samples(data=None, data_delay=None, configs=None, folders=None, zero
                             # erase direct path wave
                             ir_pyfar["ir_norm_hipass_window"].time[0][0:ir_null_samples] = np.zeros(ir_null_samples)
 
-
                         if receivers_list != None:
-                            data[i, idx, 0:tmp] = ir_pyfar["ir_norm_hipass_window"].time[0][
+                            sofa_data_ir[i, idx, 0:tmp] = ir_pyfar["ir_norm_hipass_window"].time[0][
                                 ir_delay_samples : (ir_delay_samples + tmp)
                             ]
-
-                            data_delay[i, idx] = ir_delay_samples
                         else:
-                            data[i, ii, 0:tmp] = ir_pyfar["ir_norm_hipass_window"].time[0][
+                            sofa_data_ir[i, ii, 0:tmp] = ir_pyfar["ir_norm_hipass_window"].time[0][
                                 ir_delay_samples : (ir_delay_samples + tmp)
                             ]
-
-                            data_delay[i, ii] = ir_delay_samples                            
                     else:
                         logger.error(
                             "ERROR: invalide delay samples for:{} rx_id:{} [{}<{}] ".format(
@@ -401,8 +280,69 @@ def read_ir_samples(data=None, data_delay=None, configs=None, folders=None, zero
             idx += 1
 
 
-def read_sources_listeners(data=None):
-    """read audio config records and verify data correctness"""
+def read_ir_samples(data=None, data_delay=None, configs=None, folders=None, zero_delay=False, receivers_list=None, samples_ir_window=0, remove_direct_path=0.0):
+    """serial load of the IR samples of all the positions in data (see read_ir_sample)"""
+    for i in range(len(configs)):
+        # handle CTRL-C
+        if _CTRL_EXIT_SIGNAL:
+            return
+
+        read_ir_sample(
+            (
+                i,
+                configs[i],
+                folders[i],
+                receivers_list,
+                zero_delay,
+                samples_ir_window,
+                data,
+                data_delay[i],
+                remove_direct_path,
+            )
+        )
+
+
+def select_ir_samples(
+    ir_samples=None,
+    data_delay=None,
+    folders=None,
+    results=None,
+    receivers_list=None,
+    zero_delay=False,
+    samples_ir_window=0,
+    remove_direct_path=0.0,
+    samplerate=48000,
+):
+    """Data_IR of the receivers_list from ir_samples, the IRs of all the receivers (shape: measures,
+    receivers, samples, zero padded after each IR as compute_sofa loads them): same samples of
+    read_ir_samples, without reading the files again. zero_delay: each IR from its data_delay sample,
+    the direct path (remove_direct_path seconds after the delay) set to zero."""
+    receivers_list = list(receivers_list)
+    data = ir_samples[:, receivers_list, :]
+    if not zero_delay:
+        return np.array(data[:, :, :samples_ir_window])
+
+    delays = data_delay.astype(np.int64)
+    data = delay_estimator.shift_rows(data, delays, length=samples_ir_window)
+    if remove_direct_path > 0:
+        data[:, :, : int(round(samplerate * remove_direct_path))] = 0
+
+    # same errors of read_ir_samples: IRs (from the results) not longer than their delay
+    for i in range(len(folders)):
+        for idx, ii in enumerate(receivers_list):
+            ir_len = results[i]["receivers"].get(ii, {}).get("ir_norm_hipass_window_samples")
+            if ir_len is not None and ir_len <= delays[i, idx]:
+                logger.error(
+                    "ERROR: invalide delay samples for:{} rx_id:{} [{}<{}] ".format(
+                        folders[i], ii, ir_len, delays[i, idx]
+                    )
+                )
+    return data
+
+
+def read_sources_listeners(data=None, select_rx=None):
+    """read audio config records and verify data correctness, receivers of select_rx (short_name or
+    short_name,description) if given"""
     err = 0
 
     rv_listeners = []
@@ -434,8 +374,8 @@ def read_sources_listeners(data=None):
             log.error("compute_sofa: invalid listeners count for {}".format(config["custom"]["audio_folder"]))
             err += 1
 
-        if err == 0:
-            # AES69: receivers do not change specs and calibration between measures
+        # AES69: receivers do not change specs and calibration between measures (same hash: same receivers)
+        if err == 0 and not session_config.same_hash(config, data[0], "receivers_hash"):
             for idx in range(config["setup"]["listeners"][0]["receivers_count"]):
                 receiver_ref = data[0]["setup"]["listeners"][0]["receivers"][idx]
                 receiver_tmp = config["setup"]["listeners"][0]["receivers"][idx]
@@ -452,11 +392,11 @@ def read_sources_listeners(data=None):
         # filter receivers if needed
         rv_receiver_selection = []
         if err == 0:
-            if yaml_params["select_rx"] != None:
+            if select_rx != None:
                 for idx in range(config["setup"]["listeners"][0]["receivers_count"]):
                     receiver_tmp = config["setup"]["listeners"][0]["receivers"][idx]
 
-                    key = yaml_params["select_rx"].split(",")
+                    key = select_rx.split(",")
                     if len(key) == 1:
                         key.append(None)
 
@@ -470,11 +410,15 @@ def read_sources_listeners(data=None):
                                     rv_receiver_selection.append(idx)
 
         # count listener positions, did the listener move or not?
-        if (err == 0) and (config["setup"]["listeners"][0]["position"] != data[0]["setup"]["listeners"][0]["position"]):
+        if (
+            (err == 0)
+            and not session_config.same_hash(config, data[0], "listener_hash")
+            and (config["setup"]["listeners"][0]["position"] != data[0]["setup"]["listeners"][0]["position"])
+        ):
             rv_listeners_positions_count += 1
 
-        if err == 0:
-            # AES69: emitters do not change specs and calibration between measures
+        # AES69: emitters do not change specs and calibration between measures
+        if err == 0 and not session_config.same_hash(config, data[0], "emitters_hash"):
             for idx in range(config["setup"]["sources"][0]["emitters_count"]):
                 emitter_ref = data[0]["setup"]["sources"][0]["emitters"][idx]
                 emitter_tmp = config["setup"]["sources"][0]["emitters"][idx]
@@ -487,13 +431,19 @@ def read_sources_listeners(data=None):
                     err += 1
 
         # count sources positions, did the listener move or not?
-        if (err == 0) and (config["setup"]["sources"][0]["position"] != data[0]["setup"]["sources"][0]["position"]):
+        if (
+            (err == 0)
+            and not session_config.same_hash(config, data[0], "source_hash")
+            and (config["setup"]["sources"][0]["position"] != data[0]["setup"]["sources"][0]["position"])
+        ):
             rv_sources_positions_count += 1
 
     return err, rv_sources_positions_count, rv_listeners_positions_count, rv_receiver_selection
 
 
-def compute_sofa(audio_recording=None, measures_list=None, yaml_params=None):
+def compute_sofa(audio_recording=None, measures_list=None, yaml_params=None, ir_samples=None):
+    """3DTune-In sofa file of the select_rx receivers. ir_samples: Data_IR of all the receivers already
+    loaded (see compute_sofa_all), the selected receivers are cut from it instead of read again"""
     if audio_recording == None:
         logger.error("compute_sofa: audio_recording is None")
         return
@@ -508,25 +458,22 @@ def compute_sofa(audio_recording=None, measures_list=None, yaml_params=None):
 
     measure_folder_list = []
     measure_audio_config_list = []
+    measure_results_list = []
     measures_list = list(measures_list)
 
     # unpack list
     for m in measures_list:
         measure_folder_list.append(m[0])
         measure_audio_config_list.append(m[1])
+        measure_results_list.append(m[2])
 
     #
-    # POOL: compute process pool size based on CPU/MEM requirements
+    # POOL: loader processes pool size based on CPU requirements (IR samples are
+    # written in the shared memory Data_IR array, see shared_array)
     #
-    mem_bytes = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")  # e.g. 4015976448
-    mem_gib = mem_bytes / (1024.0**3)  # e.g. 3.74
-    cpu_count = min([(os.cpu_count() - 2), yaml_params["cpu_process"]])
-    cpu_count = max([_MIN_CPU_COUNT, cpu_count])
-    if _PLOT_SAVE_GRAPH == 0:
-        max_pool_size = min(cpu_count, int(mem_gib / _MIN_MEM_GB))
-    else:
-        max_pool_size = min(cpu_count, int(mem_gib / _MAX_MEM_GB))
+    max_pool_size = job_scheduler.cpu_pool_size(yaml_params["cpu_process"])
     logger.info("Pool size: {}".format(max_pool_size))
+    shared_ir = None
 
     # ToDo: remove this print or move to logger!
     logger.info("-" * 80)
@@ -624,7 +571,7 @@ def compute_sofa(audio_recording=None, measures_list=None, yaml_params=None):
     # azimuth, elevation, distance
 
     (err, sources_positions_count, listeners_positions_count, receivers_selection) = read_sources_listeners(
-        measure_audio_config_list
+        measure_audio_config_list, yaml_params["select_rx"]
     )
 
     #
@@ -821,6 +768,7 @@ def compute_sofa(audio_recording=None, measures_list=None, yaml_params=None):
             configs=measure_audio_config_list,
             folders=measure_folder_list,
             receivers_list=receivers_list,
+            results=measure_results_list,
         )
 
         #
@@ -841,6 +789,11 @@ def compute_sofa(audio_recording=None, measures_list=None, yaml_params=None):
         # when doing the sofa rendering
         if yaml_params["zero_delay"] == False:
             sofa.Data_Delay = np.zeros((measures_M, receivers_R))
+        else:
+            # IRs will start a bit before the peak: delays of all the positions and receivers at once
+            sofa.Data_Delay = delay_estimator.offset_samples(
+                sofa.Data_Delay, sofa.Data_SamplingRate, _DIRECT_PATH_OFFSET_s
+            ).astype(np.float64)
 
         #
         # audio samples for each position
@@ -856,15 +809,42 @@ def compute_sofa(audio_recording=None, measures_list=None, yaml_params=None):
         # clear audio samples
         sofa.Data_IR = []
 
-        if max_pool_size > 1:
+        if ir_samples is not None:
             #
-            # PARALLEL DATA LOAD (multiprocess)
+            # LOADED DATA: the receivers of the selection cut from the IRs of all the receivers
             #
-            logger.info("audio samples: parallel data load (multiprocessing)")
+            logger.info("audio samples: selection of the loaded IR samples")
 
-            # sofa.Data_IR = shared_array(dtype=np.float64, shape=(measures_M, receivers_R, samples_ir_window))
+            sofa.Data_IR = select_ir_samples(
+                ir_samples,
+                sofa.Data_Delay,
+                measure_folder_list,
+                measure_results_list,
+                receivers_list=receivers_list,
+                zero_delay=bool(yaml_params["zero_delay"]),
+                samples_ir_window=samples_ir_window,
+                remove_direct_path=float(yaml_params["remove_direct_path"]),
+                samplerate=sofa.Data_SamplingRate,
+            )
 
-            sofa.Data_IR = np.zeros((measures_M, receivers_R, samples_ir_window))
+        elif max_pool_size > 1:
+            #
+            # PARALLEL DATA LOAD (multiprocess)
+            #
+            logger.info("audio samples: parallel data load (multiprocessing, shared memory)")
+
+            # the workers decode the IRs directly in the shared memory Data_IR (see shared_array)
+            shape = (measures_M, receivers_R, samples_ir_window)
+            mode = "process"
+            if shared_array.available(shape):
+                shared_ir = shared_array.SharedArray(shape)
+                sofa.Data_IR = shared_ir.array
+                target = shared_ir.handle()
+            else:
+                logger.warning("not enough shared memory for {} IR samples, thread pool load".format(shape))
+                mode = "thread"
+                sofa.Data_IR = np.zeros(shape)
+                target = sofa.Data_IR
 
             zero_delay = True
             if yaml_params["zero_delay"] == False:
@@ -880,17 +860,15 @@ def compute_sofa(audio_recording=None, measures_list=None, yaml_params=None):
                         receivers_list,
                         zero_delay,
                         samples_ir_window,
-                        sofa.Data_IR,
-                        sofa.Data_Delay,
+                        target,
+                        sofa.Data_Delay[i],
                         float(yaml_params["remove_direct_path"]),
                     )
                 )
 
-            cpu_pool = multiprocessing.pool.ThreadPool(processes=max_pool_size)
-            cpu_pool.map(read_ir_sample, cpu_pool_params)
-
-            cpu_pool.close()
-            cpu_pool.join()
+            job_scheduler.run_tasks(
+                read_ir_sample, cpu_pool_params, processes=max_pool_size, mode=mode, name="read_ir_sample"
+            )
 
         else:
             #
@@ -927,10 +905,16 @@ def compute_sofa(audio_recording=None, measures_list=None, yaml_params=None):
                 filepath = measure_folder_list[0].split(measure_config_ref["custom"]["audio_folder"])[0]
                 filename = measure_config_ref["custom"]["project_folder"] + "_" + fileappend + ".sofa"
 
+                # Data.IR chunks and filters (see sofa_stream)
+                layout = sofa_stream.layout_params(yaml_params, receivers_R)
+
                 try:
                     logger.info("compute sofa: file writing: {} ...".format(filename))
-                    sof.write_sofa(os.path.join(filepath, filename), sofa)
+                    sofa_stream.write_sofa(os.path.join(filepath, filename), sofa, **layout)
                     logger.info("compute sofa: output file done: {}".format(filepath + "/" + filename))
+                    if yaml_params.get("layout_report", False):
+                        report = sofa_stream.layout_report(os.path.join(filepath, filename))
+                        print("compute sofa: {}: {}".format(filename, sofa_stream.format_report(report)))
 
                 except:
                     err = -1
@@ -939,6 +923,11 @@ def compute_sofa(audio_recording=None, measures_list=None, yaml_params=None):
             err = -1
             print("exiting on user request, output sofa file skipped.\n")
 
+    # free the shared memory of the parallel data load
+    if shared_ir is not None:
+        sofa.Data_IR = []
+        shared_ir.release()
+
     return err
 
 
@@ -972,49 +961,14 @@ if __name__ == "__main__":
     # check if we just want to list devices and quit
     #
     if args1.list_folders:
-        measure_folder_list = []
-        measure_folder_list_subfolder_count = []
-        measure_folder_list_subfolder_format = []
-        # search for available config.yaml for audio measurement folders
-        configs = glob.glob("**/config.yaml", recursive=True)
-        # filter only valid folders
-        for config in configs:
-            if re.search("_xAngle/config.yaml", config):
-                # load config file
-                measure_config = {}
-                try:
-                    with open(config, "r") as file:
-                        measure_config = yaml.safe_load(file)
-                except:
-                    measure_config = None
-
-                if None != measure_config:
-                    # check syntax
-                    if measure_config["syntax"]["name"] == "audio_measure":
-                        # search for IR folder within results
-                        tmp = config.split("/")
-                        tmp = config.split(tmp[-1])
-                        if (os.path.exists(tmp[0] + "ir")) and (0 < len(glob.glob(tmp[0] + "ir/*.wav"))):
-                            # split pattern
-                            tmp = config.split("/")
-                            tmp = config.split(tmp[-2])
-                            if not (tmp[0] in measure_folder_list):
-                                measure_folder_list.append(tmp[0])
-                                measure_folder_list_subfolder_count.append(1)
-                                measure_folder_list_subfolder_format.append(measure_config["custom"]["recording"])
-                            measure_folder_list_subfolder_count[measure_folder_list.index(tmp[0])] += 1
+        # audio measure sessions below the current folder (see session_discovery)
+        measure_folder_list = session_discovery.list_sessions(".", require_ir=True)
 
         if len(measure_folder_list) > 0:
             print("listing available audio measure folders:")
             print("========================================")
-            for i in range(len(measure_folder_list)):
-                print(
-                    measure_folder_list[i]
-                    + ", "
-                    + str(measure_folder_list_subfolder_count[i])
-                    + ", "
-                    + str(measure_folder_list_subfolder_format[i])
-                )
+            for measure_folder, count, recording in measure_folder_list:
+                print(measure_folder + ", " + str(count) + ", " + str(recording))
         else:
             print("no audio measures found.")
         parser.exit(0)
@@ -1068,6 +1022,32 @@ if __name__ == "__main__":
             type=str,
             help="select receivers array",
         )
+        parser.add_argument(
+            "-ck",
+            "--chunks",
+            type=str,
+            help="Data.IR chunk of measurements[,receivers] (0: all receivers), i.e. 1 for random access",
+        )
+        parser.add_argument(
+            "-cl",
+            "--compression",
+            type=int,
+            help="zlib compression level, 0 (none) to 9",
+        )
+        parser.add_argument(
+            "-ns",
+            "--no_shuffle",
+            action="store_true",
+            default=None,
+            help="no shuffle filter on Data.IR",
+        )
+        parser.add_argument(
+            "-sz",
+            "--layout_report",
+            action="store_true",
+            default=None,
+            help="report file size and read time of one direction of the output file",
+        )
 
     #
     # no config, use defaults
@@ -1125,6 +1105,35 @@ if __name__ == "__main__":
             default="array_six,middle",
             help="select receiver array (default: %(default)s)",
         )
+        parser.add_argument(
+            "-ck",
+            "--chunks",
+            type=str,
+            default=None,
+            help="Data.IR chunk of measurements[,receivers] (0: all receivers), i.e. 1 for random access "
+            "(default: %(default)s, sofar layout)",
+        )
+        parser.add_argument(
+            "-cl",
+            "--compression",
+            type=int,
+            default=4,
+            help="zlib compression level, 0 (none) to 9 (default: %(default)s)",
+        )
+        parser.add_argument(
+            "-ns",
+            "--no_shuffle",
+            action="store_true",
+            default=False,
+            help="no shuffle filter on Data.IR (default: %(default)s)",
+        )
+        parser.add_argument(
+            "-sz",
+            "--layout_report",
+            action="store_true",
+            default=False,
+            help="report file size and read time of one direction of the output file (default: %(default)s)",
+        )
 
     parser.add_argument(
         "-v",
@@ -1212,6 +1221,11 @@ if __name__ == "__main__":
     if yaml_params["measure_folder"] == None:
         sys.exit("\n[ERROR] missing measure folder.")
 
+    try:
+        sofa_stream.layout_params(yaml_params, 1)
+    except ValueError as e:
+        sys.exit("\n[ERROR] {}".format(e))
+
     #
     # remove_direct_path must to be used with zero_delay
     #
@@ -1224,6 +1238,7 @@ if __name__ == "__main__":
 
     measure_folder_list = []
     measure_audio_config_list = []
+    measure_results_list = []
 
     #
     # walk the given folder and search for proper results
@@ -1233,84 +1248,57 @@ if __name__ == "__main__":
 
     logger.info("searching config.yaml: {}".format(yaml_params["measure_folder"]))
 
-    for f in os.walk(yaml_params["measure_folder"]):
-        if os.path.exists(os.path.join(str(f[0]), "config.yaml")):
-            audio_config = ""
-            try:
-                with open(os.path.join(str(f[0]), "config.yaml"), "r") as file:
-                    audio_config = yaml.safe_load(file)
-            except:
-                sys.exit("\n[ERROR] cannot open/parse yaml config file: {}".format(kwargs["ess_yaml_config"]))
+    # configs and compute_hrir results of the positions, parsed only if changed (see session_index)
+    index = session_index.SessionIndex(yaml_params["measure_folder"])
 
-            error_cnt = 0
+    for folder in session_discovery.position_folders(yaml_params["measure_folder"]):
+        audio_config = ""
+        try:
+            position = index.position(folder)
+            audio_config = position["config"]
+        except:
+            sys.exit("\n[ERROR] cannot open/parse yaml config file: {}".format(kwargs["ess_yaml_config"]))
 
-            # sanity check on consistent audio format
-            if audio_recording == None:
-                audio_recording = audio_config["custom"]["recording"]
-            else:
-                tmp = audio_config["custom"]["recording"]
-                if (
-                    (audio_recording["bit_depth"] != tmp["bit_depth"])
-                    or (audio_recording["format"] != tmp["format"])
-                    or (audio_recording["samplerate"] != tmp["samplerate"])
-                    or (audio_recording["subformat"] != tmp["subformat"])
-                    or (audio_recording["units"] != tmp["units"])
-                ):
-                    logger.error("inconsistent audio recording format on: {}".format(folder))
-                    error_cnt = error_cnt + 1
-
-            # add folder to the list of measures only if a valid config is found
-            try:
-                if not (audio_config["syntax"]["name"] == "audio_measure"):
-                    error_cnt = error_cnt + 1
-            except:
+        error_cnt = 0
+
+        # sanity check on consistent audio format
+        if audio_recording == None:
+            audio_recording = audio_config["custom"]["recording"]
+        else:
+            tmp = audio_config["custom"]["recording"]
+            if (
+                (audio_recording["bit_depth"] != tmp["bit_depth"])
+                or (audio_recording["format"] != tmp["format"])
+                or (audio_recording["samplerate"] != tmp["samplerate"])
+                or (audio_recording["subformat"] != tmp["subformat"])
+                or (audio_recording["units"] != tmp["units"])
+            ):
+                logger.error("inconsistent audio recording format on: {}".format(folder))
                 error_cnt = error_cnt + 1
 
-            if error_cnt == 0:
-                # add folder to the list of measures only if impulse_response folder is present
-                for rx in audio_config["setup"]["listeners"][0]["receivers"]:
-                    # check for "far" file
-                    ir_filename = (
-                        "sweep_0_IR_rx_"
-                        + str(rx)
-                        + "_trid_"
-                        + str(audio_config["setup"]["listeners"][0]["receivers"][rx]["track_id"])
-                        + ".far"
-                    )
-                    if os.path.exists(os.path.join(str(f[0]), "ir", ir_filename)):
-                        try:
-                            if os.stat(os.path.join(str(f[0]), "ir", ir_filename)) == 0:
-                                error_cnt = error_cnt + 1
-                        except:
-                            error_cnt = error_cnt + 1
-                    else:
-                        error_cnt = error_cnt + 1
-
-                    # check for "wav" file
-                    ir_filename = (
-                        "sweep_0_IR_rx_"
-                        + str(rx)
-                        + "_trid_"
-                        + str(audio_config["setup"]["listeners"][0]["receivers"][rx]["track_id"])
-                        + ".wav"
-                    )
-                    if os.path.exists(os.path.join(str(f[0]), "ir", ir_filename)):
-                        try:
-                            if os.stat(os.path.join(str(f[0]), "ir", ir_filename)) == 0:
-                                error_cnt = error_cnt + 1
-                        except:
-                            error_cnt = error_cnt + 1
-                    else:
-                        error_cnt = error_cnt + 1
+        # add folder to the list of measures only if a valid config is found
+        try:
+            if not (audio_config["syntax"]["name"] == "audio_measure"):
+                error_cnt = error_cnt + 1
+        except:
+            error_cnt = error_cnt + 1
+
+        # a results bundle, or the .far and .wav files of all the receivers (see session_index)
+        if error_cnt == 0 and not position["results"]["complete"]:
+            error_cnt = error_cnt + 1
+
+        # if everything is there ... add folder to the compute list
+        if error_cnt == 0:
+            measure_folder_list.append(folder)
+            measure_audio_config_list.append(audio_config)
+            measure_results_list.append(position["results"])
 
-            # if everything is there ... add folder to the compute list
-            if error_cnt == 0:
-                measure_folder_list.append(f[0])
-                measure_audio_config_list.append(audio_config)
+    index.save()
+    logger.info("session index: {}".format(index.report()))
 
     #
     # create SOFA object and fetch impulses
     #
     if len(measure_folder_list) > 0:
-        measures_list = zip(measure_folder_list, measure_audio_config_list)
+        measures_list = zip(measure_folder_list, measure_audio_config_list, measure_results_list)
         compute_sofa(audio_recording, measures_list, yaml_params)
@@ -2,12 +2,9 @@
 """Compute HRIR and save PYFAR/Wav format"""
 
 from __future__ import division
-import scipy.signal as sig
 
 import os
-import re
 import sys
-import glob
 import yaml
 import logging
 import argparse
@@ -18,11 +15,25 @@ import matplotlib.mlab as mlab
 
 import numpy as np
 import pyfar as pf
-import soundfile as sf
-import scipy.signal as sig
-from multiprocessing import Pool
 from setproctitle import setproctitle
 
+import track_reader
+import stream_deconvolver
+import sweep_align
+import sweep_average
+import sweep_sequence
+import reference_cache
+import hrir_manifest
+import ir_bundle
+import delay_estimator
+import result_writer
+import stage_timer
+import plot_hrir
+import job_scheduler
+import session_index
+import session_config
+import session_discovery
+
 logger = logging.getLogger(__name__)
 
 #
@@ -30,8 +41,46 @@ logger = logging.getLogger(__name__)
 #
 _PLOT_SAVE_GRAPH = 0  # 0:skip, 1:save, 2:show, 3:show&save plot
 _MIN_CPU_COUNT = 1  # we need at least one CPU for each compute process
-_MIN_MEM_GB = 2.0  # min amount of memory for each compute process
-_MAX_MEM_GB = 3.5  # max amount of memory for each compute process
+_MIN_MEM_GB = 1.0  # initial memory guess for each compute process (then measured, see job_scheduler)
+
+# processing version stored in the manifest: bump when outputs change for the same inputs
+_HRIR_PROCESSING_VERSION = 2
+
+# recompute measures even if the manifest says outputs are up to date
+_FORCE_RECOMPUTE = False
+
+# audio recordings are loaded (selected tracks only) with this precision
+_AUDIO_READ_DTYPE = np.float32
+
+# results format: "files" (.far/.wav/.yaml for each receiver), "bundle" (one npz for
+# each position with all the receivers, see ir_bundle) or "both"
+_OUTPUT_FORMATS = ["files", "bundle", "both"]
+_OUTPUT_FORMAT = "files"
+
+# deconvolution: "full" (one FFT over the whole recording, full length IRs) or "stream" (receivers
+# tracks read in blocks, only the IR window is computed: bounded memory, see stream_deconvolver)
+_DECONVOLUTIONS = ["full", "stream"]
+_DECONVOLUTION = "full"
+
+# streaming and interleaved sweeps: the stimulus impulse response (0 dBFS calibration) peaks one
+# sample before zero, at the end of the full length circular result (of the previous sweep slot):
+# the IR window is computed from this time (s) before
+_STREAM_CALIB_PRE_s = 0.01
+
+# repeated sweeps (sweep_0, sweep_1, ... see record_ess): aligned on their sweep head and averaged
+# into one recording before the deconvolution (see sweep_average), otherwise only audio_filename is used
+_AVERAGE_REPEATS = False
+
+# averaging: repeats with a residual (vs the median of all the repeats) above the median residual
+# by more than this value (dB) are rejected, None to keep all the repeats
+_REJECT_OUTLIERS_dB = None
+
+# per stage wall/CPU time and peak memory of each measure (JSON lines), None to disable
+_STAGE_LOG = None
+
+# reference sweeps, inverse filter envelopes and spectra are shared by all the
+# measures of a session: computed once per worker (optionally stored to disk)
+_REFERENCE_CACHE = reference_cache.ReferenceCache()
 
 # IR WINDOW FILTER, values in seconds
 _IR_WINDOW_FADEIN_s = 0.002
@@ -45,10 +94,8 @@ _IR_INFO_dbFS_CALIB = 2
 _IR_INFO_SAMPLERATE = 3
 
 #
-# fractional octave smoothing in pyfar is using many GB of RAM
-# use with discretion when running only few threads in parallel.
+# fractional octave smoothing of the raw (full length) IR for plots (see plot_hrir)
 _ENABLE_FRACTION_OCTAVE_SMOOTHING = False
-_MAX_SMOOTHING_MEM_GB = 60
 
 
 #
@@ -73,6 +120,26 @@ def int_or_str(text):
         return text
 
 
+def write_yaml(filename=None, data=None):
+    with open(filename, "w") as outfile:
+        yaml.dump(data, outfile, default_flow_style=False)
+
+
+def hrir_params():
+    """Processing params that change the compute_hrir outputs (see hrir_manifest)"""
+    return {
+        "version": _HRIR_PROCESSING_VERSION,
+        "dsp_delay": float(_DSP_AUDIO_DELAY),
+        "read_precision": np.dtype(_AUDIO_READ_DTYPE).name,
+        "ir_window_length_s": float(_IR_WINDOW_LENGTH_s),
+        "sound_speed": float(_SOUND_SPEED),
+        "output_format": _OUTPUT_FORMAT,
+        "deconvolution": _DECONVOLUTION,
+        "average_repeats": bool(_AVERAGE_REPEATS),
+        "reject_outliers_db": None if _REJECT_OUTLIERS_dB is None else float(_REJECT_OUTLIERS_dB),
+    }
+
+
 #
 # COMPUTE FUNCTIONS
 #
@@ -146,10 +213,162 @@ def compute_ess(
     return data
 
 
+#
+# deconvolve multiple audio tracks with the same inverse sweep
+#
+def deconvolve_tracks(data=None, tracks=None, inverse_sweep=None):
+    """Impulse responses for the selected tracks of data, one real-FFT pass.
+
+    The inverse sweep spectrum is computed only once and applied to all the tracks
+    (columns of data) at the same time. This is the same circular convolution done
+    by pyfar when multiplying two signals of the same length (fft_norm="none").
+
+    Returns an array with one impulse response per row: shape (len(tracks), samples)
+    """
+    samples = data.shape[0]
+
+    # inverse sweep spectrum, computed once for all the tracks
+    inverse_sweep_spectrum = np.fft.rfft(inverse_sweep, n=samples)
+
+    # 2-D real fft over the selected tracks: (frequency bins, tracks)
+    # note: audio data can be loaded as float32, the fft is always computed in double precision
+    tracks_spectrum = np.fft.rfft(data[:, tracks].astype(np.float64, copy=False), n=samples, axis=0)
+    tracks_spectrum *= inverse_sweep_spectrum[:, np.newaxis]
+    del inverse_sweep_spectrum
+
+    ir_tracks = np.fft.irfft(tracks_spectrum, n=samples, axis=0)
+    del tracks_spectrum
+
+    return np.ascontiguousarray(ir_tracks.T)
+
+
+def deconvolve_stream(stream=None, stimulus=None, inverse_sweep=None, end=0, length=0, repeat=1, step=0):
+    """First length samples of the impulse responses of the stimulus and of the stream tracks.
+
+    Same samples of deconvolve_tracks, with the inverse sweep not zero padded (end: last stimulus
+    sample + 1) and the tracks read block by block from stream (track_reader.TrackStream or
+    sweep_average.RepeatAverage, see stream_deconvolver): memory does not depend on the recording
+    length. The stimulus track is already in memory (with the dsp delay and fade-in corrections),
+    its impulse response is the first row. Interleaved sweeps (see sweep_sequence): the impulse
+    responses of the repeat sweeps, one every step samples, are averaged.
+
+    Returns an array with one impulse response per row: shape (1 + len(stream.tracks), length)
+    """
+    inverse_filter = stream_deconvolver.InverseFilter(inverse_sweep, length)
+
+    ir_tracks = None
+    for k in range(repeat):
+        ir_sweep = stream_deconvolver.deconvolve_window(
+            lambda start, stop: np.column_stack((stimulus[start:stop], stream.read(start, stop))),
+            len(stimulus),
+            end + k * step,
+            inverse_filter,
+        )
+        if ir_tracks is None:
+            ir_tracks = ir_sweep
+        else:
+            ir_tracks += ir_sweep
+
+    if repeat > 1:
+        ir_tracks /= repeat
+    return ir_tracks
+
+
+def prepare_repeats(filenames=None, tx_track_id=0, rx_track_ids=None, align=None, source_position_str=""):
+    """Align the repeated sweeps of a measure on their sweep head and reject the outliers.
+
+    align(data, samplerate): sweep head of the stimulus track data (see align_stimulus).
+    Returns (filenames, offsets, frames) of the repeats to average (see sweep_average.RepeatAverage),
+    the first recording is the time reference.
+    """
+    heads = sweep_average.align_repeats(filenames, tx_track_id, align, dtype=_AUDIO_READ_DTYPE)
+    offsets = [head - heads[0][0] for head, _ in heads]
+    frames = heads[0][1]
+    logger.info(
+        "compute hrir: source {}, {} repeats, sweep head offsets: {} (samples)".format(
+            source_position_str, len(filenames), offsets
+        )
+    )
+
+    if _REJECT_OUTLIERS_dB is None:
+        return filenames, offsets, frames
+
+    with sweep_average.RepeatAverage(filenames, rx_track_ids, offsets, frames, _AUDIO_READ_DTYPE) as average:
+        residuals = average.repeat_residuals()
+    kept = sweep_average.select_repeats(residuals, _REJECT_OUTLIERS_dB)
+
+    for r in range(len(filenames)):
+        logger.info(
+            "compute hrir: source {}, repeat {}, residual {:.1f} (dB){}".format(
+                source_position_str,
+                os.path.basename(filenames[r]),
+                10 * np.log10(max(residuals[r], 1e-30)),
+                "" if r in kept else ", REJECTED",
+            )
+        )
+    if len(kept) < len(filenames):
+        logger.warning(
+            "compute hrir: source {}, {} of {} repeats rejected as outliers".format(
+                source_position_str, len(filenames) - len(kept), len(filenames)
+            )
+        )
+
+    return [filenames[r] for r in kept], [offsets[r] for r in kept], frames
+
+
+def align_stimulus(data=None, samplerate=96000, f1=20, f2=20000, T=15, amplitude=0.8, padding_pre=0, interleave=0):
+    """Sweep head, tail and head sub-sample fraction of the recorded stimulus track (see sweep_align),
+    interleaved sweeps: of the first one"""
+    align_window = min(4, T)
+    stimulus_key = ("ess", f1, f2, T, samplerate, amplitude, align_window)
+    align_refs = [
+        _REFERENCE_CACHE.get(
+            (stimulus_key, tail),
+            lambda tail=tail: compute_ess(
+                frequency_begin=f1,
+                frequency_end=f2,
+                samplerate=samplerate,
+                duration=T,
+                amplitude=amplitude,
+                window=align_window,
+                tail=tail,
+            ),
+        )
+        for tail in [False, True]
+    ]
+
+    return sweep_align.align_sweep(
+        data=data,
+        head_reference=align_refs[0],
+        tail_reference=align_refs[1],
+        frequency_begin=f1,
+        frequency_end=f2,
+        duration=T,
+        window=align_window,
+        padding_pre=padding_pre,
+        samplerate=samplerate,
+        cache=_REFERENCE_CACHE,
+        key=stimulus_key,
+        interleave=interleave,
+    )
+
+
 #
 # Impulse Response
 #
 def compute_hrir(folder=None):
+    """compute the IRs of a measure folder: False on errors (logged), the job scheduler retries them"""
+    # stage timings (see stage_timer and tools/stage_report.py): a measure not completed (early
+    # return or exception) is recorded as failed
+    timer = stage_timer.StageTimer(_STAGE_LOG, folder=folder)
+    try:
+        return compute_hrir_measure(folder, timer)
+    finally:
+        timer.close("failed")
+
+
+def compute_hrir_measure(folder=None, timer=None):
+    """see compute_hrir: the stages are recorded by timer, closed by the caller if not completed"""
     logger.info("compute_hrir: {}".format(folder))
 
     #
@@ -157,11 +376,10 @@ def compute_hrir(folder=None):
     #
     config = ""
     try:
-        with open(os.path.join(str(folder), "config.yaml"), "r") as file:
-            config = yaml.safe_load(file)
+        config = session_config.read_config(os.path.join(str(folder), "config.yaml"))
     except:
         logger.error("compute hrir: invalid config in folder {}".format(folder))
-        return
+        return False
 
     # supported syntax version
     ver_mjr = config["syntax"]["version"]["major"]
@@ -170,7 +388,7 @@ def compute_hrir(folder=None):
     ver = ver_mjr + (ver_min / 10)
     if ver < 0.1:
         logger.error("compute_hrir: unsupported config syntax for {}".format(folder))
-        return
+        return False
 
     #
     # Read params from config
@@ -188,6 +406,9 @@ def compute_hrir(folder=None):
     f2 = config["custom"]["stimulus"]["sweep"]["frequency"]["end"]
     padding_pre = config["custom"]["stimulus"]["sweep"]["padding"]["pre"]["value"]
     padding_post = config["custom"]["stimulus"]["sweep"]["padding"]["post"]["value"]
+    amplitude = config["custom"]["stimulus"]["sweep"]["amplitude"]["value"]
+    repeat = config["custom"]["stimulus"]["sweep"].get("repeat", {}).get("value", 1)
+    interleave = config["custom"]["stimulus"]["sweep"].get("interleave", {}).get("value", 0)
     tx_track_id = config["setup"]["sources"][0]["emitters"][0]["track_id"]
     rx_track_num = config["setup"]["listeners"][0]["receivers_count"]
     rx_track_id = config["setup"]["listeners"][0]["receivers"][0]["track_id"]
@@ -204,10 +425,50 @@ def compute_hrir(folder=None):
                 source_position_str, folder, audio_format
             )
         )
-        return
+        return False
 
     logger.info("compute hrir: >>> source {}".format(source_position_str))
 
+    # recordings of the measure: audio_filename and, when averaging, its repeats found in the folder
+    # (interleaved sweeps: all the repeats are in audio_filename, see sweep_sequence)
+    audio_files = [audio_file + "." + audio_file_ext]
+    if _AVERAGE_REPEATS and interleave <= 0:
+        for name in sweep_average.repeat_filenames(audio_file, audio_file_ext, repeat)[1:]:
+            if os.path.exists(os.path.join(str(folder), name)):
+                audio_files.append(name)
+            else:
+                logger.warning("compute hrir: source {}, missing repeat: {}".format(source_position_str, name))
+
+    timer.source = source_position_str
+
+    #
+    # skip the measure if outputs are up to date with inputs and processing params
+    #
+    manifest_params = hrir_params()
+    try:
+        manifest_valid, manifest_reason, manifest_inputs = hrir_manifest.check_manifest(
+            folder, inputs=["config.yaml"] + audio_files, params=manifest_params
+        )
+    except OSError as e:
+        logger.error("compute hrir: source {}, cannot read inputs: {}".format(source_position_str, e))
+        return False
+
+    timer.lap("manifest")
+
+    if manifest_valid and not _FORCE_RECOMPUTE:
+        logger.info("compute hrir: <<< source: {} up to date, skipping.".format(source_position_str))
+        timer.close("skipped")
+        return
+
+    if manifest_valid:
+        manifest_reason = "forced"
+    logger.info("compute hrir: source {}, compute: {}".format(source_position_str, manifest_reason))
+    hrir_manifest.remove_manifest(folder)
+
+    # the sofa scripts read the position bundle first: drop the one of a previous run
+    if _OUTPUT_FORMAT == "files":
+        ir_bundle.remove_bundle(os.path.join(str(folder), "ir", ir_bundle.bundle_filename(audio_file)))
+
     # Load WAV file
     logger.info(
         "compute hrir: source "
@@ -220,10 +481,52 @@ def compute_hrir(folder=None):
         + audio_file_ext
     )
 
+    # read only the stimulus track and the receivers tracks (see config), all the other tracks
+    # of the recording are skipped. Columns of data follow the audio_tracks order.
+    # streaming deconvolution: only the stimulus track, receivers are read block by block later
+    rx_track_ids = list(session_config.track_ids(config))
+    audio_tracks = list(dict.fromkeys([tx_track_id] + rx_track_ids))
+    if _DECONVOLUTION == "stream":
+        audio_tracks = [tx_track_id]
+    track_col = {track: col for col, track in enumerate(audio_tracks)}
+    tx_col = track_col[tx_track_id]
+
+    audio_path = str(folder) + "/" + audio_file + "." + audio_file_ext
+    audio_offsets = None
     data = ""
-    data, samplerate = sf.read(str(folder) + "/" + audio_file + "." + audio_file_ext)
+    if len(audio_files) > 1:
+        # repeated sweeps: aligned on the sweep head of the first one and averaged block by block
+        audio_paths, audio_offsets, audio_frames = prepare_repeats(
+            [str(folder) + "/" + name for name in audio_files],
+            tx_track_id,
+            rx_track_ids,
+            lambda tx, rate: align_stimulus(tx, rate, f1, f2, T, amplitude, padding_pre)[0],
+            source_position_str,
+        )
+        timer.lap("repeats")
+
+        with sweep_average.RepeatAverage(
+            audio_paths, audio_tracks, audio_offsets, audio_frames, _AUDIO_READ_DTYPE
+        ) as average:
+            data = average.read_all()
+            samplerate = average.samplerate
+        logger.info(
+            "compute hrir: source {}, average of {} repeats".format(source_position_str, len(audio_paths))
+        )
+    else:
+        data, samplerate = track_reader.read_tracks(audio_path, tracks=audio_tracks, dtype=_AUDIO_READ_DTYPE)
     fs = samplerate
 
+    # interleaved sweeps: a sweep every interleave_step samples in the same recording
+    interleave_step = 0
+    if interleave > 0 and repeat > 1:
+        interleave_step = sweep_sequence.interleave_samples(interleave, samplerate)
+        logger.info(
+            "compute hrir: source {}, {} interleaved sweeps, one every {} (s)".format(
+                source_position_str, repeat, interleave
+            )
+        )
+
     samples = len(data)
 
     # add DSP delay to the TX track if needed
@@ -236,7 +539,9 @@ def compute_hrir(folder=None):
         offset = int(offset *2)
 
         # shift source track for dsp delay
-        data[offset:, tx_track_id] = data[:(samples-offset), tx_track_id]
+        data[offset:, tx_col] = data[:(samples-offset), tx_col]
+
+    timer.lap("read")
 
     logger.info("compute hrir: source " + source_position_str + ", Duration: " + str(len(data) / fs) + "(s)")
     logger.info(
@@ -249,21 +554,13 @@ def compute_hrir(folder=None):
 
 
     #
-    # correlate and compute padding-pre sweep / recording latency
+    # correlate and compute padding-pre/post sweep / recording latency
+    # (search only the lags allowed by paddings, coarse-to-fine)
     #
-    orig_sweep = compute_ess(
-        frequency_begin=f1,
-        frequency_end=f2,
-        samplerate=samplerate,
-        duration=T,
-        amplitude=config["custom"]["stimulus"]["sweep"]["amplitude"]["value"],
-        window=min(4, T),
-        tail=False,
+    xsweep_head, xsweep_tail, xsweep_head_fraction = align_stimulus(
+        data[:, tx_col], samplerate, f1, f2, T, amplitude, padding_pre, interleave if interleave_step > 0 else 0
     )
-
-    sweep_data_corr = sig.correlate(data[:, tx_track_id], orig_sweep)
-
-    xsweep_head = np.argmax(abs(sweep_data_corr)) - int(len(orig_sweep))
+    timer.lap("align")
 
     padding_pre_computed = xsweep_head
 
@@ -274,35 +571,25 @@ def compute_hrir(folder=None):
             )
         )
 
-    recording_latency_computed = np.argmax(abs(sweep_data_corr)) - int(len(orig_sweep) + padding_pre * samplerate)
-
-    #
-    # correlate and compute padding-post sweep
-    #
-    orig_sweep = compute_ess(
-        frequency_begin=f1,
-        frequency_end=f2,
-        samplerate=samplerate,
-        duration=T,
-        amplitude=config["custom"]["stimulus"]["sweep"]["amplitude"]["value"],
-        window=min(4, T),
-        tail=True,
-    )
-
-    sweep_data_corr = sig.correlate(data[:, tx_track_id], orig_sweep)
-
-    xsweep_tail = np.argmax(abs(sweep_data_corr))
+    recording_latency_computed = xsweep_head - int(padding_pre * samplerate)
 
     # sanity check: we need a valid duration
     if xsweep_tail <= xsweep_head:
-        logger.error("compute hrir: source {}, audio sweep invalid head/tail position. skipping hrir computation.")
-        return
+        logger.error(
+            "compute hrir: source {}, audio sweep invalid head/tail position. skipping hrir computation.".format(
+                source_position_str
+            )
+        )
+        return False
 
     padding_post_computed = samples - xsweep_tail
 
     logger.info(
-        "compute hrir: source {}, audio latency: {:3.3f} (ms) {} (samples)".format(
-            source_position_str, recording_latency_computed * 1000 / fs, recording_latency_computed
+        "compute hrir: source {}, audio latency: {:3.3f} (ms) {} (samples) {:+.3f} (sub-sample)".format(
+            source_position_str,
+            recording_latency_computed * 1000 / fs,
+            recording_latency_computed,
+            xsweep_head_fraction,
         )
     )
     logger.info(
@@ -329,10 +616,17 @@ def compute_hrir(folder=None):
     #
 
     # stimulus: this is the full signal
-    xsweep_full = data[:, tx_track_id]
+    xsweep_full = data[:, tx_col]
 
     # stimulus: remove loop-recording delay and paddings
-    xsweep = data[xsweep_head:xsweep_tail, tx_track_id]
+    xsweep = data[xsweep_head:xsweep_tail, tx_col]
+
+    # interleaved sweeps: the following sweeps overlap the recorded stimulus, keep only the first one
+    # (before the fade-in below: only the first sweep of the recording has it)
+    if interleave_step > 0:
+        xsweep = sweep_sequence.separate_sweep(
+            xsweep_full, xsweep_head, xsweep_tail - xsweep_head, repeat, interleave_step
+        )
 
     # WORKAROUND :  LINUX ALSA AUDIO CARD, anti pop FADE-IN BIAS correction
     if 1:
@@ -359,41 +653,129 @@ def compute_hrir(folder=None):
     #
 
     # compute timing range, sweep and total length
-    t_sweep = np.arange(0, T * fs) / fs
     t = np.arange(0, len(xsweep)) / fs
 
     # compute inverse ESS slew-rate
     R = np.log(f2 / f1)
 
     # compute inverse mirror filter (equalized)
-    k_sweep = np.exp(t_sweep * R / T)
+    # k_sweep only depends on the stimulus and on the recorded sweep length (samples)
+    k_sweep = _REFERENCE_CACHE.get(
+        ("k_sweep", f1, f2, fs, xsweep_tail - xsweep_head),
+        lambda: np.exp((np.arange(0, T * fs) / fs) * R / T),
+    )
     f = xsweep[::-1] / k_sweep
 
     # adding pre and post zero padding: note the signal is reversed as per A.Farina technique
-    # so first we add padding-post, then padding-pre
-    f = np.concatenate((np.zeros(padding_post_computed), f, np.zeros(padding_pre_computed)))
+    # so first we add padding-post, then padding-pre (the streaming deconvolution uses f as it is)
+    if _DECONVOLUTION == "full":
+        f = np.concatenate((np.zeros(padding_post_computed), f, np.zeros(padding_pre_computed)))
 
     # sanity check on filter length
-    if len(f) != len(xsweep_full):
+    if _DECONVOLUTION == "full" and len(f) != len(xsweep_full):
         logger.error(
             "compute hrir: source {}, ERROR: inverse sweep length is not the same as direct sweep lenth. id: {} track {}".format(
                 source_position_str, str(rx_id), str(rx_track_id)
             ),
         )
 
-    # pyfar: np.array to pyfar.signal class
-    d_xsweep = pf.Signal(data=xsweep_full, sampling_rate=fs)
-    i_xsweep = pf.Signal(data=f, sampling_rate=fs)
+    timer.lap("inverse_filter")
+
+    #
+    # compute IR (impulse response) with convolution in freq domain (fft)
+    #
+    # the inverse sweep is transformed only once and the stimulus track (used for calibration)
+    # plus all the receivers tracks are deconvolved together in one 2-D real-FFT pass
+    logger.info(
+        "compute hrir: source {}, STEP-01: compute impulse response for {} receivers".format(
+            source_position_str, rx_track_num
+        )
+    )
+
+    # IR window (see STEP-05): fade-in/out depending on the source distance
+    dyn_fade_s = (int((1000 * source_position[2] / _SOUND_SPEED) / 2) + 1) / 1000
+    ir_window_samples = min(samples, int(np.ceil((_IR_WINDOW_LENGTH_s + 2 * dyn_fade_s) * fs)) + 1)
+
+    # interleaved sweeps: the IR window (and the calibration samples) must fit between two sweeps
+    if interleave_step > 0:
+        if interleave_step < int(_STREAM_CALIB_PRE_s * fs) + ir_window_samples:
+            logger.error(
+                "compute hrir: source {}, interleave {} (s) shorter than the IR window, skipping.".format(
+                    source_position_str, interleave
+                )
+            )
+            return False
+        if interleave < sweep_sequence.min_interleave(f1, f2, T, _IR_WINDOW_LENGTH_s):
+            logger.warning(
+                "compute hrir: source {}, interleave {} (s): harmonics of the next sweep in the IR window".format(
+                    source_position_str, interleave
+                )
+            )
+
+    if _DECONVOLUTION == "stream":
+        # only the IR window (plus the calibration samples before it), receivers tracks read in blocks
+        ir_start = min(int(_STREAM_CALIB_PRE_s * fs), samples - ir_window_samples)
+        if audio_offsets is not None:
+            stream = sweep_average.RepeatAverage(
+                audio_paths, rx_track_ids, audio_offsets, audio_frames, _AUDIO_READ_DTYPE
+            )
+        else:
+            stream = track_reader.TrackStream(audio_path, tracks=rx_track_ids, dtype=_AUDIO_READ_DTYPE)
+        with stream:
+            ir_tracks = deconvolve_stream(
+                stream=stream,
+                stimulus=data[:, tx_col],
+                inverse_sweep=f,
+                end=xsweep_tail - ir_start,
+                length=ir_start + ir_window_samples,
+                repeat=repeat if interleave_step > 0 else 1,
+                step=interleave_step,
+            )
+    else:
+        ir_start = 0
+        ir_tracks = deconvolve_tracks(
+            data=data, tracks=[tx_col] + [track_col[track] for track in rx_track_ids], inverse_sweep=f
+        )
+        if interleave_step > 0:
+            # one impulse response every interleave_step samples: separated (with the calibration
+            # samples before each one) and averaged
+            ir_start = int(_STREAM_CALIB_PRE_s * fs)
+            ir_tracks = sweep_sequence.average_slots(ir_tracks, interleave_step, repeat, ir_start, interleave_step)
 
     # impulse response calibration for 0dB
-    ir = d_xsweep * i_xsweep
+    dbFS_calib = 2.38 * np.max(np.abs(ir_tracks[0]))
 
-    dbFS_calib = 2.38 * np.max(np.abs(ir.time))
+    # 0dbFS calibration: retrieve 0 dBFS level from reference sweep amplitude
+    ir_rx = ir_tracks[1:, ir_start:]
+    ir_rx *= 1 / dbFS_calib
+    timer.lap("STEP-01 deconvolve")
+
+    # compute IR delay
+    #
+    # using pyfar is actually slower...
+    # ir_delay= pf.dsp.find_impulse_response_delay(ir)
+    #
+    # so going with max correlation in time,
+    # since we know the distance we keep a "SAFETY SEARCH WINDOW" in case
+    # we have a non ideal recording environment: the first DIRECT reflection
+    # is travelling at the sound speed, we keep twice the distance
+    distance_sound_delay = 2 * (source_position[2] / _SOUND_SPEED)
+
+    # peak sample of each receiver and its sub-sample (sinc interpolated) position
+    ir_rx_delay_samples, ir_rx_delay_exact = delay_estimator.peak_delays(
+        ir_rx, search=int(distance_sound_delay * fs)
+    )
+    timer.lap("STEP-02 delay")
 
     #
     # DEBUG ONLY: verify impulse response for ess sweep signal
     #             we want delay=0 and amplitude=0dbFS
     if 0:
+        # pyfar: np.array to pyfar.signal class
+        d_xsweep = pf.Signal(data=xsweep_full, sampling_rate=fs)
+        i_xsweep = pf.Signal(data=f, sampling_rate=fs)
+        ir = d_xsweep * i_xsweep
+
         plt.figure()
         ax = pf.plot.time_freq(ir, dB_time=True, color=[0.6, 0.6, 0.6], label="ir raw", log_reference=1)
         pf.plot.time_freq(d_xsweep, dB_time=True, label="ess", log_reference=1)
@@ -414,335 +796,228 @@ def compute_hrir(folder=None):
         ax[0].set_title("Measured IR and TF, source: {}, CALIB={}".format(source_position_str, str(dbFS_calib)))
         plt.show()
 
-    #
-    # loop over all the single-listener / multiple-receivers audio tracks
-    #
-    for rx_id in np.arange(rx_track_num):
-        logger.info(
-            "compute hrir: source {}, rx {}, STEP-00: analyze receiver id: {} track {}".format(
-                source_position_str, str(rx_id), str(rx_id), str(rx_track_id)
-            ),
-        )
+    # output files (in ir/ subfolder) recorded in the manifest
+    ir_outputs = []
 
-        # get the listener corrispondent audio track
-        rx_track_id = config["setup"]["listeners"][0]["receivers"][rx_id]["track_id"]
-
-        # this is the measured audio data in response to the ess stimulus
-        x = data[:, rx_track_id]
-
-        if _PLOT_SAVE_GRAPH:
-            # separate plots in a subfolder
-            plot_path = str(folder) + "/plots/"
-            plot_path_pdf = str(folder) + "/plots/pdf/"
-            plot_path_png = str(folder) + "/plots/png/"
-            if not os.path.exists(plot_path):
-                os.makedirs(plot_path)
-            if not os.path.exists(plot_path_png):
-                os.makedirs(plot_path_png)
-            if not os.path.exists(plot_path_pdf):
-                os.makedirs(plot_path_pdf)
-
-            plt.rcParams["figure.figsize"] = [16, 9]
-            plt.figure()
-            plt.clf()
-            plt.subplot(2, 1, 2)
-            ax = plt.plot(x)
-            plt.grid()
-            plt.title("recorded_y(t), source {}".format(source_position_str))
-
-            plt.subplot(2, 1, 1)
-            ax = plt.plot(xsweep_full)
-            plt.grid()
-            plt.title("ess_sweep(t), source {}".format(source_position_str))
-
-            # save / show plot
-            if _PLOT_SAVE_GRAPH & 0x02:
-                plt.show()
-            if _PLOT_SAVE_GRAPH & 0x01:
-                plot_filename = "{}_xy_rx_{}_trid_{}.pdf".format(audio_file, str(rx_id), str(rx_track_id))
-                plt.savefig(plot_path_pdf + plot_filename, dpi=300)
-                plot_filename = "{}_xy_rx_{}_trid_{}.png".format(audio_file, str(rx_id), str(rx_track_id))
-                plt.savefig(plot_path_png + plot_filename, dpi=300)
-            plt.close()
+    # results are written in background while the next receivers are computed
+    with result_writer.ResultWriter(name="compute_hrir_writer") as writer:
+        # results of all the receivers, for the position bundle
+        bundle = {"rx_ids": [], "track_ids": [], "ir": [], "ir_norm_hipass_window": [], "ir_info": []}
 
         #
-        # compute IR (impulse response) with convolution in freq domain (fft)
-        #
-        logger.info(
-            "compute hrir: source {}, rx {}, STEP-01: compute impulse response".format(source_position_str, str(rx_id))
-        )
+        # loop over all the single-listener / multiple-receivers audio tracks
         #
-        # IMPORTANT NOTE: the recording setup is equalized so that all the channels will have the same level recorded at
-        #                 the same pressure level. See the section "calibration" of the config.yaml file for each
-        #                 receiver and emitter. This is a critical step for a proper audio normalization
+        for rx_id in np.arange(rx_track_num):
+            logger.info(
+                "compute hrir: source {}, rx {}, STEP-00: analyze receiver id: {} track {}".format(
+                    source_position_str, str(rx_id), str(rx_id), str(rx_track_id)
+                ),
+            )
 
-        # ToDo: equalize signal amplitude if the config file shows different calibration levels for emitters and receivers
-        #       read calibration from config, convert dB to Linear, compute new amplitude
+            # get the listener corrispondent audio track
+            rx_track_id = rx_track_ids[rx_id]
 
-        # see config file for emitters and receivers at:
-        #
-        # calibration:
-        #     whitenoise:
-        #       spl_1m_dbA_slow: 60
-        #       wav_peak_level: 0.8
-        #     sine-1khz:
-        #       spl_1m_dbA_slow: 60
-        #       wav_peak_level: 0.8
+            # this is the measured audio data in response to the ess stimulus (not loaded when streaming)
+            x = data[:, track_col[rx_track_id]] if rx_track_id in track_col else None
 
-        # pyfar: np.array to pyfar.signal class
-        x_rec = pf.Signal(data=x, sampling_rate=fs)
+            #
+            # IMPORTANT NOTE: the recording setup is equalized so that all the channels will have the same level recorded at
+            #                 the same pressure level. See the section "calibration" of the config.yaml file for each
+            #                 receiver and emitter. This is a critical step for a proper audio normalization
 
-        logger.info(
-            "compute hrir: source {}, rx {}, STEP-02a: compute IR signal (pyfar)".format(
-                source_position_str, str(rx_id)
-            )
-        )
+            # ToDo: equalize signal amplitude if the config file shows different calibration levels for emitters and receivers
+            #       read calibration from config, convert dB to Linear, compute new amplitude
 
-        #
-        # IR by convolution (FFT multiply)
-        ir = x_rec * i_xsweep
+            # see config file for emitters and receivers at:
+            #
+            # calibration:
+            #     whitenoise:
+            #       spl_1m_dbA_slow: 60
+            #       wav_peak_level: 0.8
+            #     sine-1khz:
+            #       spl_1m_dbA_slow: 60
+            #       wav_peak_level: 0.8
 
-        # 0dbFS calibration: retrieve 0 dBFS level from reference sweep amplitude
-        ir = pf.multiply((ir, 1 / dbFS_calib), domain="time")
+            logger.info(
+                "compute hrir: source {}, rx {}, STEP-02a: IR signal from batched deconvolution".format(
+                    source_position_str, str(rx_id)
+                )
+            )
 
-        # compute IR delay
+            # pyfar: np.array to pyfar.signal class, IR is already calibrated to 0dbFS
+            ir = pf.Signal(data=ir_rx[rx_id], sampling_rate=fs)
 
-        # using pyfar is actually slower...
-        # ir_delay= pf.dsp.find_impulse_response_delay(ir)
+            ir_delay_samples = ir_rx_delay_samples[rx_id]
 
-        # so going with max correlation in time,
-        # since we know the distance we keep a "SAFETY SEARCH WINDOW" in case
-        # we have a non ideal recording environment: the first DIRECT reflection
-        # is travelling at the sound speed, we keep twice the distance
+            # ir_delay = np.argmax(np.abs(ir.time)) / fs
+            # ir_delay = ir_delay_samples / fs
+            ir_delay = ir_rx_delay_exact[rx_id] / fs
 
-        distance_sound_delay = 2 * (source_position[2] / _SOUND_SPEED)
+            logger.info(
+                "compute hrir: source {}, rx {}, STEP-02b: IR delay={} [ms]".format(
+                    source_position_str, str(rx_id), (ir_delay * 1000)
+                )
+            )
 
-        # ir_delay_samples = np.argmax( np.abs( ir.time ) )
-        ir_delay_samples = np.argmax(np.abs(ir.time[:, : int(distance_sound_delay * fs)]))
+            # normalize in comparison to the recorded signal amplitude
+            logger.info(
+                "compute hrir: source {}, rx {}, STEP-03: normalize IR signal to {}".format(
+                    source_position_str, str(rx_id), dbFS_calib
+                )
+            )
 
-        # ir_delay = np.argmax(np.abs(ir.time)) / fs
-        ir_delay = ir_delay_samples / fs
+            # ToDo: still need the amplited eq above, so copy as-is
+            ir_norm = ir
 
-        logger.info(
-            "compute hrir: source {}, rx {}, STEP-02b: IR delay={} [ms]".format(
-                source_position_str, str(rx_id), (ir_delay * 1000)
+            #
+            # compute cropped IR (window)
+            #
+            logger.info(
+                "compute hrir: source {}, rx {}, STEP-05: post-process IR signal, high-pass & window".format(
+                    source_position_str, str(rx_id)
+                )
             )
-        )
 
-        # normalize in comparison to the recorded signal amplitude
-        logger.info(
-            "compute hrir: source {}, rx {}, STEP-03: normalize IR signal to {}".format(
-                source_position_str, str(rx_id), dbFS_calib
+            # apply high-pass (8th order) at 20Hz to reject out of band noise
+            ir_norm_hipass = pf.dsp.filter.butterworth(ir_norm, 8, f1, "highpass")
+
+            # apply window to reduce impulse response length (dyn_fade_s: see STEP-01)
+            # ir_norm_hipass_window = pf.dsp.time_window(
+            #     ir_norm_hipass,
+            #     [0, _IR_WINDOW_FADEIN_s, _IR_WINDOW_LENGTH_s, (_IR_WINDOW_LENGTH_s + _IR_WINDOW_FADEOUT_s)],
+            #     unit="s",
+            #     crop="window",
+            # )
+
+            ir_norm_hipass_window = pf.dsp.time_window(
+                ir_norm_hipass,
+                [0, dyn_fade_s, _IR_WINDOW_LENGTH_s, (_IR_WINDOW_LENGTH_s + 2 * dyn_fade_s)],
+                unit="s",
+                crop="window",
             )
-        )
+            timer.lap("STEP-05 filter_window", rx=rx_id)
+
+            # separate results in a subfolder
+            ir_path = str(folder) + "/ir/"
+            if not os.path.exists(ir_path):
+                os.makedirs(ir_path)
 
-        # ToDo: still need the amplited eq above, so copy as-is
-        ir_norm = ir
+            ir_info = np.array([ir_delay, ir_delay_samples, dbFS_calib, samplerate])
 
-        if _PLOT_SAVE_GRAPH:
-            if _ENABLE_FRACTION_OCTAVE_SMOOTHING:
-                # impulse response, smoothed 1/6 octave band
+            if _OUTPUT_FORMAT in ("bundle", "both"):
+                bundle["rx_ids"].append(rx_id)
+                bundle["track_ids"].append(rx_track_id)
+                bundle["ir"].append(ir)
+                bundle["ir_norm_hipass_window"].append(ir_norm_hipass_window)
+                bundle["ir_info"].append(ir_info)
 
-                # NOTE: since "smooth_fractiona_octave" is allocating 6G of ram we use it ONLY for plots
-                #       enabling this will decrease the number of parallel computations based on the number of cores and
-                #       available memory of the system
-                # see: https://pyfar.readthedocs.io/en/stable/modules/pyfar.dsp.html#pyfar.dsp.smooth_fractional_octave
+            # For the purpose of reproducibility save intermediate results in a compressed file format.
+            # pyfar uses its own far format, which saves data in zip format.
+            if _OUTPUT_FORMAT in ("files", "both"):
                 logger.info(
-                    "compute hrir: source {}, rx {}, STEP-04: post-process IR signal, smooth 1/6th octave".format(
-                        source_position_str, str(rx_id)
+                    "compute hrir: source {}, rx {}, STEP-06: save results for receiver: {}".format(
+                        source_position_str, str(rx_id), rx_id
                     )
                 )
-                ir_norm_smooth, _ = pf.dsp.smooth_fractional_octave(
-                    ir_norm, num_fractions=6, mode="magnitude_zerophase"
-                )
-
-        #
-        # compute cropped IR (window)
-        #
-        logger.info(
-            "compute hrir: source {}, rx {}, STEP-05: post-process IR signal, high-pass & window".format(
-                source_position_str, str(rx_id)
-            )
-        )
 
-        # apply high-pass (8th order) at 20Hz to reject out of band noise
-        ir_norm_hipass = pf.dsp.filter.butterworth(ir_norm, 8, f1, "highpass")
+                ir_filename = "{}_IR_rx_{}_trid_{}.far".format(audio_file, str(rx_id), str(rx_track_id))
 
-        # apply window to reduce impulse response length
-        dyn_fade_s = (int((1000 * source_position[2] / _SOUND_SPEED) / 2) + 1) / 1000
+                writer.submit(
+                    ir_path + ir_filename,
+                    pf.io.write,
+                    ir_path + ir_filename,
+                    compressed=True,
+                    ir=ir,
+                    ir_norm_hipass_window=ir_norm_hipass_window,
+                    ir_info=ir_info,
+                )
+                ir_outputs.append(ir_filename)
+                timer.lap("STEP-06 save_far", rx=rx_id)
 
-        # ir_norm_hipass_window = pf.dsp.time_window(
-        #     ir_norm_hipass,
-        #     [0, _IR_WINDOW_FADEIN_s, _IR_WINDOW_LENGTH_s, (_IR_WINDOW_LENGTH_s + _IR_WINDOW_FADEOUT_s)],
-        #     unit="s",
-        #     crop="window",
-        # )
+                logger.info(
+                    "compute hrir: source {}, rx {}, STEP-07: save IR in wav format for receiver: {}".format(
+                        source_position_str, str(rx_id), rx_id
+                    )
+                )
 
-        ir_norm_hipass_window = pf.dsp.time_window(
-            ir_norm_hipass,
-            [0, dyn_fade_s, _IR_WINDOW_LENGTH_s, (_IR_WINDOW_LENGTH_s + 2 * dyn_fade_s)],
-            unit="s",
-            crop="window",
-        )
+                #
+                # For the final result, saving also in .WAV
+                #
 
-        # apply smoothing for 1/6 octave band
-        ir_norm_hipass_window_smooth, _ = pf.dsp.smooth_fractional_octave(
-            ir_norm_hipass_window, num_fractions=6, mode="magnitude_zerophase"
-        )
+                # NOTE: audio wav files have max amplitude of -1/+1, which is 0dbFS,
+                #       do we need to adjust for real/measured 0dbFS ?
+                ir_filename = "{}_IR_rx_{}_trid_{}.wav".format(audio_file, str(rx_id), str(rx_track_id))
+                writer.submit(ir_path + ir_filename, pf.io.write_audio, ir, ir_path + ir_filename, "DOUBLE")
+                ir_outputs.append(ir_filename)
 
-        if _PLOT_SAVE_GRAPH:
-            # separate plots in a subfolder
-            plot_path = str(folder) + "/plots/"
-            plot_path_pdf = str(folder) + "/plots/pdf/"
-            plot_path_png = str(folder) + "/plots/png/"
-            if not os.path.exists(plot_path):
-                os.makedirs(plot_path)
-            if not os.path.exists(plot_path_png):
-                os.makedirs(plot_path_png)
-            if not os.path.exists(plot_path_pdf):
-                os.makedirs(plot_path_pdf)
-
-            # NOTE: since IR has been calibrated to 0dB from the d_xsweep and i_xsweep, all the plots
-            #       can be done using log_reference=1 for 0dB level.
-
-            if 1:
-                plt.rcParams["figure.figsize"] = [16, 9]
-                plt.figure()
-                ax = pf.plot.time_freq(ir, dB_time=True, color=[0.6, 0.6, 0.6], label="raw", log_reference=1)
-                pf.plot.time_freq(ir_norm_hipass_window, dB_time=True, label="post-processed", log_reference=1)
-                ax[0].set_xlim(0, 0.8)
-                ax[0].set_ylim(-140, 0)
-                ax[1].legend(loc="lower left")
-                ax[0].set_title(
-                    "Measured IR and TF, source: {}, listener_rx: {}, track_id: {}".format(
-                        source_position_str, str(rx_id), str(rx_track_id)
-                    )
-                )
-                # save / show plot
-                if _PLOT_SAVE_GRAPH & 0x02:
-                    plt.show()
-                if _PLOT_SAVE_GRAPH & 0x01:
-                    plot_filename = "{}_ir_tf_rx_{}_trid_{}.pdf".format(audio_file, str(rx_id), str(rx_track_id))
-                    plt.savefig(plot_path_pdf + plot_filename, dpi=300)
-                    plot_filename = "{}_ir_tf_rx_{}_trid_{}.png".format(audio_file, str(rx_id), str(rx_track_id))
-                    plt.savefig(plot_path_png + plot_filename, dpi=300)
-                # cleanup
-                plt.close()
-
-            if 1:
-                plt.rcParams["figure.figsize"] = [16, 9]
-                plt.figure()
-                ax = pf.plot.freq(ir, dB=True, label="Original HRTF", color="grey", log_reference=1)
-                if _ENABLE_FRACTION_OCTAVE_SMOOTHING:
-                    pf.plot.freq(
-                        ir_norm_smooth,
-                        dB=True,
-                        label="Original (1/6th octave) HRTF",
-                        color="blue",
-                        log_reference=1,
-                    )
-                pf.plot.freq(
-                    ir_norm_hipass_window_smooth,
-                    dB=True,
-                    label="Filtered HRTF (hipass, crop, smooth)",
-                    color="red",
-                    log_reference=1,
+                ir_filename = "{}_IR-filtered_rx_{}_trid_{}.wav".format(audio_file, str(rx_id), str(rx_track_id))
+                writer.submit(
+                    ir_path + ir_filename, pf.io.write_audio, ir_norm_hipass_window, ir_path + ir_filename, "DOUBLE"
                 )
-                ax.set_title(
-                    "Measured TF, source: {}, listener_rx: {}, track_id: {}".format(
-                        source_position_str, str(rx_id), str(rx_track_id)
+                ir_outputs.append(ir_filename)
+
+                # for easier documentation write result also in yaml file
+                ir_results = {
+                    "syntax": {"name": "ir_results", "version": {"major": 0, "minor": 1, "revision": 0}},
+                    "ir_delay": str(ir_delay),
+                    "ir_delay_samples": str(ir_delay_samples),
+                    "dbFS_calib": str(dbFS_calib),
+                    "ir_samples": str(ir.n_samples),
+                    "ir_norm_hipass_window_samples": str(ir_norm_hipass_window.n_samples),
+                    "samplerate": str(samplerate),
+                }
+                yaml_filename = "{}_IR_rx_{}_trid_{}.yaml".format(audio_file, str(rx_id), str(rx_track_id))
+                writer.submit(ir_path + yaml_filename, write_yaml, ir_path + yaml_filename, ir_results)
+                ir_outputs.append(yaml_filename)
+                timer.lap("STEP-07 save_wav", rx=rx_id)
+
+                #
+                # DEBUG: convolve to check result from the same input signal
+                #
+                if 0:
+                    d_xsweep = pf.Signal(data=xsweep_full, sampling_rate=fs)
+                    x_rec = pf.Signal(data=x, sampling_rate=fs)
+                    test_output = d_xsweep * pf.dsp.pad_zeros(
+                        ir_norm_hipass_window, (d_xsweep.n_samples - ir_norm_hipass_window.n_samples)
                     )
-                )
-                ax.legend()
-                # save / show plot
-                if _PLOT_SAVE_GRAPH & 0x02:
+                    plt.figure()
+                    # pf.plot.time_freq(test_output, label="check result", color="red", log_reference=dbFS_calib)
+                    pf.plot.time(test_output, label="ess*ir", color="red")
+                    pf.plot.time(x_rec, label="reference", color="blue")
                     plt.show()
-                if _PLOT_SAVE_GRAPH & 0x01:
-                    plot_filename = "{}_tfs_rx_{}_trid_{}.pdf".format(audio_file, str(rx_id), str(rx_track_id))
-                    plt.savefig(plot_path_pdf + plot_filename, dpi=300)
-                    plot_filename = "{}_tfs_rx_{}_trid_{}.png".format(audio_file, str(rx_id), str(rx_track_id))
-                    plt.savefig(plot_path_png + plot_filename, dpi=300)
-                # cleanup
-                plt.close()
-
-        # For the purpose of reproducibility save intermediate results in a compressed file format.
-        # pyfar uses its own far format, which saves data in zip format.
-        if 1:
-            logger.info(
-                "compute hrir: source {}, rx {}, STEP-06: save results for receiver: {}".format(
-                    source_position_str, str(rx_id), rx_id
-                )
-            )
-
-            # separate plots in a subfolder
-            ir_path = str(folder) + "/ir/"
-            if not os.path.exists(ir_path):
-                os.makedirs(ir_path)
-
-            ir_filename = "{}_IR_rx_{}_trid_{}.far".format(audio_file, str(rx_id), str(rx_track_id))
-
-            ir_info = np.array([ir_delay, ir_delay_samples, dbFS_calib, samplerate])
-
-            pf.io.write(
-                ir_path + ir_filename,
-                compressed=True,
-                ir=ir,
-                ir_norm_hipass_window=ir_norm_hipass_window,
-                ir_info=ir_info,
-            )
 
+        #
+        # single file with the results of all the receivers
+        #
+        if len(bundle["rx_ids"]) > 0:
             logger.info(
-                "compute hrir: source {}, rx {}, STEP-07: save IR in wav format for receiver: {}".format(
-                    source_position_str, str(rx_id), rx_id
+                "compute hrir: source {}, STEP-08: save results bundle for {} receivers".format(
+                    source_position_str, len(bundle["rx_ids"])
                 )
             )
+            ir_filename = str(folder) + "/ir/" + ir_bundle.bundle_filename(audio_file)
+            writer.submit(ir_filename, ir_bundle.write_bundle, ir_filename, **bundle)
+            ir_outputs.append(ir_bundle.bundle_filename(audio_file))
+            timer.lap("STEP-08 save_bundle")
 
-            #
-            # For the final result, saving also in .WAV
-            #
-
-            # NOTE: audio wav files have max amplitude of -1/+1, which is 0dbFS,
-            #       do we need to adjust for real/measured 0dbFS ?
-            ir_filename = "{}_IR_rx_{}_trid_{}.wav".format(audio_file, str(rx_id), str(rx_track_id))
-            pf.io.write_audio(ir, ir_path + ir_filename, "DOUBLE")
-
-            ir_filename = "{}_IR-filtered_rx_{}_trid_{}.wav".format(audio_file, str(rx_id), str(rx_track_id))
-            pf.io.write_audio(ir_norm_hipass_window, ir_path + ir_filename, "DOUBLE")
-
-            # for easier documentation write result also in yaml file
-            ir_results = {
-                "syntax": {"name": "ir_results", "version": {"major": 0, "minor": 1, "revision": 0}},
-                "ir_delay": str(ir_delay),
-                "ir_delay_samples": str(ir_delay_samples),
-                "dbFS_calib": str(dbFS_calib),
-                "ir_samples": str(ir.n_samples),
-                "ir_norm_hipass_window_samples": str(ir_norm_hipass_window.n_samples),
-                "samplerate": str(samplerate),
-            }
-            yaml_filename = "{}_IR_rx_{}_trid_{}.yaml".format(audio_file, str(rx_id), str(rx_track_id))
-            try:
-                with open(ir_path + yaml_filename, "w") as outfile:
-                    yaml.dump(ir_results, outfile, default_flow_style=False)
-            except:
-                logger.error(
-                    "compute hrir: source {}, rx {}, ERROR saving YAML results for receiver: {}".format(
-                        source_position_str, str(rx_id), rx_id
-                    )
-                )
+        #
+        # wait for the background writes, flushed and fsynced: a write error fails
+        # this measure (no manifest, see job_scheduler retries)
+        #
+        try:
+            writer.close()
+        except result_writer.ResultWriterError as e:
+            logger.error("compute hrir: source {}, ERROR saving results: {}".format(source_position_str, e))
+            raise
+    timer.lap("writer_flush")
 
-            #
-            # DEBUG: convolve to check result from the same input signal
-            #
-            if 0:
-                test_output = d_xsweep * pf.dsp.pad_zeros(
-                    ir_norm_hipass_window, (d_xsweep.n_samples - ir_norm_hipass_window.n_samples)
-                )
-                plt.figure()
-                # pf.plot.time_freq(test_output, label="check result", color="red", log_reference=dbFS_calib)
-                pf.plot.time(test_output, label="ess*ir", color="red")
-                pf.plot.time(x_rec, label="reference", color="blue")
-                plt.show()
+    logger.info(
+        "compute hrir: source {}, reference cache: {}".format(source_position_str, _REFERENCE_CACHE.stats())
+    )
 
+    # all outputs written: next runs can skip this measure
+    hrir_manifest.write_manifest(folder, inputs=manifest_inputs, params=manifest_params, outputs=ir_outputs)
+    timer.close("total")
     logger.info("compute hrir: <<< source: " + source_position_str + " done.")
 
 
@@ -770,48 +1045,16 @@ if __name__ == "__main__":
     # check if we just want to list devices and quit
     #
     if args1.list_folders:
-        measure_folder_list = []
-        measure_folder_list_subfolder_count = []
-        measure_folder_list_subfolder_format = []
-        # search for available config.yaml for audio measurement folders
-        configs = glob.glob("**/config.yaml", recursive=True)
-        # filter only valid folders
-        for config in configs:
-            if re.search("_xAngle/config.yaml", config):
-                # load config file
-                measure_config = {}
-                try:
-                    with open(config, "r") as file:
-                        measure_config = yaml.safe_load(file)
-                except:
-                    measure_config = None
-
-                if None != measure_config:
-                    # check syntax
-                    if measure_config["syntax"]["name"] == "audio_measure":
-                        # split pattern
-                        tmp = config.split("/")
-                        tmp = config.split(tmp[-2])
-                        if not (tmp[0] in measure_folder_list):
-                            measure_folder_list.append(tmp[0])
-                            measure_folder_list_subfolder_count.append(1)
-                            measure_folder_list_subfolder_format.append(measure_config["custom"]["recording"])
-                        measure_folder_list_subfolder_count[measure_folder_list.index(tmp[0])] += 1
+        # audio measure sessions below the current folder (see session_discovery)
+        measure_folder_list = session_discovery.list_sessions(".", require_ir=False)
 
         if len(measure_folder_list) > 0:
             print("listing available audio measure folders:")
             print("========================================")
-            for i in range(len(measure_folder_list)):
-                print(
-                    measure_folder_list[i]
-                    + ", "
-                    + str(measure_folder_list_subfolder_count[i])
-                    + ", "
-                    + str(measure_folder_list_subfolder_format[i])
-                )
+            for measure_folder, count, recording in measure_folder_list:
+                print(measure_folder + ", " + str(count) + ", " + str(recording))
         else:
             print("no audio measures found.")
-
         parser.exit(0)
 
     #
@@ -845,6 +1088,56 @@ if __name__ == "__main__":
             type=float,
             help="dsp audio delay to be added to the audio source track",
         )
+        parser.add_argument(
+            "-rp",
+            "--read_precision",
+            type=str,
+            help="audio tracks read precision: single, double",
+        )
+        parser.add_argument(
+            "-rc",
+            "--reference_cache",
+            type=str,
+            help="folder to store reference sweeps/filters cache (.npy)",
+        )
+        parser.add_argument(
+            "-f",
+            "--force",
+            action="store_true",
+            default=None,
+            help="recompute all the measures, even if outputs are up to date",
+        )
+        parser.add_argument(
+            "-of",
+            "--output_format",
+            type=str,
+            help="results format: {}".format(", ".join(_OUTPUT_FORMATS)),
+        )
+        parser.add_argument(
+            "-tl",
+            "--timing_log",
+            type=str,
+            help="per stage timings file (JSON lines), none to disable",
+        )
+        parser.add_argument(
+            "-dc",
+            "--deconvolution",
+            type=str,
+            help="deconvolution: {}".format(", ".join(_DECONVOLUTIONS)),
+        )
+        parser.add_argument(
+            "-ar",
+            "--average_repeats",
+            action="store_true",
+            default=None,
+            help="average the repeated sweeps (sweep_0, sweep_1, ...) before the deconvolution",
+        )
+        parser.add_argument(
+            "-ro",
+            "--reject_outliers",
+            type=float,
+            help="averaging: reject repeats with a residual above the median one by this value (dB)",
+        )
 
     #
     # no config, use defaults
@@ -881,6 +1174,65 @@ if __name__ == "__main__":
             default="0.0",
             help="dsp audio delay to be added to the audio source track (default: %(default)s seconds)",
         )
+        parser.add_argument(
+            "-rp",
+            "--read_precision",
+            type=str,
+            default="single",
+            help="audio tracks read precision: single, double (default: %(default)s)",
+        )
+        parser.add_argument(
+            "-rc",
+            "--reference_cache",
+            type=str,
+            default=None,
+            help="folder to store reference sweeps/filters cache (.npy), memory only if not set (default: %(default)s)",
+        )
+        parser.add_argument(
+            "-f",
+            "--force",
+            action="store_true",
+            default=False,
+            help="recompute all the measures, even if outputs are up to date (default: %(default)s)",
+        )
+        parser.add_argument(
+            "-of",
+            "--output_format",
+            type=str,
+            default="files",
+            help="results format: {} (default: %(default)s)".format(", ".join(_OUTPUT_FORMATS)),
+        )
+        parser.add_argument(
+            "-tl",
+            "--timing_log",
+            type=str,
+            default=None,
+            help="per stage timings file (JSON lines), none to disable (default: next to the log file, "
+            "disabled without log file)",
+        )
+        parser.add_argument(
+            "-dc",
+            "--deconvolution",
+            type=str,
+            default="full",
+            help="deconvolution: full (whole recording, full length IRs), stream (IR window only, bounded "
+            "memory) (default: %(default)s)",
+        )
+        parser.add_argument(
+            "-ar",
+            "--average_repeats",
+            action="store_true",
+            default=False,
+            help="average the repeated sweeps (sweep_0, sweep_1, ...) before the deconvolution (default: %(default)s)",
+        )
+        parser.add_argument(
+            "-ro",
+            "--reject_outliers",
+            type=float,
+            default=None,
+            help="averaging: reject repeats with a residual above the median one by this value (dB), keep all "
+            "the repeats if not set (default: %(default)s)",
+        )
 
     parser.add_argument(
         "-v",
@@ -938,6 +1290,46 @@ if __name__ == "__main__":
     if ( yaml_params["dsp_delay"] != 0 ):
         _DSP_AUDIO_DELAY = float(yaml_params["dsp_delay"])
 
+    #
+    # set audio tracks read precision
+    #
+    if str(yaml_params.get("read_precision", "single")).lower() == "double":
+        _AUDIO_READ_DTYPE = np.float64
+    else:
+        _AUDIO_READ_DTYPE = np.float32  # single by default
+
+    #
+    # skip up-to-date measures unless forced
+    #
+    _FORCE_RECOMPUTE = bool(yaml_params.get("force", False))
+
+    #
+    # results format: per receiver files and/or one bundle for each position
+    #
+    _OUTPUT_FORMAT = str(yaml_params.get("output_format", "files")).lower()
+    if _OUTPUT_FORMAT not in _OUTPUT_FORMATS:
+        sys.exit("\n[ERROR] unknown output format: {}".format(_OUTPUT_FORMAT))
+
+    #
+    # deconvolution of the whole recording or streaming (IR window only)
+    #
+    _DECONVOLUTION = str(yaml_params.get("deconvolution", "full")).lower()
+    if _DECONVOLUTION not in _DECONVOLUTIONS:
+        sys.exit("\n[ERROR] unknown deconvolution: {}".format(_DECONVOLUTION))
+
+    #
+    # repeated sweeps: averaged (optionally without the outliers) or only the first one
+    #
+    _AVERAGE_REPEATS = bool(yaml_params.get("average_repeats", False))
+    if yaml_params.get("reject_outliers") != None:
+        _REJECT_OUTLIERS_dB = float(yaml_params["reject_outliers"])
+
+    #
+    # reference cache stored on disk (if given), shared by all the workers
+    #
+    if yaml_params.get("reference_cache") != None:
+        _REFERENCE_CACHE = reference_cache.ReferenceCache(folder=yaml_params["reference_cache"])
+
     #
     # set graphs computation level
     #
@@ -972,6 +1364,15 @@ if __name__ == "__main__":
     if yaml_params["measure_folder"] == None:
         sys.exit("\n[ERROR] missing measure folder.")
 
+    #
+    # per stage timings: next to the log file (if any), never in the measure folder
+    #
+    timing_log = yaml_params.get("timing_log")
+    if timing_log == None and yaml_params.get("logfile") != None:
+        timing_log = os.path.splitext(yaml_params["logfile"])[0] + "_stages.jsonl"
+    if timing_log != None and str(timing_log).lower() != "none":
+        _STAGE_LOG = os.path.abspath(timing_log)
+
     measure_folder_list = []
 
     #
@@ -980,51 +1381,59 @@ if __name__ == "__main__":
     if not (os.path.isdir(yaml_params["measure_folder"])):
         sys.exit("\n[ERROR] cannot open folder: {}".format(yaml_params["measure_folder"]))
 
-    for f in os.walk(yaml_params["measure_folder"]):
-        if os.path.exists(os.path.join(str(f[0]), "config.yaml")):
-            audio_config = ""
-            try:
-                with open(os.path.join(str(f[0]), "config.yaml"), "r") as file:
-                    audio_config = yaml.safe_load(file)
-            except:
-                sys.exit("\n[ERROR] cannot open/parse yaml config file: {}".format(kwargs["ess_yaml_config"]))
-
-            # add folder to the list of measures only if a valid config is found
-            try:
-                if audio_config["syntax"]["name"] == "audio_measure":
-                    measure_folder_list.append(f[0])
-            except:
-                pass
+    # configs of the positions, parsed only if changed (see session_index)
+    index = session_index.SessionIndex(yaml_params["measure_folder"])
 
-    #
-    # compute process pool size based on CPU/MEM requirements
-    #
-    mem_bytes = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")  # e.g. 4015976448
-    mem_gib = mem_bytes / (1024.0**3)  # e.g. 3.74
-    cpu_count = min([(os.cpu_count() - 2), yaml_params["cpu_process"]])
-    cpu_count = max([_MIN_CPU_COUNT, cpu_count])
+    for folder in session_discovery.position_folders(yaml_params["measure_folder"]):
+        audio_config = ""
+        try:
+            audio_config = index.position(folder)["config"]
+        except:
+            sys.exit("\n[ERROR] cannot open/parse yaml config file: {}".format(kwargs["ess_yaml_config"]))
 
-    if _PLOT_SAVE_GRAPH == 0:
-        max_pool_size = min(cpu_count, int(mem_gib / _MIN_MEM_GB))
-    else:
-        max_pool_size = min(cpu_count, int(mem_gib / _MAX_MEM_GB))
-        if _MAX_SMOOTHING_MEM_GB:
-            max_pool_size = min(cpu_count, int(mem_gib / _MAX_SMOOTHING_MEM_GB))
+        # add folder to the list of measures only if a valid config is found
+        # (ess sweeps only: continuous rotation measures, see compute_rotation_hrir.py)
+        try:
+            if (
+                audio_config["syntax"]["name"] == "audio_measure"
+                and audio_config["custom"]["stimulus"].get("type", "ess_sweep") == "ess_sweep"
+            ):
+                measure_folder_list.append(folder)
+        except:
+            pass
 
     #
-    # compute HRIR for each measure folder
+    # compute HRIR for each measure folder: workers are started according to the CPU limit
+    # and to the measured memory of each computation (see job_scheduler)
     #
-    logger.info("Pool size: {}".format(max_pool_size))
-    cpu_pool = Pool(max_pool_size)
+    # plots are rendered after the computation (see plot_hrir): always full parallelism here
+    cpu_count = job_scheduler.cpu_pool_size(yaml_params["cpu_process"])
 
     if len(measure_folder_list) > 0:
         # debug: single manual run
         # compute_hrir(measure_folder_list[0])
+        result = job_scheduler.run_tasks(
+            compute_hrir,
+            measure_folder_list,
+            processes=cpu_count,
+            mem_per_task_gb=_MIN_MEM_GB,
+            name="compute_hrir",
+        )
 
-        # with cpu_pool as w:
-        #     # w.map(partial(compute_hrir, config=None), measure_folder_list)
-        #     w.map_async(compute_hrir, measure_folder_list, callback=progress)
-        result = cpu_pool.map(compute_hrir, measure_folder_list)
+    # results of the computed positions in the session index, read by the sofa scripts
+    session_index.update_index(yaml_params["measure_folder"], index)
 
-    cpu_pool.close()
-    cpu_pool.join()
+    #
+    # render plots from the saved results, same plots/resolution of the inline rendering
+    # (use plot_hrir.py to regenerate plots with other formats/resolutions)
+    #
+    if _PLOT_SAVE_GRAPH and len(measure_folder_list) > 0:
+        plot_hrir.plot_folders(
+            measure_folder_list,
+            cpu_process=cpu_count,
+            plots=plot_hrir._PLOT_TYPES,
+            formats=plot_hrir._PLOT_FORMATS if (_PLOT_SAVE_GRAPH & 0x01) else [],
+            dpi=300,
+            smoothing=_ENABLE_FRACTION_OCTAVE_SMOOTHING,
+            show=bool(_PLOT_SAVE_GRAPH & 0x02),
+        )
@@ -0,0 +1,538 @@
+#!/usr/bin/env python3
+"""compute impulse responses of continuous rotation measures (see record_ess_map.py -cr)
+
+The table turned while a perfect sweep was played in loop: a block NLMS adaptive filter (see
+rotation_nlms) tracks the impulse responses of all the receivers along the recording, the table
+encoder positions give the time of each azimuth of the output grid. One position folder
+(<measure_name>_+<azimuth><elevation>+<distance>_xAngle, same layout of record_ess_map) is
+written for each azimuth, with the results bundle of all the receivers (see ir_bundle): the sofa
+scripts read them as the measures of the step by step maps.
+
+mu (0..1] trades time resolution for noise: the impulse response at an azimuth averages the
+recording of period / mu seconds around it, i.e. rotation_speed * period / mu degrees.
+"""
+
+import os
+import sys
+import copy
+import math
+import yaml
+import logging
+import argparse
+
+import numpy as np
+import pyfar as pf
+from setproctitle import setproctitle
+
+import track_reader
+import rotation_nlms
+import ir_bundle
+import delay_estimator
+import result_writer
+import job_scheduler
+import session_config
+import session_discovery
+
+logger = logging.getLogger(__name__)
+
+#
+# DEFINES / CONSTANT / GLOBALS
+#
+_AUDIO_READ_DTYPE = np.float32
+_SOUND_SPEED = 343  # m/s, same of compute_hrir
+_COORD_ROUND_DECIMALS = 9  # same of record_ess_map
+
+# IR window (same of compute_hrir), never longer than the filters period
+_IR_WINDOW_LENGTH_s = 1.0
+
+# IR_INFO for pyfar data storage (same layout of compute_hrir)
+_IR_INFO_DELAY = 0
+_IR_INFO_DELAY_SAMPLES = 1
+_IR_INFO_dbFS_CALIB = 2
+_IR_INFO_SAMPLERATE = 3
+
+# adaptive filter step size and block length (s), see rotation_nlms
+_MU = 1.0
+_BLOCK_s = 0.1
+
+# output azimuths grid (degree): from the measure config if not set
+_AZIMUTH_BEGIN = None
+_AZIMUTH_END = None
+_AZIMUTH_STEP = None
+
+# output position folders: next to the rotation measure folder if not set
+_OUTPUT_FOLDER = None
+
+# extra delay to be added to the reference audio track to compensate for audio dsp chain delay
+_DSP_AUDIO_DELAY = 0
+
+# the compute_hrir head detection makes its IRs and delays one sample early (see bench_pipeline): the
+# tracked IRs are advanced by as much, the sofa files mix both kinds of positions
+_LEGACY_HEAD_OFFSET_SAMPLES = 1
+
+
+#
+# TOOLS
+#
+def azimuth_grid(rotation=None):
+    """output azimuths (degree): the given grid, or the one of the measure (custom.rotation)"""
+    begin = rotation["azimuth"]["begin"] if _AZIMUTH_BEGIN is None else _AZIMUTH_BEGIN
+    end = rotation["azimuth"]["end"] if _AZIMUTH_END is None else _AZIMUTH_END
+    step = rotation["azimuth"]["step"] if _AZIMUTH_STEP is None else _AZIMUTH_STEP
+    count = int(math.floor(abs(end - begin) / abs(step) + 1e-9)) + 1
+    return [begin + math.copysign(abs(step), end - begin) * k for k in range(count)]
+
+
+def position_name(measure_name=None, azimuth=0, elevation=0, distance=1):
+    """position folder name, same of record_ess_map (azimuths with a fractional part: 3 decimals)"""
+    azimuth = azimuth % 360
+    if float(azimuth).is_integer():
+        azimuth_str = "{:03d}".format(int(azimuth))
+    else:
+        azimuth_str = "{:07.3f}".format(azimuth)
+    return measure_name + "_+{}{}{:03d}+{:03d}_xAngle".format(
+        azimuth_str, "+" if elevation > 0 else "-", abs(int(elevation)), int(distance)
+    )
+
+
+def position_config(config=None, name=None, azimuth=0, elevation=0, distance=1):
+    """config.yaml of one output position: source position, view and up vectors as record_ess_map"""
+    config = copy.deepcopy(config)
+    source = config["setup"]["sources"][0]
+    az = math.pi / 180 * ((180 + azimuth) % 360)
+    el = math.pi / 180 * (elevation % 360)
+
+    config["custom"]["audio_folder"] = name
+    for key in ("position", "position_copy"):
+        source[key]["coord"]["type"] = "spherical"
+        source[key]["coord"]["units"] = ["degree", "degree", "metre"]
+        source[key]["coord"]["value"] = [azimuth, elevation, distance]
+
+    source["position"]["view_vect"]["type"] = "cartesian"
+    source["position"]["view_vect"]["units"] = ["meter"]
+    source["position"]["view_vect"]["value"] = [
+        round(math.cos(az) * math.cos(el), _COORD_ROUND_DECIMALS),
+        round(math.sin(az) * math.cos(el), _COORD_ROUND_DECIMALS),
+        round(math.sin(el), _COORD_ROUND_DECIMALS),
+    ]
+    source["position"]["up_vect"]["value"] = [
+        round(math.sin(az) * math.sin(el), _COORD_ROUND_DECIMALS),
+        round(math.cos(az) * math.sin(el), _COORD_ROUND_DECIMALS),
+        round(math.cos(el), _COORD_ROUND_DECIMALS),
+    ]
+    return config
+
+
+def write_yaml(filename=None, data=None):
+    with open(filename, "w") as file:
+        yaml.dump(data, file, default_flow_style=False, sort_keys=False)
+
+
+#
+# compute the impulse responses of a rotation measure
+#
+def compute_rotation_hrir(folder=None):
+    logger.info("compute rotation hrir: {}".format(folder))
+
+    try:
+        config = session_config.read_yaml(os.path.join(str(folder), "config.yaml"))
+    except:
+        logger.error("compute rotation hrir: invalid config in folder {}".format(folder))
+        return
+
+    rotation = config["custom"]["rotation"]
+    setproctitle("hrir_rotation_{}".format(os.path.basename(os.path.normpath(str(folder)))))
+
+    fs = int(config["custom"]["recording"]["samplerate"])
+    sweep = config["custom"]["stimulus"]["sweep"]
+    f1 = sweep["frequency"]["begin"]
+    padding_pre = sweep["padding"]["pre"]["value"]
+    elevation = rotation["elevation"]
+    distance = rotation["distance"]
+    tx_track_id = config["setup"]["sources"][0]["emitters"][0]["track_id"]
+    receivers = config["setup"]["listeners"][0]["receivers"]
+    rx_ids = list(range(config["setup"]["listeners"][0]["receivers_count"]))
+    rx_track_ids = [receivers[rx_id]["track_id"] for rx_id in rx_ids]
+
+    audio_file = config["custom"]["audio_filename"]
+    audio_path = os.path.join(str(folder), audio_file + "." + config["custom"]["recording"]["format"])
+
+    times, azimuths, periods = rotation_nlms.read_encoder_log(os.path.join(str(folder), rotation["encoder_log"]))
+
+    #
+    # STEP-01: recorded stimulus, head of the first period and reference period
+    #
+    length = rotation_nlms.period_samples(rotation["period"]["value"], fs)
+    tx, samplerate = track_reader.read_tracks(audio_path, tracks=[tx_track_id], dtype=_AUDIO_READ_DTYPE)
+    tx = tx[:, 0]
+    head = rotation_nlms.find_head(tx, rotation_nlms.perfect_sweep(length), int(padding_pre * fs) + length // 2)
+    reference = rotation_nlms.reference_period(tx, head, length)
+    del tx
+
+    # compensate for audio chain delays AFTER the point of measure (see compute_hrir): the
+    # reference is delayed, the receivers are aligned on the delayed reference
+    head += 2 * int(int(fs * _DSP_AUDIO_DELAY) / 2)
+    logger.info(
+        "compute rotation hrir: period {} samples, {} periods, first period at sample {}".format(length, periods, head)
+    )
+
+    nlms = rotation_nlms.BlockNLMS(reference, channels=len(rx_ids), mu=_MU, head=head)
+
+    # 0 dBFS calibration: same scale of compute_hrir (stimulus impulse response peak)
+    dbFS_calib = 2.38 * np.max(np.abs(np.fft.irfft(nlms.spectrum * nlms.normalization, length)))
+
+    #
+    # STEP-02: frame of each azimuth of the grid (the filters refer to lag frames before)
+    #
+    grid = azimuth_grid(rotation)
+    lag = rotation_nlms.estimate_lag(length, _MU)
+    valid = rotation_nlms.valid_times(length, _MU, periods, fs)
+    targets = head + rotation_nlms.target_times(times, azimuths, grid, valid) * fs + lag
+    begin = head + length  # the first period starts from silence
+    end = head + periods * length
+    block = min(length, max(1, int(_BLOCK_s * fs)))
+    for idx, azimuth in enumerate(grid):
+        if not np.isfinite(targets[idx]):
+            logger.warning("compute rotation hrir: azimuth {} not reached by the table, skipped".format(azimuth))
+        elif not (head + valid[0] * fs + lag <= round(targets[idx]) <= end):
+            # filters not settled yet, or after the end of the recording
+            logger.warning("compute rotation hrir: azimuth {} out of the valid estimates, skipped".format(azimuth))
+            targets[idx] = np.nan
+
+    output_folder = _OUTPUT_FOLDER
+    if output_folder is None:
+        output_folder = os.path.dirname(os.path.normpath(str(folder)))
+
+    # IR window (see compute_hrir STEP-05), within the filters period
+    dyn_fade_s = (int((1000 * distance / _SOUND_SPEED) / 2) + 1) / 1000
+    window_s = min(_IR_WINDOW_LENGTH_s, (length - 2) / fs - 2 * dyn_fade_s)
+
+    #
+    # STEP-03: track the impulse responses, one position folder for each azimuth
+    #
+    count = 0
+    with result_writer.ResultWriter(name="compute_rotation_hrir_writer") as writer, track_reader.TrackStream(
+        audio_path, tracks=rx_track_ids, dtype=_AUDIO_READ_DTYPE
+    ) as stream:
+        for idx, filters in rotation_nlms.track_targets(stream.read, nlms, begin, end, block, targets):
+            azimuth = grid[idx]
+            name = position_name(rotation["measure_name"], azimuth, elevation, distance)
+            position_folder = os.path.join(output_folder, name)
+            logger.info("compute rotation hrir: azimuth {}: {}".format(azimuth, position_folder))
+
+            ir_rx = np.roll(filters, -_LEGACY_HEAD_OFFSET_SAMPLES, axis=-1) / dbFS_calib
+            ir_rx_delay_samples, ir_rx_delay_exact = delay_estimator.peak_delays(
+                ir_rx, search=int(2 * (distance / _SOUND_SPEED) * fs)
+            )
+
+            bundle = {"rx_ids": [], "track_ids": [], "ir": [], "ir_norm_hipass_window": [], "ir_info": []}
+            for col, rx_id in enumerate(rx_ids):
+                ir = pf.Signal(data=ir_rx[col], sampling_rate=fs)
+                ir_norm_hipass = pf.dsp.filter.butterworth(ir, 8, f1, "highpass")
+                ir_norm_hipass_window = pf.dsp.time_window(
+                    ir_norm_hipass,
+                    [0, dyn_fade_s, window_s, (window_s + 2 * dyn_fade_s)],
+                    unit="s",
+                    crop="window",
+                )
+
+                bundle["rx_ids"].append(rx_id)
+                bundle["track_ids"].append(rx_track_ids[col])
+                bundle["ir"].append(ir)
+                bundle["ir_norm_hipass_window"].append(ir_norm_hipass_window)
+                bundle["ir_info"].append(
+                    np.array([ir_rx_delay_exact[col] / fs, ir_rx_delay_samples[col], dbFS_calib, samplerate])
+                )
+
+            position = position_config(config, name, azimuth, elevation, distance)
+            position["custom"]["rotation"]["source"] = {
+                "folder": os.path.basename(os.path.normpath(str(folder))),
+                "time": {"value": round(float((targets[idx] - lag - head) / fs), 6), "units": "s"},
+                "mu": float(_MU),
+            }
+
+            os.makedirs(os.path.join(position_folder, "ir"), exist_ok=True)
+            writer.submit(
+                os.path.join(position_folder, "config.yaml"),
+                write_yaml,
+                os.path.join(position_folder, "config.yaml"),
+                position,
+            )
+            ir_filename = os.path.join(position_folder, "ir", ir_bundle.bundle_filename(audio_file))
+            writer.submit(ir_filename, ir_bundle.write_bundle, ir_filename, **bundle)
+            count += 1
+
+        try:
+            writer.close()
+        except result_writer.ResultWriterError as e:
+            logger.error("compute rotation hrir: {}, ERROR saving results: {}".format(folder, e))
+            raise
+
+    logger.info("compute rotation hrir: {} done, {} positions of {}.".format(folder, count, len(grid)))
+
+
+#
+###############################################################################
+# MAIN
+###############################################################################
+#
+if __name__ == "__main__":
+    setproctitle("compute_rotation_hrir_main")
+
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument(
+        "-yp",
+        "--yaml_params",
+        type=str,
+        default=None,
+        help="yaml input params file (default: %(default)s)",
+    )
+
+    args1, remaining = parser.parse_known_args()
+
+    #
+    # do we have a config file? if yes parse WITHOUT defaults
+    #
+    if args1.yaml_params != None:
+        parser = argparse.ArgumentParser(
+            description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter, parents=[parser]
+        )
+        parser.add_argument(
+            "-mf",
+            "--measure_folder",
+            type=str,
+            help="folder with continuous rotation measures",
+        )
+        parser.add_argument(
+            "-o",
+            "--output_folder",
+            type=str,
+            help="folder of the output positions (next to each rotation measure if not set)",
+        )
+        parser.add_argument(
+            "-c",
+            "--cpu_process",
+            type=int,
+            help="maximum number of CPU process to use",
+        )
+        parser.add_argument(
+            "-d",
+            "--dsp_delay",
+            type=float,
+            help="dsp audio delay to be added to the audio source track",
+        )
+        parser.add_argument(
+            "-ab",
+            "--azimuth_begin",
+            type=float,
+            help="output azimuths grid begin (deg)",
+        )
+        parser.add_argument(
+            "-ae",
+            "--azimuth_end",
+            type=float,
+            help="output azimuths grid end (deg)",
+        )
+        parser.add_argument(
+            "-as",
+            "--azimuth_step",
+            type=float,
+            help="output azimuths grid step (deg)",
+        )
+        parser.add_argument(
+            "-mu",
+            "--step_size",
+            type=float,
+            help="adaptive filter step size (0..1], lower is less noisy and more blurred",
+        )
+        parser.add_argument(
+            "-bl",
+            "--block",
+            type=float,
+            help="adaptive filter block (s), time resolution of the tracking",
+        )
+
+    #
+    # no config, use defaults
+    #
+    else:
+        parser = argparse.ArgumentParser(
+            description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter, parents=[parser]
+        )
+        parser.add_argument(
+            "-mf",
+            "--measure_folder",
+            type=str,
+            default=None,
+            help="folder with continuous rotation measures (default: %(default)s)",
+        )
+        parser.add_argument(
+            "-o",
+            "--output_folder",
+            type=str,
+            default=None,
+            help="folder of the output positions (default: next to each rotation measure)",
+        )
+        parser.add_argument(
+            "-c",
+            "--cpu_process",
+            default=6,
+            type=int,
+            help="maximum number of CPU process to use (default: %(default)s)",
+        )
+        parser.add_argument(
+            "-d",
+            "--dsp_delay",
+            type=float,
+            default="0.0",
+            help="dsp audio delay to be added to the audio source track (default: %(default)s seconds)",
+        )
+        parser.add_argument(
+            "-ab",
+            "--azimuth_begin",
+            type=float,
+            default=None,
+            help="output azimuths grid begin (deg) (default: from the measure)",
+        )
+        parser.add_argument(
+            "-ae",
+            "--azimuth_end",
+            type=float,
+            default=None,
+            help="output azimuths grid end (deg) (default: from the measure)",
+        )
+        parser.add_argument(
+            "-as",
+            "--azimuth_step",
+            type=float,
+            default=None,
+            help="output azimuths grid step (deg) (default: from the measure)",
+        )
+        parser.add_argument(
+            "-mu",
+            "--step_size",
+            type=float,
+            default=1.0,
+            help="adaptive filter step size (0..1], lower is less noisy and more blurred (default: %(default)s)",
+        )
+        parser.add_argument(
+            "-bl",
+            "--block",
+            type=float,
+            default=0.1,
+            help="adaptive filter block (s), time resolution of the tracking (default: %(default)s)",
+        )
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        default=False,
+        help="verbose (default: %(default)s)",
+    )
+
+    parser.add_argument(
+        "-log",
+        "--logfile",
+        type=str,
+        default=None,
+        help="log verbose output to file (default: %(default)s)",
+    )
+
+    args, remaining = parser.parse_known_args(remaining)
+
+    #
+    # set debug verbosity
+    #
+    if args.verbose:
+        if args.logfile != None:
+            logging.basicConfig(filename=args.logfile, encoding="utf-8", level=logging.INFO)
+        else:
+            logging.basicConfig(level=logging.INFO)
+    else:
+        logging.basicConfig(level=logging.WARNING)
+
+    #
+    # load params from external config file (if given)
+    #
+    yaml_params = vars(args)
+    if args1.yaml_params != None:
+        try:
+            with open(args1.yaml_params, "r") as file:
+                yaml_params = yaml.safe_load(file)
+        except:
+            sys.exit("\n[ERROR] cannot open/parse yaml config file: {}".format(args1.yaml_params))
+
+        # console params have priority on default config
+        params = vars(args)
+        for p in params:
+            if (p in yaml_params) and (params[p] != None):
+                yaml_params[p] = params[p]
+
+    args1 = []
+    args = []
+
+    if yaml_params.get("dsp_delay"):
+        _DSP_AUDIO_DELAY = float(yaml_params["dsp_delay"])
+    if yaml_params.get("step_size") != None:
+        _MU = float(yaml_params["step_size"])
+    if yaml_params.get("block") != None:
+        _BLOCK_s = float(yaml_params["block"])
+    _AZIMUTH_BEGIN = yaml_params.get("azimuth_begin")
+    _AZIMUTH_END = yaml_params.get("azimuth_end")
+    _AZIMUTH_STEP = yaml_params.get("azimuth_step")
+    _OUTPUT_FOLDER = yaml_params.get("output_folder")
+
+    #
+    # setup log
+    #
+    logger.info("-" * 80)
+    logger.info("SETUP:")
+    logger.info("-" * 80)
+
+    for p in yaml_params:
+        logger.info("{} : {}".format(str(p), str(yaml_params[p])))
+
+    #
+    # sanity checks to validate input params
+    #
+    if yaml_params["measure_folder"] == None:
+        sys.exit("\n[ERROR] missing measure folder.")
+    if not (0 < _MU <= 1):
+        sys.exit("\n[ERROR] step size out of (0..1]: {}".format(_MU))
+    if _AZIMUTH_STEP != None and _AZIMUTH_STEP == 0:
+        sys.exit("\n[ERROR] azimuth step cannot be 0.")
+
+    #
+    # walk the given folder and search for continuous rotation measures
+    #
+    if not (os.path.isdir(yaml_params["measure_folder"])):
+        sys.exit("\n[ERROR] cannot open folder: {}".format(yaml_params["measure_folder"]))
+
+    measure_folder_list = []
+    for folder in sorted(session_discovery.position_folders(yaml_params["measure_folder"])):
+        try:
+            audio_config = session_config.read_yaml(os.path.join(folder, "config.yaml"))
+        except:
+            sys.exit("\n[ERROR] cannot open/parse yaml config file: {}".format(folder))
+
+        # rotation measures only (the output positions have no encoder log)
+        try:
+            if (
+                audio_config["syntax"]["name"] == "audio_measure"
+                and audio_config["custom"]["stimulus"].get("type") == "perfect_sweep"
+                and os.path.exists(os.path.join(folder, audio_config["custom"]["rotation"]["encoder_log"]))
+            ):
+                measure_folder_list.append(folder)
+        except:
+            pass
+
+    if len(measure_folder_list) == 0:
+        sys.exit("\n[ERROR] no continuous rotation measures in: {}".format(yaml_params["measure_folder"]))
+
+    job_scheduler.run_tasks(
+        compute_rotation_hrir,
+        measure_folder_list,
+        processes=job_scheduler.cpu_pool_size(yaml_params["cpu_process"]),
+        name="compute_rotation_hrir",
+    )
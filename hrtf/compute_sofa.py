@@ -5,9 +5,7 @@ from __future__ import division
 import scipy.signal as sig
 
 import os
-import re
 import sys
-import glob
 import yaml
 import logging
 import signal
@@ -28,11 +26,19 @@ import sofar as sof
 from multiprocessing import Pool
 
 
-import multiprocessing
-import multiprocessing.pool
 
 from setproctitle import setproctitle
 
+import job_scheduler
+import shared_array
+import sofa_stream
+import sofa_update
+import ir_bundle
+import session_index
+import session_config
+import session_discovery
+import delay_estimator
+
 from datetime import datetime
 
 
@@ -45,8 +51,6 @@ logger = logging.getLogger(__name__)
 _CTRL_EXIT_SIGNAL = 0  # driven by CTRL-C, 0 to exit threads
 
 _MIN_CPU_COUNT = 1  # we need at least one CPU for each compute process
-_MIN_MEM_GB = 2  # min amount of memory for each compute process
-_MAX_MEM_GB = 6  # max amount of memory for each compute process
 _PLOT_SAVE_GRAPH = 0  # 0:skip, 1:save, 2:show, 3:show&save plot
 
 # IR_INFO for pyfar data storage
@@ -55,6 +59,8 @@ _IR_INFO_DELAY_SAMPLES = 1
 _IR_INFO_dbFS_CALIB = 2
 _IR_INFO_SAMPLERATE = 3
 
+_POSITION_TOLERANCE = 1e-6  # source positions of the same measurement (sofa update)
+
 
 #
 # TOOLS
@@ -98,47 +104,9 @@ def signal_handler(sig, frame):
 #     # sofa.inspect()
 
 
-def sum_array(data=None):
-    rv = 0
-
-    items_num = len(data)
-    for val in data:
-        rv += val
-
-    return rv
-
-
-def compute_delay(data=None):
-    adata = abs(data)
-
-    peak_idx = np.argmax(adata)
-    peak = adata[peak_idx]
-
-    i = peak_idx - 4
-    while (i > 4) and (sum_array(adata[i - 4 : i]) > (peak / 4)):
-        i -= 1
-
-    return i
-
-
-def compute_delay_adj(data=None, idx=0):
-    adata = abs(data)
-
-    peak_idx = idx
-
-    if peak_idx == 0:
-        peak_idx = np.argmax(adata)
-
-    peak = adata[peak_idx]
-
-    i = peak_idx - 4
-    while (i > 4) and (sum_array(adata[i - 4 : i]) > (peak / 4)):
-        i -= 1
-
-    return i
-
-
-def read_ir_delays(data=None, configs=None, folders=None):
+def read_ir_delays(data=None, configs=None, folders=None, peaks=None, results=None):
+    """IR delays (seconds) in data, IR peak positions (samples) in peaks if given, from the results
+    of each position in the session index if given (see session_index)"""
     global _CTRL_EXIT_SIGNAL
 
     err = 0
@@ -146,12 +114,21 @@ def read_ir_delays(data=None, configs=None, folders=None):
     samples_ir_window = 0
 
     for i in range(len(configs)):
+        # session index results, or one bundle for each position (if available) instead of per receiver files
+        bundle_results = None
+        bundle_filename = ir_bundle.bundle_path(folders[i], configs[i])
+        if results is not None:
+            bundle_results = results[i]["receivers"]
+            bundle_filename = folders[i] + " (session index)"
+        elif ir_bundle.has_bundle(folders[i], configs[i]):
+            bundle_results = ir_bundle.read_results(folders[i], configs[i])
+
         for ii in range(configs[i]["setup"]["listeners"][0]["receivers_count"]):
             # handle CTRL-C
             if _CTRL_EXIT_SIGNAL:
                 return (err, samples_ir, samples_ir_window)
 
-            ir_trid = configs[i]["setup"]["listeners"][0]["receivers"][ii]["track_id"]
+            ir_trid = session_config.track_ids(configs[i])[ii]
             ir_folder = folders[i] + "/ir/"
             ir_yaml_filename = (
                 configs[i]["custom"]["audio_filename"] + "_IR_rx_" + str(ii) + "_trid_" + str(ir_trid) + ".yaml"
@@ -161,15 +138,21 @@ def read_ir_delays(data=None, configs=None, folders=None):
 
             ir_yaml = []
 
-            try:
-                with open(ir_yaml_file, "r") as file:
-                    ir_yaml = yaml.safe_load(file)
-            except:
-                logger.error("ERROR while reading {}".format(ir_yaml_file))
-                ir_yaml = None
+            if bundle_results != None:
+                ir_yaml = bundle_results.get(int(ii))
+                if ir_yaml == None:
+                    logger.error("ERROR missing rx_id {} in {}".format(ii, bundle_filename))
+            else:
+                try:
+                    ir_yaml = session_config.read_yaml(ir_yaml_file)
+                except:
+                    logger.error("ERROR while reading {}".format(ir_yaml_file))
+                    ir_yaml = None
 
             if ir_yaml != None:
                 data[i, ii] = ir_yaml["ir_delay"]
+                if peaks is not None:
+                    peaks[i, ii] = int(ir_yaml["ir_delay_samples"])
                 samples_ir = max(samples_ir, int(ir_yaml["ir_samples"]))
                 samples_ir_window = max(samples_ir_window, int(ir_yaml["ir_norm_hipass_window_samples"]))
 
@@ -185,75 +168,23 @@ def read_ir_sample(params):
     i = params[0]
     config = params[1]
     folder = params[2]
-    zero_delay = params[3]
-    sofa_data_ir = params[4]
-
-    for ii in range(config["setup"]["listeners"][0]["receivers_count"]):
-        # handle CTRL-C
-        if _CTRL_EXIT_SIGNAL:
-            return
-
-        ir_trid = config["setup"]["listeners"][0]["receivers"][ii]["track_id"]
-        ir_folder = folder + "/ir/"
-        ir_pyfar_filename = config["custom"]["audio_filename"] + "_IR_rx_" + str(ii) + "_trid_" + str(ir_trid) + ".far"
-        ir_pyfar_file = ir_folder + "/" + ir_pyfar_filename
-
-        logger.info(ir_pyfar_file)
-
-        ir_pyfar = []
-
-        try:
-            # with open(ir_pyfar_file, "r") as file:
-            ir_pyfar = pf.io.read(ir_pyfar_file)
-        except:
-            logger.error("ERROR while reading {}".format(ir_pyfar_file))
-            ir_pyfar = None
-
-        if ir_pyfar != None:
-            # fetch impulse response in time domain
-            if zero_delay == False:
-                sofa_data_ir[i, ii, :] = ir_pyfar["ir_norm_hipass_window"].time[0]
-            else:
-                # retrieve info from file processing, 3DTune-In requires zero-delay aligned files!!
-                ir_info = ir_pyfar["ir_info"]
-                ir_delay_samples = int(ir_info[_IR_INFO_DELAY_SAMPLES])
-
-                # make sure we preserve the peak for the final IR
-                # ir_delay_samples = np.argmax(np.abs(ir_pyfar["ir_norm_hipass_window"].time[0]))
-                # if ir_delay_samples > 4:
-                #     ir_delay_samples -= 4
-
-                # ir_delay_samples = compute_delay(ir_pyfar["ir_norm_hipass_window"].time[0])
-                ir_delay_samples = compute_delay_adj(ir_pyfar["ir_norm_hipass_window"].time[0], ir_delay_samples)
-
-                ir_len = ir_pyfar["ir_norm_hipass_window"].n_samples
-
-                if ir_len > ir_delay_samples:
-                    tmp = ir_len - ir_delay_samples
-                    sofa_data_ir[i, ii, 0:tmp] = ir_pyfar["ir_norm_hipass_window"].time[0][ir_delay_samples:]
-                else:
-                    logger.error(
-                        "ERROR: invalide delay samples for:{} rx_id:{} [{}<{}] ".format(
-                            ir_pyfar_filename, ii, ir_len, ir_delay_samples
-                        )
-                    )
 
+    # Data_IR: shared memory array handle in process mode (see shared_array), the array in thread mode
+    with shared_array.attach(params[3]) as sofa_data_ir:
+        # one bundle for each position (if available) instead of per receiver files
+        bundle_receivers = None
+        if ir_bundle.has_bundle(folder, config):
+            bundle_receivers = ir_bundle.read_receivers(folder, config)
 
-def read_ir_samples(data=None, configs=None, folders=None, zero_delay=False):
-    global _CTRL_EXIT_SIGNAL
-
-    err = 0
-
-    for i in range(len(configs)):
-        for ii in range(configs[i]["setup"]["listeners"][0]["receivers_count"]):
+        for ii in range(config["setup"]["listeners"][0]["receivers_count"]):
             # handle CTRL-C
             if _CTRL_EXIT_SIGNAL:
                 return
 
-            ir_trid = configs[i]["setup"]["listeners"][0]["receivers"][ii]["track_id"]
-            ir_folder = folders[i] + "/ir/"
+            ir_trid = session_config.track_ids(config)[ii]
+            ir_folder = folder + "/ir/"
             ir_pyfar_filename = (
-                configs[i]["custom"]["audio_filename"] + "_IR_rx_" + str(ii) + "_trid_" + str(ir_trid) + ".far"
+                config["custom"]["audio_filename"] + "_IR_rx_" + str(ii) + "_trid_" + str(ir_trid) + ".far"
             )
             ir_pyfar_file = ir_folder + "/" + ir_pyfar_filename
 
@@ -261,42 +192,124 @@ def read_ir_samples(data=None, configs=None, folders=None, zero_delay=False):
 
             ir_pyfar = []
 
-            try:
-                # with open(ir_pyfar_file, "r") as file:
-                ir_pyfar = pf.io.read(ir_pyfar_file)
-            except:
-                logger.error("ERROR while reading {}".format(ir_pyfar_file))
-                ir_pyfar = None
+            if bundle_receivers != None:
+                ir_pyfar = bundle_receivers.get(int(ii))
+                if ir_pyfar == None:
+                    logger.error("ERROR missing rx_id {} in {}".format(ii, ir_bundle.bundle_path(folder, config)))
+            else:
+                try:
+                    # with open(ir_pyfar_file, "r") as file:
+                    ir_pyfar = pf.io.read(ir_pyfar_file)
+                except:
+                    logger.error("ERROR while reading {}".format(ir_pyfar_file))
+                    ir_pyfar = None
 
             if ir_pyfar != None:
-                # fetch impulse response in time domain
+                # fetch impulse response in time domain (zero-delay alignment is done on the whole Data_IR)
+                ir_len = ir_pyfar["ir_norm_hipass_window"].n_samples
+                sofa_data_ir[i, ii, 0:ir_len] = ir_pyfar["ir_norm_hipass_window"].time[0]
+
+
+def load_ir_samples(shape=None, configs=None, folders=None, processes=1, mode="process", progress=True):
+    """Data_IR (shape: measures, receivers, samples) of all the positions, read by a pool of processes
+    workers (see read_ir_sample), returns (Data_IR, shared): in process mode the workers decode the
+    IRs directly in a shared memory array (shared, release it once Data_IR is written), in thread
+    mode (or without enough shared memory) they share a numpy array (shared is None)"""
+    shared = None
+    if mode == "process" and not shared_array.available(shape):
+        logger.warning("not enough shared memory for {} IR samples, thread pool load".format(shape))
+        mode = "thread"
+
+    if mode == "process":
+        shared = shared_array.SharedArray(shape)
+        data = shared.array
+        target = shared.handle()
+    else:
+        data = np.zeros(shape)
+        target = data
+
+    cpu_pool_params = []
+    for i in range(len(configs)):
+        cpu_pool_params.append((i, configs[i], folders[i], target))
+
+    job_scheduler.run_tasks(
+        read_ir_sample, cpu_pool_params, processes=processes, mode=mode, progress=progress, name="read_ir_sample"
+    )
+    return data, shared
+
+
+def align_zero_delay(data=None, peaks=None, folders=None):
+    """3DTune-In requires zero-delay aligned IRs: move the onset before the IR peak (see
+    delay_estimator.onset_samples) to the first sample, for all the positions and receivers at once"""
+    samples_ir_window = data.shape[-1]
+    ir_onsets = delay_estimator.onset_samples(data, peaks)
+    for i, ii in zip(*np.nonzero((ir_onsets < 0) | (ir_onsets >= samples_ir_window))):
+        logger.error(
+            "ERROR: invalide delay samples for:{} rx_id:{} [{}<{}] ".format(
+                folders[i], ii, samples_ir_window, ir_onsets[i, ii]
+            )
+        )
+    delay_estimator.shift_rows(data, ir_onsets, out=data)
+
+
+def stream_ir_samples(writer=None, configs=None, folders=None, peaks=None, zero_delay=False, processes=1):
+    """IR samples of all the positions loaded block by block (one position for each worker, see
+    load_ir_samples) and written to the sofa_stream writer: memory is bounded by a block. The
+    block array (shared memory in process mode) and the workers are kept for all the blocks."""
+    (measures_M, receivers_R, samples_ir_window) = writer.shape
+    shape = (min(processes, measures_M), receivers_R, samples_ir_window)
+
+    mode = "process"
+    if processes > 1 and not shared_array.available(shape):
+        logger.warning("not enough shared memory for {} IR samples, thread pool load".format(shape))
+        mode = "thread"
+
+    shared = None
+    if processes > 1 and mode == "process":
+        shared = shared_array.SharedArray(shape)
+        block = shared.array
+        target = shared.handle()
+    else:
+        block = np.zeros(shape)
+        target = block
 
-                if zero_delay == False:
-                    data[i, ii, :] = ir_pyfar["ir_norm_hipass_window"].time[0]
-                else:
-                    # retrieve info from file processing, 3DTune-In requires zero-delay aligned files!!
-                    ir_info = ir_pyfar["ir_info"]
-                    ir_delay_samples = int(ir_info[_IR_INFO_DELAY_SAMPLES])
+    scheduler = job_scheduler.JobScheduler(
+        processes=processes, mode=mode, progress=False, name="read_ir_sample", keep_pool=True
+    )
+    try:
+        for start in range(0, measures_M, processes):
+            if _CTRL_EXIT_SIGNAL:
+                return -1
 
-                    # make sure we preserve the peak for the final IR
-                    # ir_delay_samples = np.argmax(np.abs(ir_pyfar["ir_norm_hipass_window"].time[0]))
-                    # if ir_delay_samples > 4:
-                    #     ir_delay_samples -= 4
+            stop = min(measures_M, start + processes)
+            data = block[: stop - start]
+            data.fill(0)
+            if processes > 1:
+                scheduler.run(read_ir_sample, [(i - start, configs[i], folders[i], target) for i in range(start, stop)])
+            else:
+                read_ir_samples(data=data, configs=configs[start:stop], folders=folders[start:stop])
 
-                    # ir_delay_samples = compute_delay(ir_pyfar["ir_norm_hipass_window"].time[0])
-                    ir_delay_samples = compute_delay_adj(ir_pyfar["ir_norm_hipass_window"].time[0], ir_delay_samples)
+            if zero_delay and not (_CTRL_EXIT_SIGNAL):
+                align_zero_delay(data, peaks[start:stop], folders[start:stop])
 
-                    ir_len = ir_pyfar["ir_norm_hipass_window"].n_samples
+            writer.write(start, data)
+            logger.info("compute sofa: {}/{} positions written".format(stop, measures_M))
+    finally:
+        scheduler.close()
+        data = block = None
+        if shared is not None:
+            shared.release()
 
-                    if ir_len > ir_delay_samples:
-                        tmp = ir_len - ir_delay_samples
-                        data[i, ii, 0:tmp] = ir_pyfar["ir_norm_hipass_window"].time[0][ir_delay_samples:]
-                    else:
-                        logger.error(
-                            "ERROR: invalide delay samples for:{} rx_id:{} [{}<{}] ".format(
-                                ir_pyfar_filename, ii, ir_len, ir_delay_samples
-                            )
-                        )
+    return -1 if _CTRL_EXIT_SIGNAL else 0
+
+def read_ir_samples(data=None, configs=None, folders=None):
+    """serial load of the IR samples of all the positions in data (see read_ir_sample)"""
+    for i in range(len(configs)):
+        # handle CTRL-C
+        if _CTRL_EXIT_SIGNAL:
+            return
+
+        read_ir_sample((i, configs[i], folders[i], data))
 
 
 def read_sources_listeners(data=None):
@@ -332,8 +345,8 @@ def read_sources_listeners(data=None):
             log.error("compute_sofa: invalid listeners count for {}".format(config["custom"]["audio_folder"]))
             err += 1
 
-        if err == 0:
-            # AES69: receivers do not change specs and calibration between measures
+        # AES69: receivers do not change specs and calibration between measures (same hash: same receivers)
+        if err == 0 and not session_config.same_hash(config, data[0], "receivers_hash"):
             for idx in range(config["setup"]["listeners"][0]["receivers_count"]):
                 receiver_ref = data[0]["setup"]["listeners"][0]["receivers"][idx]
                 receiver_tmp = config["setup"]["listeners"][0]["receivers"][idx]
@@ -348,11 +361,15 @@ def read_sources_listeners(data=None):
                     err += 1
 
         # count listener positions, did the listener move or not?
-        if (err == 0) and (config["setup"]["listeners"][0]["position"] != data[0]["setup"]["listeners"][0]["position"]):
+        if (
+            (err == 0)
+            and not session_config.same_hash(config, data[0], "listener_hash")
+            and (config["setup"]["listeners"][0]["position"] != data[0]["setup"]["listeners"][0]["position"])
+        ):
             rv_listeners_positions_count += 1
 
-        if err == 0:
-            # AES69: emitters do not change specs and calibration between measures
+        # AES69: emitters do not change specs and calibration between measures
+        if err == 0 and not session_config.same_hash(config, data[0], "emitters_hash"):
             for idx in range(config["setup"]["sources"][0]["emitters_count"]):
                 emitter_ref = data[0]["setup"]["sources"][0]["emitters"][idx]
                 emitter_tmp = config["setup"]["sources"][0]["emitters"][idx]
@@ -365,13 +382,19 @@ def read_sources_listeners(data=None):
                     err += 1
 
         # count sources positions, did the listener move or not?
-        if (err == 0) and (config["setup"]["sources"][0]["position"] != data[0]["setup"]["sources"][0]["position"]):
+        if (
+            (err == 0)
+            and not session_config.same_hash(config, data[0], "source_hash")
+            and (config["setup"]["sources"][0]["position"] != data[0]["setup"]["sources"][0]["position"])
+        ):
             rv_sources_positions_count += 1
 
     return err, rv_sources_positions_count, rv_listeners_positions_count
 
 
-def compute_sofa(audio_recording=None, measures_list=None, yaml_params=None):
+def compute_sofa(audio_recording=None, measures_list=None, yaml_params=None, ir_samples=None):
+    """SingleRoomSRIR sofa file of all the receivers. ir_samples: Data_IR already loaded (see
+    compute_sofa_all), used instead of reading the IR samples again (aligned in place with zero_delay)"""
     if audio_recording == None:
         logger.error("compute_sofa: audio_recording is None")
         return
@@ -386,25 +409,23 @@ def compute_sofa(audio_recording=None, measures_list=None, yaml_params=None):
 
     measure_folder_list = []
     measure_audio_config_list = []
+    measure_results_list = []
     measures_list = list(measures_list)
 
     # unpack list
     for m in measures_list:
         measure_folder_list.append(m[0])
         measure_audio_config_list.append(m[1])
+        measure_results_list.append(m[2])
 
     #
-    # POOL: compute process pool size based on CPU/MEM requirements
+    # POOL: loader processes pool size based on CPU requirements (IR samples are
+    # written in the shared memory Data_IR array, see load_ir_samples)
     #
-    mem_bytes = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")  # e.g. 4015976448
-    mem_gib = mem_bytes / (1024.0**3)  # e.g. 3.74
-    cpu_count = min([(os.cpu_count() - 2), yaml_params["cpu_process"]])
-    cpu_count = max([_MIN_CPU_COUNT, cpu_count])
-    if _PLOT_SAVE_GRAPH == 0:
-        max_pool_size = min(cpu_count, int(mem_gib / _MIN_MEM_GB))
-    else:
-        max_pool_size = min(cpu_count, int(mem_gib / _MAX_MEM_GB))
+    max_pool_size = job_scheduler.cpu_pool_size(yaml_params["cpu_process"])
     logger.info("Pool size: {}".format(max_pool_size))
+    shared_ir = None
+    stream_shape = None
 
     # ToDo: remove this print or move to logger!
     logger.info("-" * 80)
@@ -659,9 +680,10 @@ def compute_sofa(audio_recording=None, measures_list=None, yaml_params=None):
         #
         # audio delay for each source position
         sofa.Data_Delay = np.zeros((measures_M, receivers_R))
+        ir_peaks = np.zeros((measures_M, receivers_R), dtype=np.int64)
 
         (err, samples_ir, samples_ir_window) = read_ir_delays(
-            sofa.Data_Delay, measure_audio_config_list, measure_folder_list
+            sofa.Data_Delay, measure_audio_config_list, measure_folder_list, ir_peaks, measure_results_list
         )
 
         #
@@ -681,35 +703,38 @@ def compute_sofa(audio_recording=None, measures_list=None, yaml_params=None):
         # clear audio samples
         sofa.Data_IR = []
 
-        if max_pool_size > 1:
+        if yaml_params.get("stream_write", False) and not sofa_stream.available(sofa):
+            logger.warning("compute sofa: streaming write not supported by sofar {}".format(sof.__version__))
+
+        if ir_samples is not None:
             #
-            # PARALLEL DATA LOAD (multiprocess)
+            # LOADED DATA (see compute_sofa_all)
             #
-            logger.info("audio samples: parallel data load (multiprocessing)")
+            logger.info("audio samples: loaded IR samples")
 
-            sofa.Data_IR = np.zeros((measures_M, receivers_R, samples_ir_window))
+            sofa.Data_IR = ir_samples
 
-            zero_delay = True
-            if yaml_params["zero_delay"] == False:
-                zero_delay = False
-
-            cpu_pool_params = []
-            for i in range(len(measure_audio_config_list)):
-                cpu_pool_params.append(
-                    (
-                        i,
-                        measure_audio_config_list[i],
-                        measure_folder_list[i],
-                        zero_delay,
-                        sofa.Data_IR,
-                    )
-                )
+        elif yaml_params.get("stream_write", False) and sofa_stream.available(sofa):
+            #
+            # STREAMING DATA LOAD: the IR samples are written to the output file as they are loaded
+            # (see sofa_stream), never allocated for all the positions
+            #
+            logger.info("audio samples: streaming data load and write")
 
-            cpu_pool = multiprocessing.pool.ThreadPool(processes=max_pool_size)
-            cpu_pool.map(read_ir_sample, cpu_pool_params)
+            stream_shape = (measures_M, receivers_R, samples_ir_window)
 
-            cpu_pool.close()
-            cpu_pool.join()
+        elif max_pool_size > 1:
+            #
+            # PARALLEL DATA LOAD (multiprocess)
+            #
+            logger.info("audio samples: parallel data load (multiprocessing, shared memory)")
+
+            (sofa.Data_IR, shared_ir) = load_ir_samples(
+                (measures_M, receivers_R, samples_ir_window),
+                measure_audio_config_list,
+                measure_folder_list,
+                processes=max_pool_size,
+            )
 
         else:
             #
@@ -719,14 +744,12 @@ def compute_sofa(audio_recording=None, measures_list=None, yaml_params=None):
             # audio samples for each position
             sofa.Data_IR = np.zeros((measures_M, receivers_R, samples_ir_window))
 
-            if yaml_params["zero_delay"] == False:
-                read_ir_samples(
-                    data=sofa.Data_IR, configs=measure_audio_config_list, folders=measure_folder_list, zero_delay=False
-                )
-            else:
-                read_ir_samples(
-                    data=sofa.Data_IR, configs=measure_audio_config_list, folders=measure_folder_list, zero_delay=True
-                )
+            read_ir_samples(data=sofa.Data_IR, configs=measure_audio_config_list, folders=measure_folder_list)
+
+        #
+        # 3DTune-In requires zero-delay aligned IRs (see align_zero_delay)
+        if yaml_params["zero_delay"] == True and stream_shape is None and not (_CTRL_EXIT_SIGNAL):
+            align_zero_delay(sofa.Data_IR, ir_peaks, measure_folder_list)
 
     #
     # WRITE OUTPUT FILE
@@ -734,17 +757,43 @@ def compute_sofa(audio_recording=None, measures_list=None, yaml_params=None):
 
     if 0 == err:
         if not (_CTRL_EXIT_SIGNAL):
-            sofa.inspect()
-            sofa.verify()
+            if stream_shape is None:
+                sofa.inspect()
+                sofa.verify()
 
             if 0 == err:
                 filepath = measure_folder_list[0].split(measure_config_ref["custom"]["audio_folder"])[0]
                 filename = measure_config_ref["custom"]["project_folder"] + ".sofa"
 
+                # Data.IR chunks and filters (see sofa_stream)
+                layout = sofa_stream.layout_params(yaml_params, receivers_R)
+
                 try:
                     logger.info("compute sofa: file writing ....")
-                    sof.write_sofa(os.path.join(filepath, filename), sofa)
-                    logger.info("compute sofa: output file done: {}".format(filepath + "/" + filename))
+                    if stream_shape is not None:
+                        with sofa_stream.SofaStreamWriter(
+                            os.path.join(filepath, filename), sofa, stream_shape, **layout
+                        ) as w:
+                            err = stream_ir_samples(
+                                w,
+                                measure_audio_config_list,
+                                measure_folder_list,
+                                ir_peaks,
+                                zero_delay=bool(yaml_params["zero_delay"]),
+                                processes=max_pool_size,
+                            )
+                            if err != 0:
+                                w.abort()
+                    else:
+                        sofa_stream.write_sofa(os.path.join(filepath, filename), sofa, **layout)
+
+                    if 0 == err:
+                        logger.info("compute sofa: output file done: {}".format(filepath + "/" + filename))
+                        if yaml_params.get("layout_report", False):
+                            report = sofa_stream.layout_report(os.path.join(filepath, filename))
+                            print("compute sofa: {}".format(sofa_stream.format_report(report)))
+                    else:
+                        print("exiting on user request, output sofa file skipped.\n")
 
                 except:
                     err = -1
@@ -753,6 +802,176 @@ def compute_sofa(audio_recording=None, measures_list=None, yaml_params=None):
             err = -1
             print("exiting on user request, output sofa file skipped.\n")
 
+    # free the shared memory of the parallel data load
+    if shared_ir is not None:
+        sofa.Data_IR = []
+        shared_ir.release()
+
+    return err
+
+
+def update_sofa(audio_recording=None, measures_list=None, yaml_params=None, modified=None):
+    """Update the sofa file of compute_sofa with the positions changed since it was written: config or
+    compute_hrir results newer than the file (modified: latest change time (ns) of each position, see
+    session_index.modified_ns) or a source position not in the file. Their measurements are replaced
+    or appended (see sofa_update), the other positions are not read. Receivers, emitters, sampling
+    rate, IR window and zero_delay must match the file: run compute_sofa without update otherwise."""
+    measures_list = list(measures_list)
+    measure_folder_list = [m[0] for m in measures_list]
+    measure_audio_config_list = [m[1] for m in measures_list]
+    measure_results_list = [m[2] for m in measures_list]
+    measure_config_ref = measure_audio_config_list[0]
+
+    filepath = measure_folder_list[0].split(measure_config_ref["custom"]["audio_folder"])[0]
+    filename = os.path.join(filepath, measure_config_ref["custom"]["project_folder"] + ".sofa")
+    if not os.path.exists(filename):
+        logger.info("sofa update: no {}, computing the whole file".format(filename))
+        return compute_sofa(audio_recording, measures_list, yaml_params)
+
+    sofa_modified = os.stat(filename).st_mtime_ns
+    dimensions = sofa_update.dimensions(filename)
+    layout = sofa_update.read_variables(
+        filename,
+        [
+            "SourcePosition",
+            "ReceiverPosition",
+            "ReceiverDescriptions",
+            "EmitterPosition",
+            "EmitterDescriptions",
+            "Data.SamplingRate",
+            "Data.Delay",
+        ],
+    )
+
+    #
+    # changed positions: replaced (same source position) or appended
+    #
+    changed = []
+    rows = []
+    appended = 0
+    for i, config in enumerate(measure_audio_config_list):
+        position = np.asarray(config["setup"]["sources"][0]["position"]["coord"]["value"], dtype=np.float64)
+        match = np.flatnonzero(np.all(np.abs(layout["SourcePosition"] - position) <= _POSITION_TOLERANCE, axis=1))
+        if len(match) == 0:
+            changed.append(i)
+            rows.append(dimensions["M"] + appended)
+            appended += 1
+        elif modified[i] > sofa_modified:
+            changed.append(i)
+            rows.append(int(match[0]))
+
+    if len(changed) == 0:
+        logger.info("sofa update: {} is up to date".format(filename))
+        return 0
+
+    folders = [measure_folder_list[i] for i in changed]
+    configs = [measure_audio_config_list[i] for i in changed]
+    results = [measure_results_list[i] for i in changed]
+    logger.info(
+        "sofa update: {} positions changed ({} new) of {}".format(len(changed), appended, len(measure_folder_list))
+    )
+
+    #
+    # the same checks of read_sources_listeners, between the changed positions and with the file
+    #
+    (err, sources_positions_count, listeners_positions_count) = read_sources_listeners(configs)
+
+    receivers = configs[0]["setup"]["listeners"][0]["receivers"]
+    emitters = configs[0]["setup"]["sources"][0]["emitters"]
+    receivers_R = int(configs[0]["setup"]["listeners"][0]["receivers_count"])
+    if err == 0 and receivers_R != dimensions["R"]:
+        logger.error("sofa update: {} receivers, {} in {}".format(receivers_R, dimensions["R"], filename))
+        err += 1
+    if err == 0:
+        for idx in range(receivers_R):
+            description = receivers[idx]["short_name"] + " " + receivers[idx]["description"]
+            position = np.asarray(receivers[idx]["position"]["coord"]["value"], dtype=np.float64)
+            if description != layout["ReceiverDescriptions"][idx] or np.any(
+                np.abs(layout["ReceiverPosition"][idx].reshape(-1) - position) > _POSITION_TOLERANCE
+            ):
+                logger.error("sofa update: receiver {} does not match {}".format(idx, filename))
+                err += 1
+    if err == 0 and int(configs[0]["setup"]["sources"][0]["emitters_count"]) != dimensions["E"]:
+        logger.error("sofa update: emitters count does not match {}".format(filename))
+        err += 1
+    if err == 0:
+        for idx in range(dimensions["E"]):
+            description = emitters[idx]["short_name"] + " " + emitters[idx]["description"]
+            position = np.asarray(emitters[idx]["position"]["coord"]["value"], dtype=np.float64)
+            if description != layout["EmitterDescriptions"][idx] or np.any(
+                np.abs(layout["EmitterPosition"][idx].reshape(-1) - position) > _POSITION_TOLERANCE
+            ):
+                logger.error("sofa update: emitter {} does not match {}".format(idx, filename))
+                err += 1
+    if err == 0 and float(audio_recording["samplerate"]) != float(layout["Data.SamplingRate"][0]):
+        logger.error("sofa update: samplerate does not match {}".format(filename))
+        err += 1
+    if err == 0 and bool(yaml_params["zero_delay"]) != bool(np.any(layout["Data.Delay"] != 0)):
+        logger.error("sofa update: zero_delay option does not match {}".format(filename))
+        err += 1
+
+    #
+    # IR samples of the changed positions
+    #
+    samples_ir_window = dimensions["N"]
+    delays = np.zeros((len(changed), receivers_R))
+    ir_peaks = np.zeros((len(changed), receivers_R), dtype=np.int64)
+    if err == 0:
+        (err, samples_ir, samples_ir_window) = read_ir_delays(delays, configs, folders, ir_peaks, results)
+    if err == 0 and samples_ir_window > dimensions["N"]:
+        logger.error(
+            "sofa update: IR window of {} samples, {} in {}".format(samples_ir_window, dimensions["N"], filename)
+        )
+        err += 1
+    if err != 0:
+        logger.error("sofa update: {} does not match the session, run compute_sofa without update".format(filename))
+        return -1
+
+    shape = (len(changed), receivers_R, dimensions["N"])
+    shared = None
+    max_pool_size = job_scheduler.cpu_pool_size(yaml_params["cpu_process"])
+    if max_pool_size > 1:
+        (data, shared) = load_ir_samples(shape, configs, folders, processes=max_pool_size)
+    else:
+        data = np.zeros(shape)
+        read_ir_samples(data=data, configs=configs, folders=folders)
+
+    if yaml_params["zero_delay"] == True and not (_CTRL_EXIT_SIGNAL):
+        align_zero_delay(data, ir_peaks, folders)
+
+    #
+    # WRITE: the measurements variables of the changed positions, as compute_sofa
+    #
+    if not (_CTRL_EXIT_SIGNAL):
+        listener = [config["setup"]["listeners"][0]["position"] for config in configs]
+        source = [config["setup"]["sources"][0]["position"] for config in configs]
+        values = {
+            "Data.IR": data,
+            "Data.Delay": delays if yaml_params["zero_delay"] == True else np.zeros_like(delays),
+            "IRPeakDelay": delays,
+            "MeasurementDate": np.zeros(len(changed)),
+            "SourcePosition": np.asarray([p["coord"]["value"] for p in source], dtype=np.float64),
+            "SourceView": np.asarray([p["view_vect"]["value"] for p in source], dtype=np.float64),
+            "SourceUp": np.asarray([p["up_vect"]["value"] for p in source], dtype=np.float64),
+            "ListenerPosition": np.asarray([p["coord"]["value"] for p in listener], dtype=np.float64),
+            "ListenerView": np.asarray([p["view_vect"]["value"] for p in listener], dtype=np.float64),
+            "ListenerUp": np.asarray([p["up_vect"]["value"] for p in listener], dtype=np.float64),
+        }
+        try:
+            sofa_update.update_measurements(filename, rows, values)
+            logger.info("compute sofa: output file updated: {}".format(filename))
+        except Exception as e:
+            err = -1
+            logger.error("compute sofa: error updating sofa file {}: {}".format(filename, e))
+    else:
+        err = -1
+        print("exiting on user request, output sofa file not updated.\n")
+
+    values = None
+    data = None
+    if shared is not None:
+        shared.release()
+
     return err
 
 
@@ -786,49 +1005,14 @@ if __name__ == "__main__":
     # check if we just want to list devices and quit
     #
     if args1.list_folders:
-        measure_folder_list = []
-        measure_folder_list_subfolder_count = []
-        measure_folder_list_subfolder_format = []
-        # search for available config.yaml for audio measurement folders
-        configs = glob.glob("**/config.yaml", recursive=True)
-        # filter only valid folders
-        for config in configs:
-            if re.search("_xAngle/config.yaml", config):
-                # load config file
-                measure_config = {}
-                try:
-                    with open(config, "r") as file:
-                        measure_config = yaml.safe_load(file)
-                except:
-                    measure_config = None
-
-                if None != measure_config:
-                    # check syntax
-                    if measure_config["syntax"]["name"] == "audio_measure":
-                        # search for IR folder within results
-                        tmp = config.split("/")
-                        tmp = config.split(tmp[-1])
-                        if (os.path.exists(tmp[0] + "ir")) and (0 < len(glob.glob(tmp[0] + "ir/*.wav"))):
-                            # split pattern
-                            tmp = config.split("/")
-                            tmp = config.split(tmp[-2])
-                            if not (tmp[0] in measure_folder_list):
-                                measure_folder_list.append(tmp[0])
-                                measure_folder_list_subfolder_count.append(1)
-                                measure_folder_list_subfolder_format.append(measure_config["custom"]["recording"])
-                            measure_folder_list_subfolder_count[measure_folder_list.index(tmp[0])] += 1
+        # audio measure sessions below the current folder (see session_discovery)
+        measure_folder_list = session_discovery.list_sessions(".", require_ir=True)
 
         if len(measure_folder_list) > 0:
             print("listing available audio measure folders:")
             print("========================================")
-            for i in range(len(measure_folder_list)):
-                print(
-                    measure_folder_list[i]
-                    + ", "
-                    + str(measure_folder_list_subfolder_count[i])
-                    + ", "
-                    + str(measure_folder_list_subfolder_format[i])
-                )
+            for measure_folder, count, recording in measure_folder_list:
+                print(measure_folder + ", " + str(count) + ", " + str(recording))
         else:
             print("no audio measures found.")
         parser.exit(0)
@@ -864,6 +1048,46 @@ if __name__ == "__main__":
             action="store_true",
             help="remove IR delay for 3D_TuneIn_Toolkit",
         )
+        parser.add_argument(
+            "-sw",
+            "--stream_write",
+            action="store_true",
+            default=None,
+            help="write the IR samples of each position as they are loaded (memory bounded by the pool size)",
+        )
+        parser.add_argument(
+            "-u",
+            "--update",
+            action="store_true",
+            default=None,
+            help="update the existing sofa file with the changed and new positions only",
+        )
+        parser.add_argument(
+            "-ck",
+            "--chunks",
+            type=str,
+            help="Data.IR chunk of measurements[,receivers] (0: all receivers), i.e. 1,1 for random access",
+        )
+        parser.add_argument(
+            "-cl",
+            "--compression",
+            type=int,
+            help="zlib compression level, 0 (none) to 9",
+        )
+        parser.add_argument(
+            "-ns",
+            "--no_shuffle",
+            action="store_true",
+            default=None,
+            help="no shuffle filter on Data.IR",
+        )
+        parser.add_argument(
+            "-sz",
+            "--layout_report",
+            action="store_true",
+            default=None,
+            help="report file size and read time of one direction of the output file",
+        )
 
     #
     # no config, use defaults
@@ -900,6 +1124,50 @@ if __name__ == "__main__":
             default=False,
             help="remove IR delay for 3D_TuneIn_Toolkit",
         )
+        parser.add_argument(
+            "-sw",
+            "--stream_write",
+            action="store_true",
+            default=False,
+            help="write the IR samples of each position as they are loaded (memory bounded by the pool size) "
+            "(default: %(default)s)",
+        )
+        parser.add_argument(
+            "-u",
+            "--update",
+            action="store_true",
+            default=False,
+            help="update the existing sofa file with the changed and new positions only (default: %(default)s)",
+        )
+        parser.add_argument(
+            "-ck",
+            "--chunks",
+            type=str,
+            default=None,
+            help="Data.IR chunk of measurements[,receivers] (0: all receivers), i.e. 1,1 for random access "
+            "(default: %(default)s, sofar layout)",
+        )
+        parser.add_argument(
+            "-cl",
+            "--compression",
+            type=int,
+            default=4,
+            help="zlib compression level, 0 (none) to 9 (default: %(default)s)",
+        )
+        parser.add_argument(
+            "-ns",
+            "--no_shuffle",
+            action="store_true",
+            default=False,
+            help="no shuffle filter on Data.IR (default: %(default)s)",
+        )
+        parser.add_argument(
+            "-sz",
+            "--layout_report",
+            action="store_true",
+            default=False,
+            help="report file size and read time of one direction of the output file (default: %(default)s)",
+        )
 
     parser.add_argument(
         "-v",
@@ -987,11 +1255,18 @@ if __name__ == "__main__":
     if yaml_params["measure_folder"] == None:
         sys.exit("\n[ERROR] missing measure folder.")
 
+    try:
+        sofa_stream.layout_params(yaml_params, 1)
+    except ValueError as e:
+        sys.exit("\n[ERROR] {}".format(e))
+
     # audio recording format
     audio_recording = None
 
     measure_folder_list = []
     measure_audio_config_list = []
+    measure_results_list = []
+    measure_modified_list = []
 
     #
     # walk the given folder and search for proper results
@@ -1001,84 +1276,61 @@ if __name__ == "__main__":
 
     logger.info("searching config.yaml: {}".format(yaml_params["measure_folder"]))
 
-    for f in os.walk(yaml_params["measure_folder"]):
-        if os.path.exists(os.path.join(str(f[0]), "config.yaml")):
-            audio_config = ""
-            try:
-                with open(os.path.join(str(f[0]), "config.yaml"), "r") as file:
-                    audio_config = yaml.safe_load(file)
-            except:
-                sys.exit("\n[ERROR] cannot open/parse yaml config file: {}".format(kwargs["ess_yaml_config"]))
+    # configs and compute_hrir results of the positions, parsed only if changed (see session_index)
+    index = session_index.SessionIndex(yaml_params["measure_folder"])
+
+    for folder in session_discovery.position_folders(yaml_params["measure_folder"]):
+        audio_config = ""
+        try:
+            position = index.position(folder)
+            audio_config = position["config"]
+        except:
+            sys.exit("\n[ERROR] cannot open/parse yaml config file: {}".format(kwargs["ess_yaml_config"]))
 
-            error_cnt = 0
+        error_cnt = 0
 
-            # sanity check on consistent audio format
-            if audio_recording == None:
-                audio_recording = audio_config["custom"]["recording"]
-            else:
-                tmp = audio_config["custom"]["recording"]
-                if (
-                    (audio_recording["bit_depth"] != tmp["bit_depth"])
-                    or (audio_recording["format"] != tmp["format"])
-                    or (audio_recording["samplerate"] != tmp["samplerate"])
-                    or (audio_recording["subformat"] != tmp["subformat"])
-                    or (audio_recording["units"] != tmp["units"])
-                ):
-                    logger.error("inconsistent audio recording format on: {}".format(folder))
-                    error_cnt = error_cnt + 1
-
-            # add folder to the list of measures only if a valid config is found
-            try:
-                if not (audio_config["syntax"]["name"] == "audio_measure"):
-                    error_cnt = error_cnt + 1
-            except:
+        # sanity check on consistent audio format
+        if audio_recording == None:
+            audio_recording = audio_config["custom"]["recording"]
+        else:
+            tmp = audio_config["custom"]["recording"]
+            if (
+                (audio_recording["bit_depth"] != tmp["bit_depth"])
+                or (audio_recording["format"] != tmp["format"])
+                or (audio_recording["samplerate"] != tmp["samplerate"])
+                or (audio_recording["subformat"] != tmp["subformat"])
+                or (audio_recording["units"] != tmp["units"])
+            ):
+                logger.error("inconsistent audio recording format on: {}".format(folder))
                 error_cnt = error_cnt + 1
 
-            if error_cnt == 0:
-                # add folder to the list of measures only if impulse_response folder is present
-                for rx in audio_config["setup"]["listeners"][0]["receivers"]:
-                    # check for "far" file
-                    ir_filename = (
-                        "sweep_0_IR_rx_"
-                        + str(rx)
-                        + "_trid_"
-                        + str(audio_config["setup"]["listeners"][0]["receivers"][rx]["track_id"])
-                        + ".far"
-                    )
-                    if os.path.exists(os.path.join(str(f[0]), "ir", ir_filename)):
-                        try:
-                            if os.stat(os.path.join(str(f[0]), "ir", ir_filename)) == 0:
-                                error_cnt = error_cnt + 1
-                        except:
-                            error_cnt = error_cnt + 1
-                    else:
-                        error_cnt = error_cnt + 1
-
-                    # check for "wav" file
-                    ir_filename = (
-                        "sweep_0_IR_rx_"
-                        + str(rx)
-                        + "_trid_"
-                        + str(audio_config["setup"]["listeners"][0]["receivers"][rx]["track_id"])
-                        + ".wav"
-                    )
-                    if os.path.exists(os.path.join(str(f[0]), "ir", ir_filename)):
-                        try:
-                            if os.stat(os.path.join(str(f[0]), "ir", ir_filename)) == 0:
-                                error_cnt = error_cnt + 1
-                        except:
-                            error_cnt = error_cnt + 1
-                    else:
-                        error_cnt = error_cnt + 1
+        # add folder to the list of measures only if a valid config is found
+        try:
+            if not (audio_config["syntax"]["name"] == "audio_measure"):
+                error_cnt = error_cnt + 1
+        except:
+            error_cnt = error_cnt + 1
+
+        # a results bundle, or the .far and .wav files of all the receivers (see session_index)
+        if error_cnt == 0 and not position["results"]["complete"]:
+            error_cnt = error_cnt + 1
 
-            # if everything is there ... add folder to the compute list
-            if error_cnt == 0:
-                measure_folder_list.append(f[0])
-                measure_audio_config_list.append(audio_config)
+        # if everything is there ... add folder to the compute list
+        if error_cnt == 0:
+            measure_folder_list.append(folder)
+            measure_audio_config_list.append(audio_config)
+            measure_results_list.append(position["results"])
+            measure_modified_list.append(session_index.modified_ns(position))
+
+    index.save()
+    logger.info("session index: {}".format(index.report()))
 
     #
     # create SOFA object and fetch impulses
     #
     if len(measure_folder_list) > 0:
-        measures_list = zip(measure_folder_list, measure_audio_config_list)
-        compute_sofa(audio_recording, measures_list, yaml_params)
+        measures_list = zip(measure_folder_list, measure_audio_config_list, measure_results_list)
+        if yaml_params.get("update", False):
+            update_sofa(audio_recording, measures_list, yaml_params, measure_modified_list)
+        else:
+            compute_sofa(audio_recording, measures_list, yaml_params)
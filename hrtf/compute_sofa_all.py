@@ -0,0 +1,426 @@
+#!/usr/bin/env python3
+"""All the sofa files of a session from one read of the IRs: compute_sofa and compute_3dti_sofa variants
+
+runme_all.sh ran compute_sofa once and compute_3dti_sofa for each receivers pair: each run walked the
+session and read the IR files of all the positions again. Here the IRs of all the receivers are
+loaded once (see compute_sofa.load_ir_samples), the SingleRoomSRIR file is written from them (as
+compute_sofa without -z), then the SimpleFreeFieldHRIR file of each receivers pair (compute_hrir
+receivers_pairs, or -s) is cut from them (see compute_3dti_sofa.select_ir_samples) with the -irw, -z
+and -r options of compute_3dti_sofa. Same output files of the separate runs.
+"""
+
+import os
+import sys
+import yaml
+import logging
+import signal
+import argparse
+
+import matplotlib
+import numpy as np
+
+from setproctitle import setproctitle
+
+import sofa_stream
+import session_index
+import session_discovery
+import compute_sofa
+import compute_3dti_sofa
+from compute_hrir import receivers_pairs
+
+logger = logging.getLogger(__name__)
+
+
+#
+# TOOLS
+#
+def signal_handler(sig, frame):
+    # the loaders and the writers check the CTRL-C flag of their own script
+    print("\npressed Ctrl+C\n")
+    compute_sofa._CTRL_EXIT_SIGNAL = 1
+    compute_3dti_sofa._CTRL_EXIT_SIGNAL = 1
+
+
+def find_measures(measure_folder=None):
+    """(audio_recording, folders, configs, results) of the positions with complete compute_hrir results,
+    the same walk and checks of compute_sofa / compute_3dti_sofa"""
+    audio_recording = None
+    folders, configs, results = [], [], []
+
+    # configs and compute_hrir results of the positions, parsed only if changed (see session_index)
+    index = session_index.SessionIndex(measure_folder)
+
+    for folder in session_discovery.position_folders(measure_folder):
+        try:
+            position = index.position(folder)
+            audio_config = position["config"]
+        except:
+            sys.exit("\n[ERROR] cannot open/parse yaml config file: {}".format(folder))
+
+        error_cnt = 0
+
+        # sanity check on consistent audio format
+        if audio_recording == None:
+            audio_recording = audio_config["custom"]["recording"]
+        else:
+            tmp = audio_config["custom"]["recording"]
+            if (
+                (audio_recording["bit_depth"] != tmp["bit_depth"])
+                or (audio_recording["format"] != tmp["format"])
+                or (audio_recording["samplerate"] != tmp["samplerate"])
+                or (audio_recording["subformat"] != tmp["subformat"])
+                or (audio_recording["units"] != tmp["units"])
+            ):
+                logger.error("inconsistent audio recording format on: {}".format(folder))
+                error_cnt = error_cnt + 1
+
+        # add folder to the list of measures only if a valid config is found
+        try:
+            if not (audio_config["syntax"]["name"] == "audio_measure"):
+                error_cnt = error_cnt + 1
+        except:
+            error_cnt = error_cnt + 1
+
+        # a results bundle, or the .far and .wav files of all the receivers (see session_index)
+        if error_cnt == 0 and not position["results"]["complete"]:
+            error_cnt = error_cnt + 1
+
+        if error_cnt == 0:
+            folders.append(folder)
+            configs.append(audio_config)
+            results.append(position["results"])
+
+    index.save()
+    logger.info("session index: {}".format(index.report()))
+    return audio_recording, folders, configs, results
+
+
+def load_ir_samples(configs=None, folders=None, results=None, cpu_process=1):
+    """Data_IR of all the positions and receivers, as compute_sofa loads it, and its shared memory
+    block (None for a serial load, see compute_sofa.load_ir_samples)"""
+    receivers_R = int(configs[0]["setup"]["listeners"][0]["receivers_count"])
+    delays = np.zeros((len(configs), receivers_R))
+    (err, samples_ir, samples_ir_window) = compute_sofa.read_ir_delays(delays, configs, folders, None, results)
+    shape = (len(configs), receivers_R, samples_ir_window)
+
+    max_pool_size = compute_sofa.job_scheduler.cpu_pool_size(cpu_process)
+    logger.info("audio samples: {} IR samples, pool size: {}".format(shape, max_pool_size))
+    if max_pool_size > 1:
+        return compute_sofa.load_ir_samples(shape, configs, folders, processes=max_pool_size)
+
+    data = np.zeros(shape)
+    compute_sofa.read_ir_samples(data=data, configs=configs, folders=folders)
+    return data, None
+
+
+#
+###############################################################################
+# MAIN
+###############################################################################
+#
+
+if __name__ == "__main__":
+    # install CTRL-C handles
+    signal.signal(signal.SIGINT, signal_handler)
+
+    # set user friendly process name for MAIN
+    setproctitle("comp_sofa_all_main")
+
+    # parse input params
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument(
+        "-yp",
+        "--yaml_params",
+        type=str,
+        default=None,
+        help="yaml input params file (default: %(default)s)",
+    )
+
+    args1, remaining = parser.parse_known_args()
+
+    #
+    # do we have a config file? if yes parse WITHOUT defaults
+    #
+    if args1.yaml_params != None:
+        parser = argparse.ArgumentParser(
+            description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter, parents=[parser]
+        )
+        parser.add_argument(
+            "-mf",
+            "--measure_folder",
+            type=str,
+            help="folder with audio sweep measure results",
+        )
+        parser.add_argument(
+            "-c",
+            "--cpu_process",
+            type=int,
+            help="maximum number of CPU process to use",
+        )
+        parser.add_argument(
+            "-z",
+            "--zero_delay",
+            action="store_true",
+            default=None,
+            help="remove IR delay for 3D_TuneIn_Toolkit (receivers pairs files)",
+        )
+        parser.add_argument(
+            "-r",
+            "--remove_direct_path",
+            type=float,
+            help="remove direct_path for 3D_TuneIn_Toolkit (receivers pairs files)",
+        )
+        parser.add_argument(
+            "-irw",
+            "--ir_window",
+            type=float,
+            help="window (ms) to cut IR (receivers pairs files)",
+        )
+        parser.add_argument(
+            "-s",
+            "--select_rx",
+            type=str,
+            help="receivers pairs, separated by ';'",
+        )
+        parser.add_argument(
+            "-ck",
+            "--chunks",
+            type=str,
+            help="Data.IR chunk of measurements[,receivers] (0: all receivers), i.e. 1,1 for random access",
+        )
+        parser.add_argument(
+            "-cl",
+            "--compression",
+            type=int,
+            help="zlib compression level, 0 (none) to 9",
+        )
+        parser.add_argument(
+            "-ns",
+            "--no_shuffle",
+            action="store_true",
+            default=None,
+            help="no shuffle filter on Data.IR",
+        )
+        parser.add_argument(
+            "-sz",
+            "--layout_report",
+            action="store_true",
+            default=None,
+            help="report file size and read time of one direction of the output files",
+        )
+
+    #
+    # no config, use defaults
+    #
+    else:
+        parser = argparse.ArgumentParser(
+            description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter, parents=[parser]
+        )
+        parser.add_argument(
+            "-mf",
+            "--measure_folder",
+            type=str,
+            default=None,
+            help="folder with audio sweep measure results",
+        )
+        parser.add_argument(
+            "-c",
+            "--cpu_process",
+            default=6,
+            type=int,
+            help="maximum number of CPU process to use",
+        )
+        parser.add_argument(
+            "-z",
+            "--zero_delay",
+            action="store_true",
+            default=False,
+            help="remove IR delay for 3D_TuneIn_Toolkit (receivers pairs files) (default: %(default)s)",
+        )
+        parser.add_argument(
+            "-r",
+            "--remove_direct_path",
+            type=float,
+            default=0.0,
+            help="remove direct_path for 3D_TuneIn_Toolkit (receivers pairs files) (default: %(default)s) s",
+        )
+        parser.add_argument(
+            "-irw",
+            "--ir_window",
+            default=0,
+            type=float,
+            help="window (ms) to cut IR (receivers pairs files) (default: %(default)s)",
+        )
+        parser.add_argument(
+            "-s",
+            "--select_rx",
+            type=str,
+            default=";".join(receivers_pairs),
+            help="receivers pairs, separated by ';' (default: %(default)s)",
+        )
+        parser.add_argument(
+            "-ck",
+            "--chunks",
+            type=str,
+            default=None,
+            help="Data.IR chunk of measurements[,receivers] (0: all receivers), i.e. 1,1 for random access "
+            "(default: %(default)s, sofar layout)",
+        )
+        parser.add_argument(
+            "-cl",
+            "--compression",
+            type=int,
+            default=4,
+            help="zlib compression level, 0 (none) to 9 (default: %(default)s)",
+        )
+        parser.add_argument(
+            "-ns",
+            "--no_shuffle",
+            action="store_true",
+            default=False,
+            help="no shuffle filter on Data.IR (default: %(default)s)",
+        )
+        parser.add_argument(
+            "-sz",
+            "--layout_report",
+            action="store_true",
+            default=False,
+            help="report file size and read time of one direction of the output files (default: %(default)s)",
+        )
+
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        default=False,
+        help="verbose (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-log",
+        "--logfile",
+        type=str,
+        default=None,
+        help="log verbose output to file (default: %(default)s)",
+    )
+
+    args, remaining = parser.parse_known_args(remaining)
+
+    #
+    # set debug verbosity
+    #
+    if args.verbose:
+        if args.logfile != None:
+            logging.basicConfig(filename=args.logfile, encoding="utf-8", level=logging.INFO)
+        else:
+            logging.basicConfig(level=logging.INFO)
+    else:
+        logging.basicConfig(level=logging.WARNING)
+
+    #
+    # load params from external config file (if given)
+    #
+    yaml_params = vars(args)
+    if args1.yaml_params != None:
+        params = vars(args)
+        try:
+            with open(args1.yaml_params, "r") as file:
+                yaml_params = yaml.safe_load(file)
+        except:
+            sys.exit("\n[ERROR] cannot open/parse yaml config file: {}".format(args1.yaml_params))
+
+        # console params have priority on default config
+        params = vars(args)
+        for p in params:
+            if (p in yaml_params) and (params[p] != None):
+                yaml_params[p] = params[p]
+
+    #
+    # deallocate args
+    #
+    args1 = []
+    args = []
+
+    # no graphs from the sofa scripts
+    matplotlib.use("Agg")
+
+    #
+    # setup log
+    #
+    logger.info("-" * 80)
+    logger.info("SETUP:")
+    logger.info("-" * 80)
+
+    for p in yaml_params:
+        logger.info("{} : {}".format(str(p), str(yaml_params[p])))
+
+    #
+    # sanity checks to validate input params
+    #
+    if yaml_params["measure_folder"] == None:
+        sys.exit("\n[ERROR] missing measure folder.")
+
+    if not (os.path.isdir(yaml_params["measure_folder"])):
+        sys.exit("\n[ERROR] cannot open folder: {}".format(yaml_params["measure_folder"]))
+
+    #
+    # remove_direct_path must to be used with zero_delay
+    #
+    if (yaml_params["zero_delay"] == False) and (yaml_params["remove_direct_path"] > 0.0):
+        logger.info("BRIR computation with direct path removal requires zero_delay. enabling zero_delay option.")
+        yaml_params["zero_delay"] = True
+
+    # Data.IR chunks and filters of all the files (see sofa_stream)
+    layout = {key: yaml_params.get(key) for key in ("chunks", "compression", "no_shuffle", "layout_report")}
+    layout = {key: value for key, value in layout.items() if value is not None}
+    try:
+        sofa_stream.layout_params(layout, 1)
+    except ValueError as e:
+        sys.exit("\n[ERROR] {}".format(e))
+
+    select_rx = [pair for pair in str(yaml_params["select_rx"]).split(";") if pair != ""]
+
+    #
+    # walk the given folder and search for proper results
+    #
+    logger.info("searching config.yaml: {}".format(yaml_params["measure_folder"]))
+    (audio_recording, folders, configs, results) = find_measures(yaml_params["measure_folder"])
+    if len(folders) == 0:
+        sys.exit("\n[ERROR] no compute_hrir results found in: {}".format(yaml_params["measure_folder"]))
+
+    #
+    # IR samples of all the positions and receivers, read once
+    #
+    (ir_samples, shared_ir) = load_ir_samples(configs, folders, results, yaml_params["cpu_process"])
+
+    err = 0
+    try:
+        # SingleRoomSRIR, all the receivers (as compute_sofa without zero_delay)
+        if not compute_sofa._CTRL_EXIT_SIGNAL:
+            params = {"cpu_process": yaml_params["cpu_process"], "zero_delay": False, **layout}
+            err = compute_sofa.compute_sofa(audio_recording, zip(folders, configs, results), params, ir_samples)
+
+        # SimpleFreeFieldHRIR, one for each receivers pair (as compute_3dti_sofa)
+        for pair in select_rx:
+            if compute_3dti_sofa._CTRL_EXIT_SIGNAL:
+                break
+            params = {
+                "cpu_process": yaml_params["cpu_process"],
+                "zero_delay": bool(yaml_params["zero_delay"]),
+                "remove_direct_path": float(yaml_params["remove_direct_path"]),
+                "ir_window": float(yaml_params["ir_window"]),
+                "select_rx": pair,
+                **layout,
+            }
+            err_pair = compute_3dti_sofa.compute_sofa(
+                audio_recording, zip(folders, configs, results), params, ir_samples
+            )
+            if err_pair:
+                logger.error("compute sofa all: {} failed".format(pair))
+                err = err_pair
+    finally:
+        ir_samples = None
+        if shared_ir is not None:
+            shared_ir.release()
+
+    if err:
+        sys.exit(1)
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""Vectorized peak/onset delay estimation on impulse response tensors (..., samples)
+
+All the functions work on the last axis of an array of any shape, e.g. the (M, R, N) Data_IR
+of a sofa file or the (R, N) receivers of a position, and return one delay for each row.
+"""
+
+import logging
+
+import numpy as np
+import scipy.signal as sig
+
+logger = logging.getLogger(__name__)
+
+#
+# DEFINES / CONSTANT / GLOBALS
+#
+_ONSET_WINDOW = 4  # onset walk: sum of the previous 4 samples compared with peak / 4
+_ONSET_BLOCK = 16  # onset walk: positions checked at once, grows x4 for the rows not yet stopped
+_ONSET_BLOCK_MAX = 1024
+_FRACTION_HALF_WIDTH = 16  # samples on each side of the peak used by the sinc interpolation
+_FRACTION_UPSAMPLING = 32  # sinc interpolation factor (1 = parabolic interpolation only)
+_ROWS_CHUNK = 1024  # rows processed at once, bounds the temporary memory
+
+
+#
+# TOOLS
+#
+def _rows(ir=None):
+    """2D (rows, samples) view of ir"""
+    ir = np.asarray(ir)
+    return ir.reshape(-1, ir.shape[-1])
+
+
+def _parabolic(ym=None, y0=None, yp=None):
+    """vectorized sub-sample offset (-0.5..0.5) of the peak y0, parabola through 3 points"""
+    den = ym - 2 * y0 + yp
+    with np.errstate(divide="ignore", invalid="ignore"):
+        offset = np.where(den != 0, 0.5 * (ym - yp) / den, 0.0)
+    return np.clip(offset, -0.5, 0.5)
+
+
+def peak_samples(ir=None, peaks=None, search=None):
+    """integer peak position of each row: argmax(|ir|) over the first search samples (all if None).
+
+    with peaks, the given positions are kept and only the zero ones are searched
+    (as the zero-delay alignment does for a missing ir_delay_samples).
+    """
+    ir = np.asarray(ir)
+    if peaks is None:
+        return np.argmax(np.abs(ir[..., :search]), axis=-1)
+
+    peaks = np.asarray(peaks).astype(np.int64)
+    missing = peaks == 0
+    if np.any(missing):
+        peaks = np.where(missing, np.argmax(np.abs(ir[..., :search]), axis=-1), peaks)
+    return peaks
+
+
+def peak_fraction(ir=None, peaks=None, upsampling=_FRACTION_UPSAMPLING, half_width=_FRACTION_HALF_WIDTH):
+    """sub-sample offset of the |ir| peak at peaks (same shape of peaks, samples in -1..1)
+
+    the 2 * half_width + 1 samples around the peak are band-limited (sinc) interpolated by the
+    upsampling factor, the offset is the maximum within one sample of the peak refined with a
+    parabola on the interpolated grid. upsampling=1: parabola through the 3 samples of the peak.
+    """
+    rows = _rows(ir)
+    flat_peaks = np.asarray(peaks).astype(np.int64).reshape(-1)
+    n = rows.shape[-1]
+
+    taps = np.arange(-half_width, half_width + 1)
+    rv = np.zeros(len(flat_peaks))
+    for r0 in range(0, len(flat_peaks), _ROWS_CHUNK):
+        p = flat_peaks[r0 : r0 + _ROWS_CHUNK]
+        idx = p[:, None] + taps
+        valid = (idx >= 0) & (idx < n)
+        segment = np.where(valid, np.take_along_axis(rows[r0 : r0 + _ROWS_CHUNK], np.clip(idx, 0, n - 1), axis=1), 0)
+
+        if upsampling > 1:
+            # interpolated samples within one sample of the peak (center of the segment)
+            fine = np.abs(sig.resample(segment, len(taps) * upsampling, axis=-1))
+            center = half_width * upsampling
+            fine = fine[:, center - upsampling - 1 : center + upsampling + 2]
+            i = np.clip(np.argmax(fine[:, 1:-1], axis=1) + 1, 1, fine.shape[1] - 2)
+            k = np.arange(len(p))
+            offset = i + _parabolic(fine[k, i - 1], fine[k, i], fine[k, i + 1]) - (upsampling + 1)
+            fraction = offset / upsampling
+        else:
+            a = np.abs(segment)
+            fraction = _parabolic(a[:, half_width - 1], a[:, half_width], a[:, half_width + 1])
+
+        # no interpolation on the edges of the signal
+        rv[r0 : r0 + _ROWS_CHUNK] = np.where((p > 0) & (p < n - 1), fraction, 0.0)
+
+    return rv.reshape(np.shape(peaks))
+
+
+def peak_delays(ir=None, search=None, upsampling=_FRACTION_UPSAMPLING):
+    """peak delay of each row: (integer peak positions, sub-sample delays), both in samples"""
+    peaks = peak_samples(ir, search=search)
+    return peaks, peaks + peak_fraction(ir, peaks, upsampling=upsampling)
+
+
+def onset_samples(ir=None, peaks=None):
+    """onset of each row: walking back from 4 samples before the peak, the first position where
+    the sum of the previous 4 |ir| samples is not above peak / 4 (stops at sample 4).
+
+    same results of the former compute_delay_adj loop of compute_sofa (peaks 0: argmax of the row).
+    The walk checks blocks of positions at once for all the rows, growing the block for the rows
+    still above the threshold: only a few samples before each peak are read.
+    """
+    rows = _rows(ir)
+    flat_peaks = peak_samples(rows, None if peaks is None else np.asarray(peaks).reshape(-1))
+    w = _ONSET_WINDOW
+
+    # walk start, rows starting at or below the stop sample are returned as they are
+    rv = flat_peaks - w
+    threshold = np.abs(rows[np.arange(len(rows)), flat_peaks]) / w
+
+    pending = np.flatnonzero(rv > w)
+    start = rv[pending]
+    block = _ONSET_BLOCK
+    while len(pending) > 0:
+        # positions start, start - 1, ... start - block + 1 of each pending row
+        j = start[:, None] - np.arange(block)
+        a = np.abs(rows[pending[:, None, None], np.clip(j[:, :, None] - np.arange(w, 0, -1), 0, None)])
+
+        # sum of the previous w samples, added left to right as the former sum_array loop
+        moving = a[:, :, 0]
+        for i in range(1, w):
+            moving = moving + a[:, :, i]
+        stop = (j <= w) | ~(moving > threshold[pending, None])
+
+        found = np.any(stop, axis=1)
+        rv[pending[found]] = j[found, np.argmax(stop[found], axis=1)]
+
+        pending = pending[~found]
+        start = start[~found] - block
+        block = min(4 * block, _ONSET_BLOCK_MAX)
+
+    return rv.reshape(np.shape(ir)[:-1])
+
+
+def offset_samples(peaks=None, samplerate=96000, offset=0.0001):
+    """peaks moved back by offset seconds (truncated to samples), where the peak is after the offset
+
+    same results of the former compute_delay_offset of compute_3dti_sofa for non zero peaks.
+    """
+    peaks = np.asarray(peaks)
+    offset_samples = int(offset * samplerate)
+    return np.where(offset_samples < peaks, peaks - offset_samples, peaks).astype(np.int64)
+
+
+def shift_rows(ir=None, delays=None, length=None, out=None):
+    """ir rows advanced by delays samples (zero padded): out[..., :length] = ir[..., delay:delay + length]
+
+    rows with the same delay are copied at once; out can be ir itself (in place, same length).
+    """
+    rows = _rows(ir)
+    n = rows.shape[-1]
+    length = n if length is None else length
+    flat_delays = np.asarray(delays).astype(np.int64).reshape(-1)
+
+    if out is None:
+        out = np.zeros(np.shape(ir)[:-1] + (length,), dtype=rows.dtype)
+    out_rows = out.reshape(-1, length)
+
+    for d in np.unique(flat_delays):
+        sel = np.flatnonzero(flat_delays == d)
+        t0 = max(0, -d)
+        t1 = min(length, n - d)
+        if t1 > t0:
+            out_rows[sel, t0:t1] = rows[sel, d + t0 : d + t1]
+        else:
+            t1 = t0 = 0
+        out_rows[sel, :t0] = 0
+        out_rows[sel, t1:] = 0
+
+    return out
@@ -5,9 +5,7 @@ from __future__ import division
 import scipy.signal as sig
 
 import os
-import re
 import sys
-import glob
 import yaml
 import logging
 import signal
@@ -26,6 +24,8 @@ import sofar as sof
 from multiprocessing import Pool
 from setproctitle import setproctitle
 
+import session_discovery
+
 from datetime import datetime
 
 
@@ -112,8 +112,8 @@ if __name__ == "__main__":
     if args1.list_folders:
         sofa_file_list = []
 
-        # search for available sofa files
-        sofa_file_list = glob.glob("**/*.sofa", recursive=True)
+        # search for available sofa files (see session_discovery)
+        sofa_file_list = session_discovery.sofa_files(".")
 
         if len(sofa_file_list) > 0:
             print("listing available SOFA audio files:")
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""Per-folder manifest of compute_hrir inputs/params/outputs, to skip up-to-date measures"""
+
+import os
+import hashlib
+import logging
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+#
+# DEFINES / CONSTANT / GLOBALS
+#
+_MANIFEST_FILENAME = "manifest.yaml"  # stored in the measure ir/ subfolder
+_HASH_BLOCK_BYTES = 4 * 1024 * 1024
+
+
+#
+# TOOLS
+#
+def file_hash(filename=None):
+    """sha256 of file content"""
+    h = hashlib.sha256()
+    with open(filename, "rb") as file:
+        for block in iter(lambda: file.read(_HASH_BLOCK_BYTES), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def params_hash(params=None):
+    """sha256 of processing params (dict of plain values)"""
+    return hashlib.sha256(yaml.safe_dump(params, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def input_entry(filename=None, previous=None):
+    """size, mtime and hash of an input file.
+
+    fast path: if size and mtime match the previous manifest entry, the stored hash is reused.
+    """
+    st = os.stat(filename)
+    entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha256": None}
+
+    if previous is not None and previous.get("size") == st.st_size and previous.get("mtime_ns") == st.st_mtime_ns:
+        entry["sha256"] = previous.get("sha256")
+    else:
+        entry["sha256"] = file_hash(filename)
+
+    return entry
+
+
+#
+# MANIFEST
+#
+def manifest_path(folder=None):
+    return os.path.join(str(folder), "ir", _MANIFEST_FILENAME)
+
+
+def read_manifest(folder=None):
+    """previous manifest of folder, None if missing or invalid"""
+    try:
+        with open(manifest_path(folder), "r") as file:
+            manifest = yaml.safe_load(file)
+        if manifest["syntax"]["name"] != "hrir_manifest":
+            return None
+        return manifest
+    except Exception:
+        return None
+
+
+def input_entries(folder=None, inputs=None, manifest=None):
+    """input entries for the given file names (relative to folder)"""
+    previous = {} if manifest is None else manifest.get("inputs", {})
+    return {name: input_entry(os.path.join(str(folder), name), previous.get(name)) for name in inputs}
+
+
+def check_manifest(folder=None, inputs=None, params=None):
+    """Check if the outputs of folder are up to date.
+
+    Returns (valid, reason, inputs): inputs are the current input entries,
+    to be passed to write_manifest after a new computation.
+    """
+    manifest = read_manifest(folder)
+    entries = input_entries(folder, inputs, manifest)
+
+    if manifest is None:
+        return False, "no manifest", entries
+
+    if manifest.get("params_sha256") != params_hash(params):
+        return False, "processing params changed", entries
+
+    previous = manifest.get("inputs", {})
+    for name in entries:
+        if name not in previous or previous[name].get("sha256") != entries[name]["sha256"]:
+            return False, "input changed: {}".format(name), entries
+
+    outputs = manifest.get("outputs", {})
+    if len(outputs) == 0:
+        return False, "no outputs", entries
+
+    for name in outputs:
+        filename = os.path.join(str(folder), "ir", name)
+        if not os.path.exists(filename) or os.path.getsize(filename) != outputs[name]["size"]:
+            return False, "output missing or changed: {}".format(name), entries
+
+    return True, "up to date", entries
+
+
+def write_manifest(folder=None, inputs=None, params=None, outputs=None):
+    """Write the manifest: inputs are entries from check_manifest, outputs file names in ir/"""
+    manifest = {
+        "syntax": {"name": "hrir_manifest", "version": {"major": 0, "minor": 1, "revision": 0}},
+        "inputs": inputs,
+        "params": params,
+        "params_sha256": params_hash(params),
+        "outputs": {
+            name: {"size": os.path.getsize(os.path.join(str(folder), "ir", name))} for name in outputs
+        },
+    }
+
+    filename = manifest_path(folder)
+    filename_tmp = filename + ".tmp"
+    with open(filename_tmp, "w") as outfile:
+        yaml.safe_dump(manifest, outfile, default_flow_style=False)
+    os.replace(filename_tmp, filename)
+
+
+def remove_manifest(folder=None):
+    """Remove the manifest before outputs are (re)written: an interrupted run leaves no valid manifest"""
+    filename = manifest_path(folder)
+    if os.path.exists(filename):
+        os.remove(filename)
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""Single file per measure position with the compute_hrir results of all the receivers (npz bundle)"""
+
+import os
+import logging
+
+import numpy as np
+import pyfar as pf
+
+logger = logging.getLogger(__name__)
+
+#
+# DEFINES / CONSTANT / GLOBALS
+#
+_BUNDLE_SUFFIX = "_IR_bundle.npz"  # stored in the measure ir/ subfolder, prefixed by the audio file name
+_BUNDLE_VERSION = 1
+
+# npz members are stored uncompressed: each array is read (lazily) with a single
+# sequential read, the SOFA loaders never touch the full length "ir" member
+_BUNDLE_COMPRESSED = False
+
+# IR_INFO for pyfar data storage (same layout of compute_hrir)
+_IR_INFO_DELAY = 0
+_IR_INFO_DELAY_SAMPLES = 1
+_IR_INFO_dbFS_CALIB = 2
+_IR_INFO_SAMPLERATE = 3
+
+# bundle members stored as pyfar signals in the .far files
+_SIGNAL_KEYS = ["ir", "ir_norm_hipass_window"]
+
+
+#
+# TOOLS
+#
+def bundle_filename(audio_file=None):
+    """bundle file name (no path) for the given audio file name"""
+    return str(audio_file) + _BUNDLE_SUFFIX
+
+
+def bundle_path(folder=None, config=None):
+    """bundle full path of a measure folder"""
+    return os.path.join(str(folder), "ir", bundle_filename(config["custom"]["audio_filename"]))
+
+
+def has_bundle(folder=None, config=None):
+    """True if the measure folder has a (non empty) bundle"""
+    filename = bundle_path(folder, config)
+    return os.path.exists(filename) and os.path.getsize(filename) > 0
+
+
+#
+# WRITE
+#
+def write_bundle(filename=None, rx_ids=None, track_ids=None, ir=None, ir_norm_hipass_window=None, ir_info=None):
+    """Write the results of all the receivers of one position.
+
+    ir, ir_norm_hipass_window: lists of pyfar signals (one channel each), stacked (zero padded
+    to the longest) as (receivers, samples) arrays, with the original lengths stored aside.
+    ir_info: list of ir_info arrays (see _IR_INFO_*).
+
+    The bundle is written to a temporary file and renamed: readers never see partial files.
+    """
+    ir_samples = np.array([s.n_samples for s in ir], dtype=np.int64)
+    ir_window_samples = np.array([s.n_samples for s in ir_norm_hipass_window], dtype=np.int64)
+
+    ir_data = np.zeros((len(ir), ir_samples.max()))
+    for idx, s in enumerate(ir):
+        ir_data[idx, : s.n_samples] = s.time[0]
+
+    ir_window_data = np.zeros((len(ir_norm_hipass_window), ir_window_samples.max()))
+    for idx, s in enumerate(ir_norm_hipass_window):
+        ir_window_data[idx, : s.n_samples] = s.time[0]
+
+    members = {
+        "version": np.array(_BUNDLE_VERSION),
+        "samplerate": np.array(ir[0].sampling_rate),
+        "rx_id": np.asarray(rx_ids, dtype=np.int64),
+        "track_id": np.asarray(track_ids, dtype=np.int64),
+        "ir": ir_data,
+        "ir_samples": ir_samples,
+        "ir_norm_hipass_window": ir_window_data,
+        "ir_norm_hipass_window_samples": ir_window_samples,
+        "ir_info": np.stack([np.asarray(info, dtype=np.float64) for info in ir_info]),
+    }
+
+    filename_tmp = filename + ".tmp"
+    with open(filename_tmp, "wb") as outfile:
+        if _BUNDLE_COMPRESSED:
+            np.savez_compressed(outfile, **members)
+        else:
+            np.savez(outfile, **members)
+    os.replace(filename_tmp, filename)
+
+
+def remove_bundle(filename=None):
+    """Remove a bundle left by a previous run (results written as per receiver files only)"""
+    if os.path.exists(filename):
+        os.remove(filename)
+
+
+#
+# READ
+#
+def read_results(folder=None, config=None):
+    """Receivers info of a position bundle, same content of the per receiver yaml files.
+
+    Returns {rx_id: {"ir_delay", "ir_delay_samples", "dbFS_calib", "ir_samples",
+    "ir_norm_hipass_window_samples", "samplerate"}}, None if the bundle is missing or invalid.
+    """
+    filename = bundle_path(folder, config)
+    try:
+        with np.load(filename) as bundle:
+            rx_ids = bundle["rx_id"]
+            ir_info = bundle["ir_info"]
+            ir_samples = bundle["ir_samples"]
+            ir_window_samples = bundle["ir_norm_hipass_window_samples"]
+    except Exception:
+        logger.error("ERROR while reading {}".format(filename))
+        return None
+
+    results = {}
+    for idx, rx_id in enumerate(rx_ids):
+        results[int(rx_id)] = {
+            "ir_delay": float(ir_info[idx, _IR_INFO_DELAY]),
+            "ir_delay_samples": int(ir_info[idx, _IR_INFO_DELAY_SAMPLES]),
+            "dbFS_calib": float(ir_info[idx, _IR_INFO_dbFS_CALIB]),
+            "ir_samples": int(ir_samples[idx]),
+            "ir_norm_hipass_window_samples": int(ir_window_samples[idx]),
+            "samplerate": float(ir_info[idx, _IR_INFO_SAMPLERATE]),
+        }
+    return results
+
+
+def read_receivers(folder=None, config=None, keys=None):
+    """Receivers data of a position bundle, same content of the per receiver .far files.
+
+    Returns {rx_id: {key: value}} with pyfar signals for ir/ir_norm_hipass_window and the
+    ir_info array, None if the bundle is missing or invalid. Only the requested keys
+    (default: ir_norm_hipass_window, ir_info) are read from the bundle.
+    """
+    keys = ["ir_norm_hipass_window", "ir_info"] if keys is None else keys
+    filename = bundle_path(folder, config)
+
+    try:
+        with np.load(filename) as bundle:
+            rx_ids = bundle["rx_id"]
+            samplerate = float(bundle["samplerate"])
+            members = {}
+            for key in keys:
+                members[key] = bundle[key]
+                if key in _SIGNAL_KEYS:
+                    members[key + "_samples"] = bundle[key + "_samples"]
+    except Exception:
+        logger.error("ERROR while reading {}".format(filename))
+        return None
+
+    receivers = {}
+    for idx, rx_id in enumerate(rx_ids):
+        receiver = {}
+        for key in keys:
+            if key in _SIGNAL_KEYS:
+                receiver[key] = pf.Signal(members[key][idx, : members[key + "_samples"][idx]], samplerate)
+            else:
+                receiver[key] = members[key][idx]
+        receivers[int(rx_id)] = receiver
+    return receivers
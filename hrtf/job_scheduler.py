@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""Memory-aware task scheduler for the compute scripts (process or thread pools)"""
+
+import os
+import re
+import sys
+import time
+import logging
+import resource
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+logger = logging.getLogger(__name__)
+
+#
+# DEFINES / CONSTANT / GLOBALS
+#
+_MIN_CPU_COUNT = 1  # we need at least one CPU for each compute process
+_MEM_RESERVE_GB = 1.0  # memory left to the system, never assigned to tasks
+_MEM_MARGIN = 1.25  # safety factor applied to the measured per-task peak memory
+_ADMISSION_POLL_s = 0.2  # wait time when a task cannot be admitted (memory)
+_GB = 1024.0**3
+
+
+#
+# TOOLS
+#
+def cpu_pool_size(cpu_process=None):
+    """max number of workers: leave 2 cores to the system, never more than cpu_process"""
+    cpu_count = os.cpu_count() - 2
+    if cpu_process is not None:
+        cpu_count = min(cpu_count, cpu_process)
+    return max(_MIN_CPU_COUNT, cpu_count)
+
+
+def mem_available():
+    """available memory (bytes) from /proc/meminfo, total physical memory if not available"""
+    try:
+        with open("/proc/meminfo", "r") as file:
+            for line in file:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+def reset_peak_rss():
+    """reset the process peak resident memory (VmHWM), linux only"""
+    try:
+        with open("/proc/self/clear_refs", "w") as file:
+            file.write("5")
+    except OSError:
+        pass
+
+
+def peak_rss():
+    """process peak resident memory (bytes) since the last reset, including finished child processes"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    try:
+        with open("/proc/self/status", "r") as file:
+            peak = int(re.search(r"VmHWM:\s+(\d+)", file.read()).group(1)) * 1024
+    except (OSError, AttributeError):
+        pass
+    # external tools (ffmpeg, ...) run as children of the worker
+    return max(peak, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024)
+
+
+def format_time(seconds=0):
+    seconds = int(seconds)
+    return "{:d}:{:02d}:{:02d}".format(seconds // 3600, (seconds % 3600) // 60, seconds % 60)
+
+
+def _run_task(task=None):
+    """worker side: run one task, measure elapsed time and peak memory, never raise: a False result
+    (error handled and logged by func) is a failure"""
+    (func, index, item, measure) = task
+    if measure:
+        reset_peak_rss()
+
+    t0 = time.time()
+    try:
+        result = func(item)
+        error = None if result is not False else "{} returned False".format(getattr(func, "__name__", "task"))
+    except Exception:
+        result = None
+        error = traceback.format_exc()
+
+    return index, result, error, (peak_rss() if measure else None), time.time() - t0
+
+
+#
+# SCHEDULER
+#
+class JobScheduler:
+    """Run func over items with a pool, admitting new tasks only when memory allows it.
+
+    - process mode: each task peak memory is measured in the worker (VmHWM), the
+      largest measured peak (times _MEM_MARGIN) replaces the initial mem_per_task_gb guess
+    - a task is started only if its estimated memory fits both the live MemAvailable and
+      the memory budget left by the running tasks
+    - results are collected as soon as they are ready, with progress/ETA
+    - failed tasks (exception or False result) are retried up to retries times
+    - a worker killed (OOM killer) breaks the process pool: the unfinished tasks are run again
+      in a new pool with half the running tasks and a memory estimate raised to the budget per task
+      that was not enough. A task counts a failed attempt only if it was alone in the broken
+      pool (the one killed, for sure): the pool shrinks to one task, the retries end the run.
+      Each completed task lets one more task run, up to processes, while the estimate fits
+    - thread mode: same scheduling with a thread pool (I/O bound loaders sharing arrays)
+    - keep_pool: the pool (processes workers) is created by the first run() and kept for the next
+      ones (blocks of a stream), until close() or the end of the with block
+    """
+
+    def __init__(
+        self,
+        processes=1,
+        mem_per_task_gb=1.0,
+        mode="process",
+        retries=1,
+        progress=True,
+        name="tasks",
+        keep_pool=False,
+    ):
+        self.processes = max(_MIN_CPU_COUNT, int(processes))
+        self.mode = mode
+        self.retries = retries
+        self.progress = progress
+        self.name = name
+        self.keep_pool = keep_pool
+        self.pool = None
+
+        self.mem_task = mem_per_task_gb * _GB
+        self.mem_peak = 0
+        self.mem_budget = 0
+
+        self.queue = deque()
+        self.running = 0
+        self.pool_size = self.processes
+        self.attempts = {}
+
+    def estimate(self):
+        """estimated memory (bytes) for the next task"""
+        if self.mem_peak > 0:
+            return self.mem_peak * _MEM_MARGIN
+        return self.mem_task
+
+    def admit(self):
+        """True if a new task fits the memory budget (always admit when nothing is running)"""
+        if self.running >= self.pool_size:
+            return False
+        if self.running == 0 or self.mode == "thread":
+            return True
+        need = self.estimate()
+        if (self.running + 1) * need > self.mem_budget:
+            return False
+        return (mem_available() - _MEM_RESERVE_GB * _GB) >= need
+
+    def grow(self, processes=1):
+        """one more running task after a completed one (pool shrunk by a killed worker), up to
+        processes, if the memory estimate admits it"""
+        if self.pool_size < processes and (self.pool_size + 1) * self.estimate() <= self.mem_budget:
+            self.pool_size += 1
+
+    def new_pool(self, processes=1):
+        """pool of processes workers, pool_size limits the running tasks (see admit)"""
+        if self.mode == "thread":
+            return ThreadPoolExecutor(max_workers=processes)
+        return ProcessPoolExecutor(max_workers=processes)
+
+    def open_pool(self, processes=1):
+        """pool for a run() of processes tasks at most: the kept pool if keep_pool"""
+        if not self.keep_pool:
+            return self.new_pool(processes)
+        if self.pool is None:
+            self.pool = self.new_pool(self.processes)
+        return self.pool
+
+    def close(self):
+        """shut down the kept pool (keep_pool)"""
+        if self.pool is not None:
+            self.pool.shutdown(wait=True, cancel_futures=True)
+            self.pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+        return False
+
+    def retry(self, index=None, error=None, items=None):
+        """count a failed attempt of task index: True if it can be retried"""
+        self.attempts[index] += 1
+        if self.attempts[index] <= self.retries:
+            logger.warning(
+                "{}: task {} failed, retry {}/{}:\n{}".format(
+                    self.name, items[index], self.attempts[index], self.retries, error
+                )
+            )
+            return True
+        logger.error("{}: task {} failed:\n{}".format(self.name, items[index], error))
+        return False
+
+    def report(self, done=0, total=0, failed=0, t0=0):
+        if not self.progress:
+            return
+        elapsed = time.time() - t0
+        eta = (elapsed / done) * (total - done) if done > 0 else 0
+        line = "{}: [{}/{}] {:3.0f}%, failed: {}, elapsed: {}, eta: {}".format(
+            self.name, done, total, 100 * done / max(1, total), failed, format_time(elapsed), format_time(eta)
+        )
+        if self.mode == "process":
+            line += ", mem/task: {:.2f} (GB)".format(self.estimate() / _GB)
+        print(line, file=sys.stderr, flush=True)
+
+    def run(self, func=None, items=None):
+        """run func(item) for all the items: returns the results list (None for failed tasks) in items order"""
+        items = list(items)
+        results = [None] * len(items)
+        failed = []
+        if len(items) == 0:
+            return results
+
+        self.queue = deque(range(len(items)))
+        self.attempts = {index: 0 for index in range(len(items))}
+        self.running = 0
+        self.mem_budget = mem_available() - _MEM_RESERVE_GB * _GB
+
+        processes = min(self.processes, len(items))
+        self.pool_size = processes
+        logger.info(
+            "{}: {} tasks, pool size: {} ({}), memory budget: {:.1f} (GB)".format(
+                self.name, len(items), processes, self.mode, self.mem_budget / _GB
+            )
+        )
+
+        measure = self.mode == "process"
+        pool = self.open_pool(processes)
+        futures = {}  # future: item index
+        t0 = time.time()
+        done = 0
+        try:
+            while len(self.queue) > 0 or len(futures) > 0:
+                # start the tasks that fit the memory budget
+                while len(self.queue) > 0 and self.admit():
+                    index = self.queue.popleft()
+                    futures[pool.submit(_run_task, (func, index, items[index], measure))] = index
+                    self.running += 1
+
+                finished, _ = wait(futures, timeout=_ADMISSION_POLL_s, return_when=FIRST_COMPLETED)
+                broken = False
+                for future in finished:
+                    if isinstance(future.exception(), BrokenProcessPool):
+                        broken = True  # with the other unfinished tasks below
+                        continue
+                    index = futures.pop(future)
+                    self.running -= 1
+                    try:
+                        index, result, error, peak, elapsed = future.result()
+                    except Exception:
+                        result, error, peak, elapsed = None, traceback.format_exc(), None, 0.0  # pickling
+
+                    if peak is not None:
+                        self.mem_peak = max(self.mem_peak, peak)
+                    if error is None:
+                        results[index] = result
+                        done += 1
+                        self.grow(processes)
+                    elif self.retry(index, error, items):
+                        self.queue.append(index)
+                    else:
+                        failed.append(index)
+                        done += 1
+
+                    logger.info("{}: task {} done in {:.1f} (s)".format(self.name, items[index], elapsed))
+                    self.report(done, len(items), len(failed), t0)
+
+                if broken:
+                    unfinished = sorted(futures.values())
+                    futures = {}
+                    self.running = 0
+                    pool.shutdown(wait=True, cancel_futures=True)
+                    self.pool = None
+
+                    # a worker was killed (memory): fewer workers, a larger estimate
+                    self.pool_size = max(_MIN_CPU_COUNT, len(unfinished) // 2)
+                    self.mem_peak = max(self.mem_peak, self.mem_budget / len(unfinished) / _MEM_MARGIN)
+                    logger.error(
+                        "{}: worker killed (out of memory?) running {}, pool size: {}, mem/task: {:.2f} (GB)".format(
+                            self.name, [items[i] for i in unfinished], self.pool_size, self.estimate() / _GB
+                        )
+                    )
+                    retried = [i for i in unfinished if len(unfinished) > 1 or self.retry(i, "worker killed", items)]
+                    self.queue.extendleft(reversed(retried))
+                    for index in unfinished:
+                        if index not in retried:
+                            failed.append(index)
+                            done += 1
+                            self.report(done, len(items), len(failed), t0)
+                    pool = self.open_pool(processes)
+        finally:
+            if pool is not self.pool:
+                pool.shutdown(wait=True, cancel_futures=True)
+
+        if len(failed) > 0:
+            logger.error("{}: {} failed tasks: {}".format(self.name, len(failed), [items[i] for i in failed]))
+
+        return results
+
+
+def run_tasks(
+    func=None, items=None, processes=1, mem_per_task_gb=1.0, mode="process", retries=1, progress=True, name="tasks"
+):
+    """run func over items with a JobScheduler, see JobScheduler"""
+    scheduler = JobScheduler(
+        processes=processes, mem_per_task_gb=mem_per_task_gb, mode=mode, retries=retries, progress=progress, name=name
+    )
+    return scheduler.run(func, items)
@@ -0,0 +1,322 @@
+#!/usr/bin/env python3
+"""Plot HRIR results (ir/*.far) computed by compute_hrir"""
+
+import os
+import sys
+import logging
+import argparse
+from functools import partial
+
+import matplotlib
+import matplotlib.pyplot as plt
+
+import numpy as np
+import pyfar as pf
+from setproctitle import setproctitle
+
+import ir_bundle
+import track_reader
+import job_scheduler
+import session_config
+import session_discovery
+import octave_smoothing
+
+logger = logging.getLogger(__name__)
+
+#
+# DEFINES / CONSTANT / GLOBALS
+#
+_MAX_MEM_GB = 3.5  # initial memory guess for each plot process (then measured, see job_scheduler)
+
+_PLOT_TYPES = ["ir_tf", "tfs", "xy"]  # ir+tf, transfer functions, recorded stimulus/response
+_PLOT_FORMATS = ["png", "pdf"]
+
+
+#
+# TOOLS
+#
+def save_plot(folder=None, name=None, formats=None, dpi=300, show=False):
+    """save current figure in plots/<format>/ subfolders (and/or show it), then close it"""
+    if show:
+        plt.show()
+    for fmt in formats:
+        plot_path = os.path.join(str(folder), "plots", fmt)
+        os.makedirs(plot_path, exist_ok=True)
+        plt.savefig(os.path.join(plot_path, "{}.{}".format(name, fmt)), dpi=dpi)
+    plt.close()
+
+
+def read_receivers(folder=None, config=None):
+    """read ir/*.far (or bundle) results of all the receivers: list of (rx_id, track_id, ir, ir_norm_hipass_window)"""
+    audio_file = config["custom"]["audio_filename"]
+    receivers = config["setup"]["listeners"][0]["receivers"]
+
+    bundle_receivers = None
+    if ir_bundle.has_bundle(folder, config):
+        bundle_receivers = ir_bundle.read_receivers(folder, config, keys=["ir", "ir_norm_hipass_window"])
+
+    results = []
+    for rx_id in range(config["setup"]["listeners"][0]["receivers_count"]):
+        rx_track_id = receivers[rx_id]["track_id"]
+        if bundle_receivers is not None:
+            if rx_id not in bundle_receivers:
+                logger.error("plot hrir: missing rx_id {} in {}".format(rx_id, ir_bundle.bundle_path(folder, config)))
+                continue
+            ir_data = bundle_receivers[rx_id]
+            results.append((rx_id, rx_track_id, ir_data["ir"], ir_data["ir_norm_hipass_window"]))
+            continue
+
+        ir_filename = os.path.join(
+            str(folder), "ir", "{}_IR_rx_{}_trid_{}.far".format(audio_file, str(rx_id), str(rx_track_id))
+        )
+        try:
+            ir_data = pf.io.read(ir_filename)
+        except Exception:
+            logger.error("plot hrir: missing or invalid result: {}".format(ir_filename))
+            continue
+        results.append((rx_id, rx_track_id, ir_data["ir"], ir_data["ir_norm_hipass_window"]))
+
+    return results
+
+
+#
+# PLOT FUNCTIONS
+#
+def plot_hrir(folder=None, plots=None, formats=None, dpi=300, smoothing=False, show=False):
+    """render the plots of one measure folder from the saved results"""
+    plots = _PLOT_TYPES[:2] if plots is None else plots
+    formats = ["png"] if formats is None else formats
+
+    try:
+        config = session_config.read_yaml(os.path.join(str(folder), "config.yaml"))
+    except:
+        logger.error("plot hrir: invalid config in folder {}".format(folder))
+        return
+
+    source_position_str = ",".join(str(x) for x in config["setup"]["sources"][0]["position_copy"]["coord"]["value"])
+    setproctitle("plot_" + "_".join(str(x) for x in config["setup"]["sources"][0]["position_copy"]["coord"]["value"]))
+    audio_file = config["custom"]["audio_filename"]
+
+    logger.info("plot hrir: >>> source {}".format(source_position_str))
+
+    receivers = read_receivers(folder, config)
+    if len(receivers) == 0:
+        return
+
+    # 1/6 octave smoothing, all the receivers at once
+    if "tfs" in plots:
+        ir_window_smooth = octave_smoothing.smooth_magnitude(
+            np.stack([np.abs(rx[3].freq_raw[0]) for rx in receivers]), num_fractions=6
+        )
+        if smoothing:
+            ir_smooth = octave_smoothing.smooth_magnitude(
+                np.stack([np.abs(rx[2].freq_raw[0]) for rx in receivers]), num_fractions=6
+            )
+
+    # recorded stimulus and receivers tracks
+    if "xy" in plots:
+        tx_track_id = config["setup"]["sources"][0]["emitters"][0]["track_id"]
+        audio_tracks = list(dict.fromkeys([tx_track_id] + [rx[1] for rx in receivers]))
+        track_col = {track: col for col, track in enumerate(audio_tracks)}
+        data, _ = track_reader.read_tracks(
+            os.path.join(str(folder), audio_file + "." + config["custom"]["recording"]["format"]), tracks=audio_tracks
+        )
+
+    plt.rcParams["figure.figsize"] = [16, 9]
+
+    for idx, (rx_id, rx_track_id, ir, ir_norm_hipass_window) in enumerate(receivers):
+        plot_suffix = "rx_{}_trid_{}".format(str(rx_id), str(rx_track_id))
+
+        if "xy" in plots:
+            plt.figure()
+            plt.clf()
+            plt.subplot(2, 1, 2)
+            plt.plot(data[:, track_col[rx_track_id]])
+            plt.grid()
+            plt.title("recorded_y(t), source {}".format(source_position_str))
+
+            plt.subplot(2, 1, 1)
+            plt.plot(data[:, track_col[tx_track_id]])
+            plt.grid()
+            plt.title("ess_sweep(t), source {}".format(source_position_str))
+
+            save_plot(folder, "{}_xy_{}".format(audio_file, plot_suffix), formats, dpi, show)
+
+        # NOTE: since IR has been calibrated to 0dB from the d_xsweep and i_xsweep, all the plots
+        #       can be done using log_reference=1 for 0dB level.
+        if "ir_tf" in plots:
+            plt.figure()
+            ax = pf.plot.time_freq(ir, dB_time=True, color=[0.6, 0.6, 0.6], label="raw", log_reference=1)
+            pf.plot.time_freq(ir_norm_hipass_window, dB_time=True, label="post-processed", log_reference=1)
+            ax[0].set_xlim(0, 0.8)
+            ax[0].set_ylim(-140, 0)
+            ax[1].legend(loc="lower left")
+            ax[0].set_title(
+                "Measured IR and TF, source: {}, listener_rx: {}, track_id: {}".format(
+                    source_position_str, str(rx_id), str(rx_track_id)
+                )
+            )
+            save_plot(folder, "{}_ir_tf_{}".format(audio_file, plot_suffix), formats, dpi, show)
+
+        if "tfs" in plots:
+            plt.figure()
+            ax = pf.plot.freq(ir, dB=True, label="Original HRTF", color="grey", log_reference=1)
+            if smoothing:
+                pf.plot.freq(
+                    pf.Signal(ir_smooth[idx], ir.sampling_rate, n_samples=ir.n_samples, domain="freq"),
+                    dB=True,
+                    label="Original (1/6th octave) HRTF",
+                    color="blue",
+                    log_reference=1,
+                )
+            pf.plot.freq(
+                pf.Signal(
+                    ir_window_smooth[idx],
+                    ir_norm_hipass_window.sampling_rate,
+                    n_samples=ir_norm_hipass_window.n_samples,
+                    domain="freq",
+                ),
+                dB=True,
+                label="Filtered HRTF (hipass, crop, smooth)",
+                color="red",
+                log_reference=1,
+            )
+            ax.set_title(
+                "Measured TF, source: {}, listener_rx: {}, track_id: {}".format(
+                    source_position_str, str(rx_id), str(rx_track_id)
+                )
+            )
+            ax.legend()
+            save_plot(folder, "{}_tfs_{}".format(audio_file, plot_suffix), formats, dpi, show)
+
+    logger.info("plot hrir: <<< source: " + source_position_str + " done.")
+
+
+def plot_folders(folders=None, cpu_process=6, plots=None, formats=None, dpi=300, smoothing=False, show=False):
+    """render plots of all the measure folders with a process pool (serially when showing plots)"""
+    plot_func = partial(plot_hrir, plots=plots, formats=formats, dpi=dpi, smoothing=smoothing, show=show)
+
+    if show:
+        for folder in folders:
+            plot_func(folder)
+        return
+
+    job_scheduler.run_tasks(
+        plot_func,
+        folders,
+        processes=job_scheduler.cpu_pool_size(cpu_process),
+        mem_per_task_gb=_MAX_MEM_GB,
+        name="plot_hrir",
+    )
+
+
+###############################################################################
+# MAIN
+###############################################################################
+#
+if __name__ == "__main__":
+    setproctitle("plot_hrir_main")
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "-mf",
+        "--measure_folder",
+        type=str,
+        default=None,
+        help="folder with compute_hrir results (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-c",
+        "--cpu_process",
+        default=6,
+        type=int,
+        help="maximum number of CPU process to use (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-p",
+        "--plots",
+        type=str,
+        default="ir_tf,tfs",
+        help="comma separated list of plots: {} (default: %(default)s)".format(",".join(_PLOT_TYPES)),
+    )
+    parser.add_argument(
+        "-fmt",
+        "--formats",
+        type=str,
+        default="png",
+        help="comma separated list of output formats: {} (default: %(default)s)".format(",".join(_PLOT_FORMATS)),
+    )
+    parser.add_argument(
+        "-dpi",
+        "--dpi",
+        type=int,
+        default=150,
+        help="resolution of saved plots (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-sm",
+        "--smoothing",
+        action="store_true",
+        default=False,
+        help="add the 1/6 octave smoothed raw HRTF to the tfs plots (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-s",
+        "--show",
+        action="store_true",
+        default=False,
+        help="show plots (single process) instead of saving only (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        default=False,
+        help="verbose (default: %(default)s)",
+    )
+
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+    else:
+        logging.basicConfig(level=logging.WARNING)
+
+    plots = [p.strip() for p in args.plots.split(",") if p.strip() != ""]
+    formats = [f.strip().lower() for f in args.formats.split(",") if f.strip() != ""]
+    for p in plots:
+        if p not in _PLOT_TYPES:
+            sys.exit("\n[ERROR] unknown plot: {}".format(p))
+    for f in formats:
+        if f not in _PLOT_FORMATS:
+            sys.exit("\n[ERROR] unknown format: {}".format(f))
+
+    if args.measure_folder == None:
+        sys.exit("\n[ERROR] missing measure folder.")
+    if not (os.path.isdir(args.measure_folder)):
+        sys.exit("\n[ERROR] cannot open folder: {}".format(args.measure_folder))
+
+    # matplotlib to allow saving graphs
+    if not args.show:
+        matplotlib.use("Agg")
+
+    #
+    # walk the given folder and search for computed results
+    #
+    measure_folder_list = []
+    for folder, listing in session_discovery.scan(args.measure_folder):
+        if listing["config"] is not None and "ir" in listing["dirs"]:
+            measure_folder_list.append(folder)
+
+    if len(measure_folder_list) == 0:
+        sys.exit("\n[ERROR] no compute_hrir results in: {}".format(args.measure_folder))
+
+    plot_folders(
+        sorted(measure_folder_list),
+        cpu_process=args.cpu_process,
+        plots=plots,
+        formats=formats,
+        dpi=args.dpi,
+        smoothing=args.smoothing,
+        show=args.show,
+    )
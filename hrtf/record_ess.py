@@ -12,9 +12,13 @@ import numpy as np
 import sounddevice as sd
 import soundfile as sf
 import queue
+import time
 
 import logging
 
+import sweep_sequence
+import rotation_nlms
+
 logger = logging.getLogger(__name__)
 
 
@@ -131,6 +135,8 @@ async def play_expsweep(
     playback_prepadding=2,
     playback_postpadding=2,
     playback_beep=0,
+    playback_repeat=1,
+    playback_interleave=0,
     cli=False,
     **kwargs,
 ):
@@ -139,6 +145,10 @@ async def play_expsweep(
 
     start_idx = 0
 
+    # interleaved sweeps (see sweep_sequence): playback_repeat sweeps every playback_interleave seconds,
+    # overlapping sweeps are scaled to keep the sum below playback_amplitude
+    sweep_amplitude = sweep_sequence.sweep_amplitude(playback_amplitude, playback_duration, playback_interleave)
+
     def ess_callback(outdata, frames, time, status) -> None:
         nonlocal start_idx
         nonlocal samplerate
@@ -149,6 +159,9 @@ async def play_expsweep(
         nonlocal playback_prepadding
         nonlocal playback_postpadding
         nonlocal playback_beep
+        nonlocal playback_repeat
+        nonlocal playback_interleave
+        nonlocal sweep_amplitude
         nonlocal verbose
         nonlocal event
 
@@ -159,14 +172,13 @@ async def play_expsweep(
         f1 = frequency_begin
         f2 = frequency_end
         fs = samplerate
-        # duration and zero padding
+        # duration and zero padding (duration of all the sweeps of the sequence)
         P_pre = int(playback_prepadding)
         P_post = int(playback_postpadding)
-        T = playback_duration
+        T = sweep_sequence.sequence_duration(playback_duration, playback_repeat, playback_interleave)
 
-        # compute pre/post padding idx in samples count
+        # compute pre padding idx in samples count
         P_pre_idx = int(P_pre * fs)
-        P_post_idx = int((P_pre + T) * fs)
 
         # prepare empty chunk
         outdata[:] = np.zeros((frames, 1))
@@ -186,35 +198,21 @@ async def play_expsweep(
                 # fading sine beep
                 outdata[:] = (playback_amplitude / 2) * np.sin((2 * np.pi * 1000) * t)
 
-        # return silence OR audio (or a mix of both)
+        # return silence OR audio (or a mix of both): sine sweep(s) after the pre padding
         if (start_idx + frames) > (P_pre_idx):
-            if start_idx > P_pre_idx:
-                frames_audio = frames
-                start_audio_idx = start_idx
-                # sweep time range
-                t = ((start_idx - P_pre_idx) + np.arange(frames_audio)) / samplerate
-            else:
-                frames_audio = (start_idx + frames) - P_pre_idx
-                start_audio_idx = P_pre_idx
-                # t = ((P_pre_idx - start_idx) + np.arange(frames_audio)) / samplerate
-                t = (np.arange(frames_audio)) / samplerate
-
-            t = t.reshape(-1, 1)
-
-            # sine sweep
-            R = np.log(f2 / f1)
-            outdata[(frames - frames_audio) :] = playback_amplitude * np.sin(
-                (2 * np.pi * f1 * T / R) * (np.exp(t * R / T) - 1)
+            outdata[:] = sweep_sequence.sequence_block(
+                start=start_idx,
+                frames=frames,
+                samplerate=fs,
+                frequency_begin=f1,
+                frequency_end=f2,
+                duration=playback_duration,
+                prepadding=P_pre,
+                amplitude=sweep_amplitude,
+                repeat=playback_repeat,
+                interleave=playback_interleave,
             )
 
-            # set to zero extra samples
-            if (start_idx + frames) > (P_post_idx):
-                if start_idx < P_post_idx:
-                    # outdata[int(T * fs) - (start_idx + frames) :] = 0
-                    outdata[(P_post_idx - start_idx) :] = 0
-                else:
-                    outdata[:] = 0
-
         start_idx += frames
 
     try:
@@ -224,6 +222,12 @@ async def play_expsweep(
         logger.info("frequency_end    [Hz]: " + str(frequency_end))
         logger.info("duration:         [s]: " + str(playback_duration))
         logger.info("amplitude            : " + str(playback_amplitude))
+        if playback_interleave > 0:
+            logger.info(
+                "interleaved sweeps   : {} every {} [s], amplitude {}".format(
+                    playback_repeat, playback_interleave, sweep_amplitude
+                )
+            )
         logger.info("sampling rate    [Hz]: " + str(samplerate))
 
         # SANITY CHECK: verify audio recording format capabilities
@@ -256,6 +260,105 @@ async def play_expsweep(
     logger.info("play_ess. done.")
 
 
+async def play_periodic(
+    event=None,
+    device=None,
+    verbose=False,
+    playback_amplitude=0.1,
+    samplerate=96000,
+    playback_prepadding=2,
+    playback_postpadding=2,
+    rotation_period=1.0,
+    rotation=None,
+    cli=False,
+    **kwargs,
+):
+    """Perfect sweep in loop (see rotation_nlms) until rotation["stop"] (threading.Event) is set:
+    the playback ends at the next period boundary, after the post padding.
+
+    rotation["start"] is set to the time.monotonic() DAC time of the first period sample, and
+    rotation["started"] (threading.Event) set, rotation["periods"] to the periods played.
+    """
+    loop = asyncio.get_event_loop()
+
+    start_idx = 0
+    stop_idx = None
+
+    fs = samplerate
+    P_pre_idx = int(playback_prepadding * fs)
+    P_post_idx = int(playback_postpadding * fs)
+    period = rotation_nlms.perfect_sweep(rotation_nlms.period_samples(rotation_period, fs))
+
+    def periodic_callback(outdata, frames, time_info, status) -> None:
+        nonlocal start_idx
+        nonlocal stop_idx
+
+        if status:
+            logger.debug(status, file=sys.stderr)
+
+        # the period playing when the stop is requested is the last one
+        if stop_idx is None and rotation["stop"].is_set():
+            played = max(0, start_idx + frames - P_pre_idx)
+            stop_idx = P_pre_idx + len(period) * int(np.ceil(played / len(period)))
+            rotation["periods"] = (stop_idx - P_pre_idx) // len(period)
+
+        # early exit on end of stream (last period + post padding)
+        if stop_idx is not None and start_idx > stop_idx + P_post_idx:
+            loop.call_soon_threadsafe(event.set)
+            raise sd.CallbackStop()
+
+        # time of the first period sample: encoder positions are logged on the same clock
+        if not rotation["started"].is_set() and (start_idx + frames) > P_pre_idx:
+            rotation["start"] = (
+                time.monotonic()
+                + (time_info.outputBufferDacTime - time_info.currentTime)
+                + (P_pre_idx - start_idx) / fs
+            )
+            rotation["started"].set()
+
+        outdata[:] = rotation_nlms.periodic_block(
+            period=period,
+            start=start_idx,
+            frames=frames,
+            prepadding=P_pre_idx,
+            amplitude=playback_amplitude,
+            stop=stop_idx,
+        )
+
+        start_idx += frames
+
+    try:
+        logger.info("perfect sweep period [s]: " + str(len(period) / fs))
+        logger.info("amplitude            : " + str(playback_amplitude))
+        logger.info("sampling rate    [Hz]: " + str(samplerate))
+
+        # SANITY CHECK: verify audio recording format capabilities
+        try:
+            sd.check_output_settings(device=device, samplerate=samplerate)
+        except:
+            logger.error("unsupported audio playback format {}".format(samplerate))
+
+        # playback stream
+        stream = sd.OutputStream(
+            device=device, channels=2, blocksize=10240, samplerate=samplerate, callback=periodic_callback, **kwargs
+        )
+
+        with stream:
+            if cli:
+                print("#" * 80)
+                print("press CTRL-C to stop playback")
+                print("#" * 80)
+            await event.wait()
+
+    except KeyboardInterrupt:
+        parser.exit("")
+
+    except Exception as e:
+        parser.exit(type(e).__name__ + ": " + str(e))
+
+    logger.info("play_periodic. done.")
+
+
 async def record_audio(
     event=None,
     device=None,
@@ -323,10 +426,8 @@ async def record_audio(
 #
 # ASYNCIO - MAIN
 #
-async def playrecord(cli=False, **kwargs):
-    event = asyncio.Event()
-
-    # preamble with silence for RME sync
+async def preamble(event=None, cli=False, **kwargs):
+    """silence (and beep) recorded in sweep_99 for RME sync"""
     event.clear()
     asyncio.gather(
         record_audio(
@@ -349,7 +450,20 @@ async def playrecord(cli=False, **kwargs):
     )
     await event.wait()
 
-    for r in range(kwargs["playback_repeat"]):
+
+async def playrecord(cli=False, **kwargs):
+    event = asyncio.Event()
+
+    # preamble with silence for RME sync
+    await preamble(event=event, cli=cli, **kwargs)
+
+    # interleaved sweeps: all the repeats in the same recording (sweep_0)
+    playback_interleave = kwargs.get("playback_interleave", 0)
+    recordings, sweeps = kwargs["playback_repeat"], 1
+    if playback_interleave > 0:
+        recordings, sweeps = 1, kwargs["playback_repeat"]
+
+    for r in range(recordings):
         event.clear()
 
         asyncio.gather(
@@ -372,6 +486,8 @@ async def playrecord(cli=False, **kwargs):
                 playback_duration=kwargs["playback_duration"],
                 playback_postpadding=kwargs["playback_postpadding"],
                 playback_prepadding=kwargs["playback_prepadding"],
+                playback_repeat=sweeps,
+                playback_interleave=playback_interleave,
                 cli=cli,
             ),
         )
@@ -379,7 +495,42 @@ async def playrecord(cli=False, **kwargs):
         await event.wait()
 
 
-def run_main(**kwargs):
+async def playrecord_rotation(cli=False, rotation=None, **kwargs):
+    """one recording (sweep_0) of the perfect sweep in loop while the table turns, see play_periodic"""
+    event = asyncio.Event()
+
+    # preamble with silence for RME sync
+    await preamble(event=event, cli=cli, **kwargs)
+
+    event.clear()
+    asyncio.gather(
+        record_audio(
+            event=event,
+            device=kwargs["input_device"],
+            playback_repeat=0,
+            measure_folder=kwargs["measure_folder"],
+            measure_name=kwargs["measure_name"],
+            cli=cli,
+        ),
+        play_periodic(
+            event=event,
+            verbose=kwargs["verbose"],
+            device=kwargs["output_device"],
+            playback_amplitude=kwargs["playback_amplitude"],
+            samplerate=kwargs["samplerate"],
+            playback_prepadding=kwargs["playback_prepadding"],
+            playback_postpadding=kwargs["playback_postpadding"],
+            rotation_period=kwargs["rotation_period"],
+            rotation=rotation,
+            cli=cli,
+        ),
+    )
+    await event.wait()
+
+
+def write_config(rotation=None, **kwargs):
+    """config.yaml of the recording folder: the ESS config updated with the recording params,
+    with rotation (dict, continuous rotation recordings) the stimulus is a perfect sweep in loop"""
     # load and update config file for this recording session
     ess_config = []
 
@@ -396,6 +547,10 @@ def run_main(**kwargs):
         ess_config["custom"]["stimulus"]["sweep"]["amplitude"]["value"] = kwargs["playback_amplitude"]
         ess_config["custom"]["stimulus"]["sweep"]["duration"]["value"] = kwargs["playback_duration"]
         ess_config["custom"]["stimulus"]["sweep"]["repeat"]["value"] = kwargs["playback_repeat"]
+        ess_config["custom"]["stimulus"]["sweep"]["interleave"] = {
+            "value": kwargs.get("playback_interleave", 0),
+            "units": "s",
+        }
         ess_config["custom"]["stimulus"]["sweep"]["frequency"]["begin"] = kwargs["frequency_begin"]
         ess_config["custom"]["stimulus"]["sweep"]["frequency"]["end"] = kwargs["frequency_end"]
         ess_config["custom"]["stimulus"]["sweep"]["frequency"]["units"] = "hertz"
@@ -415,6 +570,11 @@ def run_main(**kwargs):
         ess_config["custom"]["audio_folder"] = kwargs["measure_name"]
         ess_config["custom"]["audio_filename"] = "sweep_0"
 
+        # continuous rotation: perfect sweep in loop (see rotation_nlms)
+        if rotation is not None:
+            ess_config["custom"]["stimulus"]["type"] = "perfect_sweep"
+            ess_config["custom"]["rotation"] = rotation
+
         # update general section
         ess_config["general"]["date_modified"] = datetime.date.today()
 
@@ -434,10 +594,21 @@ def run_main(**kwargs):
             )
         )
 
+
+def run_main(**kwargs):
+    write_config(**kwargs)
+
     # uncomment this line to run audio recording
     return asyncio.run(playrecord(**kwargs))
 
 
+def run_rotation(rotation=None, config=None, **kwargs):
+    """continuous rotation recording: rotation (dict) shared with the table thread, see play_periodic,
+    config (dict) written in config.yaml (custom.rotation)"""
+    write_config(rotation=config, **kwargs)
+    return asyncio.run(playrecord_rotation(rotation=rotation, **kwargs))
+
+
 #
 # MAIN
 #
@@ -509,6 +680,13 @@ if __name__ == "__main__":
         default=1,
         help="sweep repetitions (default: %(default)s)",
     )
+    parser.add_argument(
+        "-il",
+        "--playback_interleave",
+        type=float,
+        default=0,
+        help="repeats in one recording, a sweep every playback_interleave s, 0 to disable (default: %(default)s)",
+    )
     parser.add_argument(
         "-yc",
         "--ess_yaml_config",
@@ -577,6 +755,8 @@ if __name__ == "__main__":
         ess_config["custom"]["stimulus"]["sweep"]["amplitude"]["value"] = args.playback_amplitude
         ess_config["custom"]["stimulus"]["sweep"]["frequency"]["begin"] = args.frequency_begin
         ess_config["custom"]["stimulus"]["sweep"]["frequency"]["end"] = args.frequency_end
+        ess_config["custom"]["stimulus"]["sweep"]["repeat"]["value"] = args.playback_repeat
+        ess_config["custom"]["stimulus"]["sweep"]["interleave"] = {"value": args.playback_interleave, "units": "s"}
 
         # audio recording
         ess_config["custom"]["recording"]["samplerate"] = args.samplerate
@@ -12,8 +12,10 @@ import subprocess
 import time
 import math
 import os
+import threading
 
 import record_ess
+import rotation_nlms
 
 import numpy as np
 import sounddevice as sd
@@ -43,6 +45,12 @@ ESS_CONFIG_SYNTAX_NAME = "audio_measure"
 ESS_CONFIG_SYNTAX_VERSION_MIN = 0.1
 ESS_CONFIG_COORD_ROUND_DECIMALS = 9
 
+# continuous rotation (see run_rotation)
+_ROTATION_ENCODER_LOG = "rotation.yaml"  # encoder positions, in the recording folder
+_ROTATION_POLL_s = 0.25  # encoder positions logging interval
+_ROTATION_SETTLE_PERIODS = 3  # sweep periods with the table still before/after the rotation, see rotation_nlms
+_ROTATION_TIMEOUT_s = 1800  # the table thread gives up (and stops the recording) after this time
+
 
 def update_ess_yaml_params(yaml_params=[], azimuth=0, elevation=0, distance=1):
     result = {}
@@ -125,6 +133,156 @@ def update_ess_yaml_params(yaml_params=[], azimuth=0, elevation=0, distance=1):
     return result
 
 
+def get_table_position():
+    """rotating table status (json of cmd_get_position.sh): position (deg, integer) and angle (deg)"""
+    rv = subprocess.run([_ROOT_DIR + "/cmd_get_position.sh"], stdout=subprocess.PIPE).stdout.decode("utf-8")
+    return json.loads(rv)
+
+
+def set_table_position(angle=0, wait=True):
+    """rotate the table to angle (deg, table coordinates), wait until the position is reached"""
+    rv = subprocess.run([_ROOT_DIR + "/cmd_set_position.sh", str(angle)], stdout=subprocess.PIPE).stdout.decode(
+        "utf-8"
+    )
+    result = json.loads(rv)
+
+    if result["error"] == 0 and wait:
+        result = get_table_position()
+        while result["position"] != round(angle):
+            time.sleep(3)
+            result = get_table_position()
+    return result
+
+
+def rotate_table(rotation=None, angle=0, settle=1.0):
+    """table thread of a continuous rotation: once the first sweep period is played (see
+    record_ess.play_periodic) wait settle seconds, turn the table to angle and wait settle seconds
+    again, logging the encoder positions all along (rotation["times"] from the first period,
+    rotation["angles"]). rotation["stop"] is always set at the end: the recording stops."""
+    try:
+        if not rotation["started"].wait(timeout=_ROTATION_TIMEOUT_s):
+            logger.error("[ERROR]: continuous rotation, playback not started")
+            return
+
+        deadline = time.monotonic() + _ROTATION_TIMEOUT_s
+        moving_at = time.monotonic() + settle
+        stop_at = None
+        while time.monotonic() < deadline:
+            before = time.monotonic()
+            result = get_table_position()
+            now = (before + time.monotonic()) / 2
+
+            rotation["times"].append(now - rotation["start"])
+            rotation["angles"].append(float(result.get("angle", result["position"])))
+
+            if moving_at is not None and now >= moving_at:
+                logger.info("continuous rotation: table to {} deg".format(angle))
+                set_table_position(angle, wait=False)
+                moving_at = None
+            elif moving_at is None and stop_at is None and result["position"] == round(angle):
+                stop_at = now + settle
+            elif stop_at is not None and now >= stop_at:
+                return
+
+            time.sleep(_ROTATION_POLL_s)
+
+        logger.error("[ERROR]: continuous rotation, timeout")
+
+    finally:
+        rotation["stop"].set()
+
+
+def run_rotation(yaml_params=None, ess_yaml_params=None):
+    """Continuous rotation: the table turns from azimuth_begin to azimuth_end while a perfect sweep
+    is played in loop, one recording (folder <measure_name>_<elevation><distance>_rotation) with the
+    encoder positions log. Impulse responses at any azimuth: see compute_rotation_hrir.py."""
+    elevation = yaml_params["elevation_begin"]
+    distance = yaml_params["distance_begin"]
+    direction = yaml_params["rtable_direction"]
+    period = float(yaml_params.get("rotation_period") or 1.0)
+
+    measure_name = yaml_params["measure_name"]
+    yaml_params["measure_name"] = measure_name + "_{}{:03d}+{:03d}_rotation".format(
+        "+" if elevation > 0 else "-", abs(elevation), distance
+    )
+    yaml_params["rotation_period"] = period
+
+    logger.info("-" * 80)
+    logger.info("ESS MAP: continuous rotation {}".format(yaml_params["measure_name"]))
+
+    # recording config: source at the first azimuth, the rotation is described in custom.rotation
+    update_ess_yaml_params(
+        yaml_params=ess_yaml_params, azimuth=yaml_params["azimuth_begin"], elevation=elevation, distance=distance
+    )
+    with open("/tmp/ess_params_000000.yaml", "w") as file:
+        yaml.dump(ess_yaml_params, file)
+        yaml_params["ess_yaml_config"] = "/tmp/ess_params_000000.yaml"
+
+    config = {
+        "measure_name": measure_name,
+        "period": {"value": period, "units": "s"},
+        "direction": direction,
+        "azimuth": {
+            "begin": yaml_params["azimuth_begin"],
+            "end": yaml_params["azimuth_end"],
+            "step": yaml_params["azimuth_step"],
+            "units": "degree",
+        },
+        "elevation": elevation,
+        "distance": distance,
+        "encoder_log": _ROTATION_ENCODER_LOG,
+    }
+
+    # table angles are not wrapped: the table turns in one direction only (ccw: 360 - azimuth)
+    table_begin = yaml_params["azimuth_begin"]
+    table_end = yaml_params["azimuth_end"]
+    if direction == "ccw":
+        table_begin = 360 - table_begin
+        table_end = 360 - table_end
+
+    result = set_table_position(table_begin)
+    if result["error"] != 0:
+        logger.error("[ERROR]: cannot set rotating table position, angle={}".format(table_begin))
+        return
+
+    rotation = {
+        "stop": threading.Event(),
+        "started": threading.Event(),
+        "start": None,
+        "periods": 0,
+        "times": [],
+        "angles": [],
+    }
+    table = threading.Thread(
+        target=rotate_table,
+        kwargs={"rotation": rotation, "angle": table_end, "settle": _ROTATION_SETTLE_PERIODS * period},
+        daemon=True,
+    )
+    table.start()
+
+    if not (yaml_params["test"]):
+        record_ess.run_rotation(rotation=rotation, config=config, **yaml_params)
+    else:
+        rotation["start"] = time.monotonic()
+        rotation["started"].set()
+    table.join()
+
+    folder = os.path.join(yaml_params["measure_folder"], yaml_params["measure_name"])
+    os.makedirs(folder, exist_ok=True)
+    rotation_nlms.write_encoder_log(
+        os.path.join(folder, _ROTATION_ENCODER_LOG),
+        rotation["times"],
+        rotation["angles"],
+        direction=direction,
+        periods=rotation["periods"],
+    )
+    logger.info(
+        "continuous rotation: {} encoder positions, {} sweep periods".format(
+            len(rotation["times"]), rotation["periods"]
+        )
+    )
+
+
 #
 # MAIN
 #
@@ -197,6 +355,25 @@ if __name__ == "__main__":
             type=int,
             help="sweep repetitions",
         )
+        parser.add_argument(
+            "-il",
+            "--playback_interleave",
+            type=float,
+            help="repeats in one recording, a sweep every playback_interleave s, 0 to disable",
+        )
+        parser.add_argument(
+            "-cr",
+            "--continuous_rotation",
+            action="store_true",
+            default=None,
+            help="one recording while the table turns from azimuth begin to end (perfect sweep in loop)",
+        )
+        parser.add_argument(
+            "-rp",
+            "--rotation_period",
+            type=float,
+            help="continuous rotation: perfect sweep period (s), the longest impulse response",
+        )
         parser.add_argument(
             "-yc",
             "--ess_yaml_config",
@@ -315,6 +492,28 @@ if __name__ == "__main__":
             default=1,
             help="sweep repetitions (default: %(default)s)",
         )
+        parser.add_argument(
+            "-il",
+            "--playback_interleave",
+            type=float,
+            default=0,
+            help="repeats in one recording, a sweep every playback_interleave s, 0 to disable (default: %(default)s)",
+        )
+        parser.add_argument(
+            "-cr",
+            "--continuous_rotation",
+            action="store_true",
+            default=False,
+            help="one recording while the table turns from azimuth begin to end (perfect sweep in loop) "
+            "(default: %(default)s)",
+        )
+        parser.add_argument(
+            "-rp",
+            "--rotation_period",
+            type=float,
+            default=1.0,
+            help="continuous rotation: perfect sweep period (s), the longest impulse response (default: %(default)s)",
+        )
         parser.add_argument(
             "-yc",
             "--ess_yaml_config",
@@ -504,6 +703,16 @@ if __name__ == "__main__":
     else:
         sys.exit("\n[ERROR] missing audio ESS yaml config file.")
 
+    #
+    # continuous rotation: one recording while the table turns, no measure loop
+    #
+    if yaml_params.get("continuous_rotation"):
+        try:
+            run_rotation(yaml_params=yaml_params, ess_yaml_params=ess_yaml_params)
+        except KeyboardInterrupt:
+            sys.exit("\nInterrupted by user")
+        parser.exit(0)
+
     #
     # run measure loop for audio sweep recording
     #
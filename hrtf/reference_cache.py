@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""Size-bounded cache for reference signals (sweeps, filters, spectra) with optional .npy storage"""
+
+import os
+import hashlib
+import logging
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+#
+# DEFINES / CONSTANT / GLOBALS
+#
+_CACHE_MAX_MB = 256  # max memory used by each cache instance (each worker has its own)
+_CACHE_VERSION = 1  # bump to invalidate .npy files written by older code
+
+
+#
+# CACHE
+#
+class ReferenceCache:
+    """LRU cache of numpy arrays, bounded by total size in bytes.
+
+    Entries are keyed by a tuple of parameters (e.g. stimulus f1/f2/T/fs/amplitude)
+    and computed on the first request. When a folder is given, arrays are also
+    stored as .npy files so that other workers and later runs can reuse them.
+
+    Returned arrays are read-only: copy them before modifying.
+    """
+
+    def __init__(self, max_bytes=_CACHE_MAX_MB * 1024 * 1024, folder=None):
+        self.max_bytes = int(max_bytes)
+        self.folder = folder
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+
+        if self.folder is not None:
+            os.makedirs(self.folder, exist_ok=True)
+
+    def filename(self, key=None):
+        digest = hashlib.sha1(repr((_CACHE_VERSION, key)).encode("utf-8")).hexdigest()
+        return os.path.join(self.folder, "ref_{}.npy".format(digest))
+
+    def load(self, key=None):
+        """array from disk, None if not available"""
+        if self.folder is None:
+            return None
+
+        try:
+            return np.load(self.filename(key), allow_pickle=False)
+        except (OSError, ValueError):
+            return None
+
+    def store(self, key=None, value=None):
+        """array to disk, written to a temp file first: concurrent workers never see partial files"""
+        if self.folder is None:
+            return
+
+        filename = self.filename(key)
+        filename_tmp = "{}.{}.tmp".format(filename, os.getpid())
+        try:
+            with open(filename_tmp, "wb") as file:
+                np.save(file, value, allow_pickle=False)
+            os.replace(filename_tmp, filename)
+        except OSError as e:
+            logger.warning("reference cache: cannot store {}: {}".format(filename, e))
+            if os.path.exists(filename_tmp):
+                os.remove(filename_tmp)
+
+    def insert(self, key=None, value=None):
+        """add to memory, evict least recently used entries above max_bytes"""
+        if value.nbytes > self.max_bytes:
+            return
+
+        self.entries[key] = value
+        self.size += value.nbytes
+        while self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= evicted.nbytes
+
+    def get(self, key=None, compute=None):
+        """cached array for key, compute() is called only on a miss"""
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+        value = self.load(key)
+        if value is not None:
+            self.loads += 1
+        else:
+            value = np.asarray(compute())
+            self.misses += 1
+            self.store(key, value)
+
+        value.flags.writeable = False
+        self.insert(key, value)
+
+        return value
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self):
+        return "entries: {}, size: {:.1f} (MB), hits: {}, disk loads: {}, misses: {}".format(
+            len(self.entries), self.size / (1024 * 1024), self.hits, self.loads, self.misses
+        )
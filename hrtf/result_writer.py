@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Background writer thread for result files, with back-pressure and error propagation"""
+
+import os
+import queue
+import logging
+import threading
+import traceback
+
+logger = logging.getLogger(__name__)
+
+#
+# DEFINES / CONSTANT / GLOBALS
+#
+_WRITER_QUEUE_SIZE = 8  # pending writes before submit() blocks (back-pressure on the compute loop)
+_WRITER_FSYNC = True  # fsync each written file (and its folder) before close() returns
+
+
+#
+# TOOLS
+#
+def fsync_file(filename=None):
+    """flush file content to the storage"""
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_folder(folder=None):
+    """flush folder entries (new/renamed files) to the storage, not supported on all the platforms"""
+    try:
+        fd = os.open(folder, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class ResultWriterError(Exception):
+    """a background write failed"""
+
+
+#
+# WRITER
+#
+class ResultWriter:
+    """Write result files in a background thread while the caller computes the next ones.
+
+    - submit(filename, func, *args, **kwargs) queues func(*args, **kwargs), expected to write
+      filename; it blocks when _WRITER_QUEUE_SIZE writes are pending (back-pressure)
+    - the first failed write is re-raised (ResultWriterError) by the next submit() or by close(),
+      later writes are skipped
+    - close() waits for all the pending writes, fsyncs the written files and their folders:
+      when it returns without errors, all the files are on the storage
+
+    Data passed to submit() must not be modified by the caller afterwards.
+    """
+
+    def __init__(self, queue_size=_WRITER_QUEUE_SIZE, fsync=_WRITER_FSYNC, name="result_writer"):
+        self.fsync = fsync
+        self.name = name
+        self.queue = queue.Queue(maxsize=max(1, int(queue_size)))
+        self.error = None
+        self.written = []
+        self.thread = threading.Thread(target=self.worker, name=name, daemon=True)
+        self.thread.start()
+
+    def worker(self):
+        while True:
+            task = self.queue.get()
+            try:
+                if task is None:
+                    return
+                (filename, func, args, kwargs) = task
+                if self.error is None:
+                    try:
+                        func(*args, **kwargs)
+                        if self.fsync:
+                            fsync_file(filename)
+                        self.written.append(filename)
+                    except Exception:
+                        self.error = "{}: cannot write {}:\n{}".format(self.name, filename, traceback.format_exc())
+            finally:
+                self.queue.task_done()
+
+    def check(self):
+        """raise the first background write error (if any)"""
+        if self.error is not None:
+            raise ResultWriterError(self.error)
+
+    def submit(self, filename=None, func=None, *args, **kwargs):
+        """queue a write of filename, blocks while the queue is full"""
+        self.check()
+        self.queue.put((str(filename), func, args, kwargs))
+
+    def close(self):
+        """wait for the pending writes and flush them to the storage: returns the written files"""
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+        self.check()
+
+        if self.fsync:
+            for folder in sorted(set(os.path.dirname(os.path.abspath(f)) for f in self.written)):
+                fsync_folder(folder)
+
+        return self.written
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        if exc_type is None:
+            self.close()
+        elif self.thread.is_alive():
+            # caller failed: drain the pending writes without masking its exception
+            self.queue.put(None)
+            self.thread.join()
+        return False
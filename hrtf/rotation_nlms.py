@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""Continuous rotation measures: periodic perfect sweep and block NLMS impulse responses tracking
+
+The rotating table turns while a perfect sweep (flat magnitude spectrum, period samples long, see
+perfect_sweep) is played in loop: the impulse responses of the receivers change with the azimuth,
+a normalized LMS adaptive filter (period taps, fed with the recorded stimulus) tracks them.
+
+With a perfect periodic excitation the regressors of period consecutive samples are orthogonal:
+the sample by sample NLMS updates of a block are computed at once in the frequency domain (one
+circular FFT of period samples per block and receiver, see BlockNLMS) and with mu = 1 the filter
+is the impulse response of the last period. The filter after each block is an average of the
+impulse responses of the last period / mu samples (see estimate_lag): the table encoder positions
+logged during the recording (see read_encoder_log) give the azimuth of each block, the impulse
+responses at any azimuth are interpolated between the two blocks around it (see track_targets).
+"""
+
+import math
+import logging
+
+import yaml
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+#
+# DEFINES / CONSTANT / GLOBALS
+#
+_ENCODER_LOG_SYNTAX_NAME = "rotation_encoder"
+_REGULARIZATION = 1e-6  # per bin normalization: added power, relative to the stimulus max power
+_REFERENCE_PERIODS = 8  # recorded stimulus periods averaged as the adaptive filter input
+_SETTLE_RESIDUAL = 0.01  # initial (zero) filters left in the estimate when it is valid (-40 dB)
+
+
+#
+# EXCITATION
+#
+def period_samples(period=1.0, samplerate=96000):
+    """samples of a sweep period of period seconds (even), the same on playback and on the recording"""
+    return 2 * int(round(period * samplerate / 2))
+
+
+def perfect_sweep(length=96000):
+    """One period (length samples, even) of a perfect sweep: flat magnitude spectrum, linear sweep
+    from DC to Nyquist over the whole period (quadratic phase), normalized to a peak of 1"""
+    k = np.arange(length // 2 + 1)
+    spectrum = np.exp(-1j * 2 * math.pi * k**2 / length)
+    period = np.fft.irfft(spectrum, length)
+    return period / np.max(np.abs(period))
+
+
+def periodic_block(period=None, start=0, frames=0, prepadding=0, amplitude=0.8, stop=None):
+    """Frames start..start + frames of the playback: prepadding samples of silence, then period in
+    loop up to stop (samples, a period boundary) if given. Returns a (frames, 1) block."""
+    idx = start + np.arange(frames) - prepadding
+    valid = idx >= 0
+    if stop is not None:
+        valid &= idx < stop - prepadding
+
+    block = np.zeros((frames, 1))
+    block[valid, 0] = amplitude * period[idx[valid] % len(period)]
+    return block
+
+
+#
+# ENCODER LOG
+#
+def write_encoder_log(filename=None, times=None, angles=None, direction="ccw", periods=0):
+    """Table encoder positions (degree) at times (s from the first sweep period) of a rotation"""
+    encoder_log = {
+        "syntax": {"name": _ENCODER_LOG_SYNTAX_NAME, "version": {"major": 0, "minor": 1, "revision": 0}},
+        "direction": direction,
+        "periods": int(periods),
+        "time": {"value": [round(float(t), 6) for t in times], "units": "s"},
+        "angle": {"value": [round(float(a), 6) for a in angles], "units": "degree"},
+    }
+    with open(filename, "w") as file:
+        yaml.dump(encoder_log, file, default_flow_style=None, sort_keys=False)
+
+
+def read_encoder_log(filename=None):
+    """(times, azimuths, periods) of an encoder log: azimuths (degree, unwrapped) of the source,
+    from the table angles and direction (as record_ess_map: ccw azimuth = 360 - table angle)"""
+    with open(filename, "r") as file:
+        encoder_log = yaml.safe_load(file)
+
+    if encoder_log["syntax"]["name"] != _ENCODER_LOG_SYNTAX_NAME:
+        raise ValueError("invalid encoder log syntax: {}".format(encoder_log["syntax"]["name"]))
+
+    times = np.asarray(encoder_log["time"]["value"], dtype=np.float64)
+    angles = np.unwrap(np.asarray(encoder_log["angle"]["value"], dtype=np.float64), period=360)
+    if encoder_log["direction"] == "ccw":
+        angles = 360 - angles
+    return times, angles, int(encoder_log["periods"])
+
+
+def target_times(times=None, azimuths=None, targets=None, valid=None):
+    """Time (s) of each target azimuth (degree) along the logged rotation, nan if never reached.
+
+    The table stands still at the beginning and at the end: each run of equal positions is
+    collapsed to its middle time, so the azimuths are strictly monotonic for the interpolation.
+    With valid (first, last time of the valid estimates, see valid_times) the middle of the valid
+    part of the run, its closest valid time if none.
+    """
+    times = np.asarray(times, dtype=np.float64)
+    azimuths = np.asarray(azimuths, dtype=np.float64)
+
+    # runs of equal positions: middle (valid) time
+    change = np.flatnonzero(np.diff(azimuths) != 0) + 1
+    starts = np.concatenate(([0], change))
+    stops = np.concatenate((change, [len(azimuths)])) - 1
+    run_begins = times[starts]
+    run_ends = times[stops]
+    if valid is not None:
+        run_begins = np.clip(run_begins, valid[0], valid[1])
+        run_ends = np.clip(run_ends, valid[0], valid[1])
+    run_times = (run_begins + run_ends) / 2
+    run_azimuths = azimuths[starts]
+
+    if run_azimuths[-1] < run_azimuths[0]:
+        run_times = run_times[::-1]
+        run_azimuths = run_azimuths[::-1]
+
+    result = np.full(len(targets), np.nan)
+    for i, target in enumerate(targets):
+        # the first turn covering the target (the azimuths are unwrapped)
+        target = run_azimuths[0] + (float(target) - run_azimuths[0]) % 360
+        if target <= run_azimuths[-1]:
+            result[i] = np.interp(target, run_azimuths, run_times)
+    return result
+
+
+#
+# RECORDING
+#
+def find_head(data=None, period=None, search=0):
+    """First sample of the first period of the recorded stimulus data: max cross-correlation with
+    period over the lags 0..search (the following periods match as well, keep search < period)"""
+    length = len(period)
+    segment = np.asarray(data[: search + length], dtype=np.float64)
+    size = 1 << int(math.ceil(math.log2(len(segment) + length)))
+    correlation = np.fft.irfft(np.fft.rfft(segment, size) * np.conj(np.fft.rfft(period, size)), size)
+    return int(np.argmax(np.abs(correlation[: search + 1])))
+
+
+def reference_period(data=None, head=0, length=0, periods=_REFERENCE_PERIODS):
+    """Average of the recorded stimulus periods after the first one (the first one starts from
+    silence): the adaptive filter input, with the playback/recording latency and converters"""
+    count = max(1, min(periods, (len(data) - head) // length - 1))
+    segments = [data[head + k * length : head + (k + 1) * length] for k in range(1, count + 1)]
+    return np.mean(np.asarray(segments, dtype=np.float64), axis=0)
+
+
+def estimate_lag(length=0, mu=1.0):
+    """Samples between the end of the last block and the time the filter estimate refers to: the
+    estimate averages the impulse responses of the last length / mu samples"""
+    return int(round(length / mu - length / 2))
+
+
+def settle_samples(length=0, mu=1.0):
+    """Samples of updates before the estimate is valid: whole periods, the initial filters weigh
+    (1 - mu) ** periods, below _SETTLE_RESIDUAL (one period with mu = 1)"""
+    if mu >= 1:
+        return length
+    return length * int(math.ceil(math.log(_SETTLE_RESIDUAL) / math.log(1 - mu)))
+
+
+def valid_times(length=0, mu=1.0, periods=0, samplerate=96000):
+    """(first, last) time (s from the first period) of the valid estimates of a recording of periods
+    periods: the updates begin after the first period (it starts from silence, see track_targets)
+    and end with the last one"""
+    lag = estimate_lag(length, mu)
+    first = (length + settle_samples(length, mu) - lag) / samplerate
+    last = (periods * length - lag) / samplerate
+    return first, last
+
+
+#
+# TRACKING
+#
+class BlockNLMS:
+    """NLMS adaptive filters of period taps, one for each receiver, with the periodic input
+    x[n] = reference[(n - head) mod period]: blocks of at most period samples are updated at once.
+
+    The filters are kept as spectra (period samples, circular), the output of the filters for all
+    the phases of the period is one inverse FFT, the update is the (regularized) normalized
+    cross-spectrum of the error of the block with the reference period.
+    """
+
+    def __init__(self, reference=None, channels=1, mu=1.0, head=0):
+        self.length = len(reference)
+        self.head = int(head)
+        self.mu = float(mu)
+        self.spectrum = np.fft.rfft(np.asarray(reference, dtype=np.float64))
+        power = np.abs(self.spectrum) ** 2
+        self.normalization = np.conj(self.spectrum) / (power + _REGULARIZATION * np.max(power))
+        self.weights = np.zeros((channels, len(self.spectrum)), dtype=np.complex128)
+
+    def update(self, start=0, d=None):
+        """Update with the frames start..start + len(d) of the receivers, d shape (frames, channels),
+        returns the a-priori error, same shape"""
+        frames = len(d)
+        phase = (start - self.head + np.arange(frames)) % self.length
+
+        output = np.fft.irfft(self.weights * self.spectrum, self.length)
+        error = np.asarray(d, dtype=np.float64).T - output[:, phase]
+
+        error_period = np.zeros((len(self.weights), self.length))
+        error_period[:, phase] = error
+        self.weights += self.mu * np.fft.rfft(error_period) * self.normalization
+        return error.T
+
+    def filters(self):
+        """impulse responses, shape (channels, period)"""
+        return np.fft.irfft(self.weights, self.length)
+
+
+def track_targets(read=None, nlms=None, begin=0, end=0, block=0, targets=None):
+    """Run nlms on the frames begin..end of the receivers (read(start, stop): shape (frames, channels))
+    block by block and yield (index, filters) for each target frame (any order): the filters of the
+    two blocks around it, linearly interpolated. Targets out of begin + block..end are not yielded.
+
+    Only the filters of the previous block are kept: memory does not depend on the targets count.
+    """
+    targets = np.asarray(targets, dtype=np.float64)
+    order = [i for i in np.argsort(targets) if np.isfinite(targets[i])]
+    next_target = 0
+
+    previous = None
+    for start in range(begin, end - block + 1, block):
+        stop = start + block
+        nlms.update(start, read(start, stop))
+        current = nlms.filters()
+
+        while next_target < len(order) and targets[order[next_target]] <= stop:
+            i = order[next_target]
+            if previous is not None and targets[i] >= start:
+                weight = (targets[i] - start) / block
+                yield i, (1 - weight) * previous + weight * current
+            next_target += 1
+
+        previous = current
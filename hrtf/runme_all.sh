@@ -13,8 +13,5 @@ if [ $# -eq 2 ]
    ./compute_hrir.py -v -c 44 -mf $1
 fi
 
-./compute_sofa.py -v -c 88 -mf $1
-./compute_3dti_sofa.py -v -c 88 -mf $1 -irw 0.02 -z -s binaural
-./compute_3dti_sofa.py -v -c 88 -mf $1 -irw 0.02 -z -s array_six,front
-./compute_3dti_sofa.py -v -c 88 -mf $1 -irw 0.02 -z -s array_six,middle
-./compute_3dti_sofa.py -v -c 88 -mf $1 -irw 0.02 -z -s array_six,rear
+# compute_sofa and compute_3dti_sofa binaural, array_six,front|middle|rear from one read of the IRs
+./compute_sofa_all.py -v -c 88 -mf $1 -irw 0.02 -z
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""Session configs: config.yaml of the positions parsed once, typed access for the hot loops
+
+The config.yaml of a position (hundreds of lines) is parsed by every script, yaml.safe_load (pure
+Python) takes tens of ms for each one: minutes on a full map before any audio is read. Here:
+- load_yaml uses the libyaml C loader when pyyaml was built with it (same values, ~8x faster)
+- PositionConfig is the parsed config (a dict: config["setup"]... as before) with the values the
+  scripts look up for each receiver precomputed: track ids and track map (track_id -> rx_id),
+  structural hashes of the receivers / emitters / positions (two configs with the same hash have
+  the same receivers setup: read_sources_listeners compares hashes, not fields)
+- ConfigCache keeps the PositionConfig of all the positions of a measure folder in one pickle file
+  (.session_cache/session_configs.pickle, see cache_path), keyed by the size and mtime of each
+  config.yaml: a config is parsed again only when its file changed (see session_index). The subtrees
+  equal between positions (room, receivers, stimulus, ...) are one object for all of them
+  (share_subtrees): the cache of a full map is stored, loaded and kept in memory once, not once for
+  each position (~100x smaller)
+"""
+
+import os
+import json
+import pickle
+import hashlib
+import logging
+
+import yaml
+
+logger = logging.getLogger(__name__)
+
+#
+# DEFINES / CONSTANT / GLOBALS
+#
+_CACHE_FOLDER = ".session_cache"  # session caches of a measure folder, see cache_path
+_CACHE_FILENAME = "session_configs.pickle"  # stored in the cache folder
+_CACHE_VERSION = 1  # bump when PositionConfig changes: older caches are rebuilt
+_CONFIG_FILENAME = "config.yaml"
+
+# libyaml loader if available (pyyaml built without it: pure Python loader, same values)
+_YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+#
+# TOOLS
+#
+def load_yaml(stream=None):
+    """yaml.safe_load with the C loader when available"""
+    return yaml.load(stream, Loader=_YAML_LOADER)
+
+
+def read_yaml(filename=None):
+    with open(filename, "r") as file:
+        return load_yaml(file)
+
+
+def cache_path(measure_folder=None, filename=None):
+    """filename in the cache folder of measure_folder: the caches are replaced by a rename, that changes
+    the mtime of the folder it is done in. The cache folder is not scanned by session_discovery, the
+    measure folder would be listed again on the next run."""
+    return os.path.join(str(measure_folder), _CACHE_FOLDER, filename)
+
+
+def remove_file(filename=None):
+    """remove filename if it exists: False if it cannot be removed"""
+    try:
+        os.remove(filename)
+    except FileNotFoundError:
+        pass
+    except OSError:
+        return False
+    return True
+
+
+def file_signature(filename=None):
+    """[size, mtime_ns] of a file, None if missing"""
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def structural_hash(value=None):
+    """hash of a config subtree: same hash, same content (dict keys order ignored)"""
+    text = json.dumps(value, sort_keys=True, default=str, separators=(",", ":"))
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def track_ids(config=None):
+    """receivers track ids (by rx_id) of a config, precomputed for a PositionConfig"""
+    if getattr(config, "track_ids", None) is not None:
+        return config.track_ids
+    receivers = config["setup"]["listeners"][0]["receivers"]
+    return [receivers[rx_id]["track_id"] for rx_id in range(config["setup"]["listeners"][0]["receivers_count"])]
+
+
+def same_hash(config=None, other=None, name=None):
+    """True if the structural hash name (receivers_hash, emitters_hash, listener_hash, source_hash) of
+    two PositionConfig is the same: no need to compare the values. False if it differs or is not
+    precomputed (plain dicts): compare the values."""
+    value = getattr(config, name, None)
+    return value is not None and value == getattr(other, name, None)
+
+
+def share_subtrees(value=None, shared=None):
+    """(value, key) of a config subtree: dicts and lists equal to one already in shared (key: content
+    hash, same types and order) are replaced by it, the others added. Shared subtrees are the same
+    object in many configs: do not modify them."""
+    if isinstance(value, dict):
+        items = [(k, share_subtrees(v, shared)) for k, v in value.items()]
+        text = "d" + "".join("{!r}:{};".format(k, child[1]) for k, child in items)
+        value = {k: child[0] for k, child in items}
+    elif isinstance(value, list):
+        items = [share_subtrees(v, shared) for v in value]
+        text = "l" + "".join("{};".format(child[1]) for child in items)
+        value = [child[0] for child in items]
+    else:
+        return value, "{}:{!r}".format(type(value).__name__, value)
+
+    key = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    return shared.setdefault(key, value), key
+
+
+def _reachable(values=None):
+    """ids of the dicts and lists of values (shared subtrees visited once)"""
+    seen = set()
+    pending = list(values)
+    while pending:
+        value = pending.pop()
+        if id(value) in seen:
+            continue
+        seen.add(id(value))
+        pending.extend(v for v in (value.values() if isinstance(value, dict) else value) if isinstance(v, (dict, list)))
+    return seen
+
+
+#
+# CONFIG MODEL
+#
+class PositionConfig(dict):
+    """Parsed config.yaml of a position (the dict as loaded) with the lookups of the scripts
+    precomputed (None if the config is not an audio measure). Treat as read only: the precomputed
+    values are not updated and the subtrees may be shared (see share_subtrees)."""
+
+    __slots__ = (
+        "signature",
+        "syntax_name",
+        "audio_filename",
+        "receivers_count",
+        "track_ids",
+        "track_map",
+        "tx_track_id",
+        "receivers_hash",
+        "emitters_hash",
+        "listener_hash",
+        "source_hash",
+    )
+
+    def __init__(self, config=None, signature=None):
+        super().__init__(config if isinstance(config, dict) else {})
+        self.signature = signature
+        for name in PositionConfig.__slots__[1:]:
+            setattr(self, name, None)
+
+        try:
+            self.syntax_name = self["syntax"]["name"]
+            listener = self["setup"]["listeners"][0]
+            source = self["setup"]["sources"][0]
+            self.audio_filename = self["custom"]["audio_filename"]
+            self.receivers_count = int(listener["receivers_count"])
+            self.track_ids = [listener["receivers"][rx_id]["track_id"] for rx_id in range(self.receivers_count)]
+            self.track_map = {track_id: rx_id for rx_id, track_id in enumerate(self.track_ids)}
+            self.tx_track_id = source["emitters"][0]["track_id"]
+            self.receivers_hash = structural_hash([listener["receivers"][i] for i in range(self.receivers_count)])
+            self.emitters_hash = structural_hash([source["emitters"][i] for i in range(int(source["emitters_count"]))])
+            self.listener_hash = structural_hash(listener["position"])
+            self.source_hash = structural_hash(source["position"])
+        except (KeyError, TypeError, IndexError, ValueError):
+            pass  # not a measure config (or an incomplete one): plain dict access only
+
+    def __reduce__(self):
+        return (_restore_config, (dict(self), {name: getattr(self, name) for name in self.__slots__}))
+
+
+def _restore_config(config=None, values=None):
+    """unpickle a PositionConfig: the precomputed values are restored, not computed again"""
+    model = dict.__new__(PositionConfig)
+    dict.update(model, config)
+    for name, value in values.items():
+        setattr(model, name, value)
+    return model
+
+
+def read_config(filename=None):
+    """PositionConfig of a config.yaml (parse errors are raised, as yaml.safe_load)"""
+    signature = file_signature(filename)
+    return PositionConfig(read_yaml(filename), signature)
+
+
+#
+# CACHE
+#
+class ConfigCache:
+    """PositionConfig of the positions under measure_folder (see position), loaded from the cache file
+    if valid, written back by save when configs were (re)parsed. Only the positions visited are kept:
+    walk all the folders before save."""
+
+    def __init__(self, measure_folder=None):
+        self.measure_folder = str(measure_folder)
+        self.filename = cache_path(self.measure_folder, _CACHE_FILENAME)
+        self.configs = {}
+        self.shared = {}
+        self.visited = set()
+        self.changed = False
+        self.stats = {"cached": 0, "parsed": 0}
+
+        try:
+            with open(self.filename, "rb") as file:
+                cache = pickle.load(file)
+            if cache["version"] == _CACHE_VERSION:
+                self.configs = cache["configs"]
+                self.shared = cache["shared"]
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("config cache: invalid {}, rebuilding: {}".format(self.filename, e))
+
+    def position(self, folder=None):
+        """PositionConfig of a position folder, None without config.yaml, parsed again if the file
+        changed since it was cached (a parse error is raised, as yaml.safe_load)"""
+        key = os.path.relpath(str(folder), self.measure_folder)
+        self.visited.add(key)
+
+        filename = os.path.join(str(folder), _CONFIG_FILENAME)
+        signature = file_signature(filename)
+        if signature is None:
+            if self.configs.pop(key, None) is not None:
+                self.changed = True
+            return None
+
+        model = self.configs.get(key)
+        if model is not None and model.signature == signature:
+            self.stats["cached"] += 1
+            return model
+
+        config = read_yaml(filename)
+        if isinstance(config, dict):
+            config = {name: share_subtrees(value, self.shared)[0] for name, value in config.items()}
+        model = PositionConfig(config, signature)
+        self.configs[key] = model
+        self.changed = True
+        self.stats["parsed"] += 1
+        return model
+
+    def save(self):
+        """write the cache if configs were (re)parsed, without the positions not visited: a failure
+        (read only measure folder) is not an error"""
+        removed = set(self.configs) - self.visited
+        if not (self.changed or removed):
+            return
+        configs = {key: model for key, model in self.configs.items() if key in self.visited}
+        reachable = _reachable(configs.values())
+        cache = {
+            "version": _CACHE_VERSION,
+            "configs": configs,
+            "shared": {key: value for key, value in self.shared.items() if id(value) in reachable},
+        }
+        try:
+            os.makedirs(os.path.dirname(self.filename), exist_ok=True)
+            with open(self.filename + ".tmp", "wb") as file:
+                pickle.dump(cache, file, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(self.filename + ".tmp", self.filename)
+            self.changed = False
+            # cache of older versions, next to the positions
+            remove_file(os.path.join(self.measure_folder, _CACHE_FILENAME))
+        except OSError as e:
+            logger.warning("config cache: cannot write {}: {}".format(self.filename, e))
+
+    def report(self):
+        return "{} configs cached, {} parsed".format(self.stats["cached"], self.stats["parsed"])
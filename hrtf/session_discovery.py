@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""Session discovery: the folders of a measure tree scanned in parallel, cached by directory mtime
+
+Every script looks for its positions the same way: os.walk of the measure folder (or glob of
+**/config.yaml from the current folder for --list_folders, each config fully parsed) and a check of
+the ir folder of each position. On a network share each listing is a round trip: minutes for an
+archive of sessions before any config is read. Here:
+- the folders are listed with os.scandir by a pool of threads (_SCAN_WORKERS), in the os.walk order
+- of a config.yaml only the syntax and custom sections are parsed (read_header): the syntax name
+  and the recording format the listings need, not the hundreds of lines of the setup
+- the listing of each folder (sub folders, config header, wav and sofa files) is kept in
+  session_folders.json in the session folder (the measure folder, the parent folder of the
+  positions), with the mtime of the folder: a folder is listed again only if an entry was added,
+  removed or renamed in it (its mtime changed), the others cost one stat. A config.yaml edited in
+  place keeps its header: the scripts read the configs through session_config (checked by file)
+- the other session caches (configs, index) are in the cache folder of the session folder
+  (session_config.cache_path), never scanned: their writes do not change the session folder
+"""
+
+import os
+import re
+import json
+import time
+import logging
+
+from concurrent.futures import ThreadPoolExecutor
+
+import session_config
+
+logger = logging.getLogger(__name__)
+
+#
+# DEFINES / CONSTANT / GLOBALS
+#
+_CACHE_FILENAME = "session_folders.json"  # stored in the session folders
+_CACHE_SYNTAX_NAME = "session_folders"
+_CACHE_VERSION = 1
+_CONFIG_FILENAME = "config.yaml"
+_HEADER_KEYS = ("syntax", "custom")  # config.yaml sections read by the discovery
+_POSITION_SUFFIX = "_xAngle"  # position folders listed by --list_folders
+_SCAN_WORKERS = 16  # folders listed at once (network shares: latency bound, not CPU bound)
+_RACY_NS = 2000000000  # folders modified less than 2 s before their listing are not cached
+
+# top-level key of a block style yaml file (not a list item, a comment or a document marker)
+_TOP_LEVEL_KEY = re.compile(r"^([^\s#\-\[{][^:]*):(\s|$)")
+
+
+#
+# TOOLS
+#
+def read_header(filename=None, keys=_HEADER_KEYS):
+    """{key: value} of the top-level sections keys of a yaml file, the others are not parsed (the
+    whole file is parsed if the sections are not found as top-level blocks)"""
+    lines = []
+    keep = False
+    with open(filename, "r") as file:
+        for line in file:
+            match = _TOP_LEVEL_KEY.match(line)
+            if match:
+                keep = match.group(1).strip("'\" ") in keys
+            if keep:
+                lines.append(line)
+
+    try:
+        header = session_config.load_yaml("".join(lines))
+    except Exception:
+        header = None
+    if not (isinstance(header, dict) and keys[0] in header):
+        config = session_config.read_yaml(filename)
+        header = {key: config[key] for key in keys if key in config} if isinstance(config, dict) else {}
+    return header
+
+
+def _config_header(filename=None):
+    """syntax name and recording format of a config.yaml, None if unreadable"""
+    try:
+        header = read_header(filename)
+    except Exception:
+        return {"syntax_name": None, "recording": None}
+    try:
+        syntax_name = header["syntax"]["name"]
+    except (KeyError, TypeError):
+        syntax_name = None
+    try:
+        recording = header["custom"]["recording"]
+    except (KeyError, TypeError):
+        recording = None
+    return {"syntax_name": syntax_name, "recording": recording}
+
+
+def list_folder(path=None):
+    """listing of a folder: {"mtime_ns", "dirs" (os.scandir order), "links" (dirs that are symbolic
+    links), "config" (header of the config.yaml, None without), "wav" (count), "sofa" (names),
+    "cache" (session_folders.json found)}"""
+    mtime_ns = os.stat(path).st_mtime_ns
+    record = {"mtime_ns": mtime_ns, "dirs": [], "links": [], "config": None, "wav": 0, "sofa": [], "cache": False}
+    with os.scandir(path) as entries:
+        for entry in entries:
+            try:
+                is_dir = entry.is_dir()
+            except OSError:
+                continue
+            if is_dir:
+                record["dirs"].append(entry.name)
+                if entry.is_symlink():
+                    record["links"].append(entry.name)
+            elif entry.name == _CONFIG_FILENAME:
+                record["config"] = _config_header(entry.path)
+            elif entry.name == _CACHE_FILENAME:
+                record["cache"] = True
+            elif entry.name.endswith(".wav"):
+                record["wav"] += 1
+            elif entry.name.endswith(".sofa"):
+                record["sofa"].append(entry.name)
+    return record
+
+
+def _read_cache(folder=None):
+    """{relative path: listing} of the session_folders.json of folder, {} if missing or invalid"""
+    filename = os.path.join(folder, _CACHE_FILENAME)
+    try:
+        with open(filename, "r") as file:
+            cache = json.load(file)
+        if cache["syntax"]["name"] == _CACHE_SYNTAX_NAME and cache["syntax"]["version"] == _CACHE_VERSION:
+            return cache["folders"]
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning("session discovery: invalid {}, rebuilding: {}".format(filename, e))
+    return {}
+
+
+def _relative(folder=None, session=None):
+    """os.path.relpath of two normalized paths, folder in session"""
+    if folder == session:
+        return "."
+    return folder if session == "." else folder[len(session.rstrip(os.sep)) + 1 :]
+
+
+#
+# DISCOVERY
+#
+class SessionFolders:
+    """Folders under root (root included) in the os.walk order, with their listing (see list_folder):
+    scan lists the folders (the cached listing of a folder is used if its mtime did not change), save
+    writes the listings of each session folder to its session_folders.json. followlinks: symbolic
+    links to folders are scanned (cycles skipped). hidden: folders starting with "." are scanned.
+    root_cache: root is a session folder (a measure folder): its cache is used and written even
+    without positions directly below."""
+
+    def __init__(self, root=None, followlinks=False, hidden=True, root_cache=True, workers=_SCAN_WORKERS):
+        self.root = str(root)
+        self.followlinks = followlinks
+        self.hidden = hidden
+        self.root_cache = root_cache
+        self.workers = workers
+        self.folders = []
+        self.records = {}
+        self.cached = {}  # normalized path: cached listing
+        self.caches = {}  # normalized session folder: {relative path: listing} as loaded
+        self.stats = {"cached": 0, "listed": 0}
+
+    def _visit(self, path=None, ancestors=None, now_ns=None):
+        """(path, (listing, cached) or None, ancestors of the sub folders, loaded caches): a folder listed
+        or taken from the cache, ancestors: (st_dev, st_ino) of the folders above (symbolic link cycles)"""
+        try:
+            st = os.stat(path)
+            if (st.st_dev, st.st_ino) in ancestors:
+                return path, None, None, {}  # symbolic link cycle
+            record = self.cached.get(os.path.normpath(path))
+            cached = record is not None and record["mtime_ns"] == st.st_mtime_ns
+            if not cached:
+                record = list_folder(path)
+                record["racy"] = now_ns - record["mtime_ns"] < _RACY_NS
+        except OSError:
+            return path, None, None, {}  # as os.walk: unreadable folders are skipped
+
+        loaded = {}
+        if record["cache"] and os.path.normpath(path) not in self.caches:
+            loaded[os.path.normpath(path)] = _read_cache(path)
+        return path, (record, cached), ancestors + ((st.st_dev, st.st_ino),), loaded
+
+    def _load(self, loaded=None):
+        for folder, folders in loaded.items():
+            self.caches[folder] = folders
+            for rel, record in folders.items():
+                self.cached.setdefault(os.path.normpath(os.path.join(folder, rel)), record)
+
+    def _children(self, path=None, record=None):
+        return [
+            os.path.join(path, name)
+            for name in record["dirs"]
+            if (self.hidden or not name.startswith("."))
+            and (self.followlinks or name not in record["links"])
+            and name != session_config._CACHE_FOLDER
+        ]
+
+    def scan(self):
+        """list the folders under root (parallel), self.folders: [(path, listing)] in the os.walk order"""
+        now_ns = time.time_ns()
+        if self.root_cache:
+            self._load({os.path.normpath(self.root): _read_cache(self.root)})
+
+        # a depth at a time: the caches found at a depth are loaded before the folders below are visited
+        children = {}
+        self.records = {}
+        level = [(self.root, ())]
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while level:
+                visits = pool.map(lambda folder: self._visit(folder[0], folder[1], now_ns), level)
+                level = []
+                for path, result, ancestors, loaded in visits:
+                    if result is None:
+                        continue
+                    record, cached = result
+                    self._load(loaded)
+                    self.records[path] = record
+                    self.stats["cached" if cached else "listed"] += 1
+
+                    children[path] = self._children(path, record)
+                    level.extend((child, ancestors) for child in children[path])
+
+        # os.walk order: a folder, then the folders below each of its sub folders in turn
+        self.folders = []
+        stack = [self.root] if self.root in self.records else []
+        while stack:
+            path = stack.pop()
+            self.folders.append((path, self.records[path]))
+            stack.extend(child for child in reversed(children.get(path, [])) if child in self.records)
+        return self.folders
+
+    def session_folders(self):
+        """normalized paths of the folders whose listings are cached: root (root_cache), the parent
+        folders of the audio measure positions"""
+        sessions = {os.path.normpath(self.root)} if self.root_cache else set()
+        for path, record in self.folders:
+            config = record["config"]
+            if path != self.root and config is not None and config["syntax_name"] == "audio_measure":
+                sessions.add(os.path.normpath(os.path.dirname(os.path.normpath(path))))
+        return sessions
+
+    def save(self):
+        """write the session_folders.json of the session folders whose listings changed: a failure
+        (read only share) is not an error"""
+        if self.stats["listed"] == 0:
+            return  # no folder changed (a removed folder changes the folder above)
+        sessions = self.session_folders()
+        caches = {session: {} for session in sessions}
+        for path, record in self.folders:
+            if record.get("racy", False):
+                continue  # may change again within the mtime resolution: listed next time
+            # in the cache of the session folder above, and in its own if a session folder (a cache is
+            # read when its folder is visited: the listing of the folder itself is taken from above)
+            folder = os.path.normpath(path)
+            owners = [folder] if folder in sessions else []
+            session = os.path.dirname(folder)
+            while session not in sessions and session != os.path.dirname(session):
+                session = os.path.dirname(session)
+            if session in sessions:
+                owners.append(session)
+
+            listing = {key: value for key, value in record.items() if key != "racy"}
+            for session in owners:
+                caches[session][_relative(folder, session)] = listing
+
+        for session, folders in caches.items():
+            if folders == self.caches.get(session) or len(folders) == 0:
+                continue
+            filename = os.path.join(session, _CACHE_FILENAME)
+            cache = {"syntax": {"name": _CACHE_SYNTAX_NAME, "version": _CACHE_VERSION}, "folders": folders}
+            try:
+                # written in place: a new file (rename) would change the mtime of the session folder
+                with open(filename, "w") as file:
+                    json.dump(cache, file, separators=(",", ":"))
+                self.caches[session] = folders
+            except OSError as e:
+                logger.warning("session discovery: cannot write {}: {}".format(filename, e))
+
+    def report(self):
+        return "{} folders cached, {} listed".format(self.stats["cached"], self.stats["listed"])
+
+
+def scan(root=None, **kwargs):
+    """[(path, listing)] of the folders under root in the os.walk order (see SessionFolders), the
+    session caches updated"""
+    folders = SessionFolders(root, **kwargs)
+    folders.scan()
+    folders.save()
+    logger.info("session discovery: {}".format(folders.report()))
+    return folders.folders
+
+
+def position_folders(measure_folder=None):
+    """folders with a config.yaml under measure_folder, in the os.walk order"""
+    return [path for path, record in scan(measure_folder) if record["config"] is not None]
+
+
+def list_sessions(root=".", require_ir=False):
+    """[(session, positions count, recording format)] of the audio measure sessions under root (as
+    glob **: hidden folders skipped, symbolic links followed), session: the path of the session
+    folder relative to root with a trailing "/". require_ir: positions with ir/*.wav files only."""
+    folders = scan(root, followlinks=True, hidden=False, root_cache=False)
+    records = dict(folders)
+
+    sessions = {}
+    for path, record in folders:
+        config = record["config"]
+        if (config is None) or (config["syntax_name"] != "audio_measure"):
+            continue
+        if not os.path.basename(os.path.normpath(path)).endswith(_POSITION_SUFFIX):
+            continue
+        if require_ir and records.get(os.path.join(path, "ir"), {"wav": 0})["wav"] == 0:
+            continue
+
+        session = os.path.relpath(os.path.dirname(os.path.normpath(path)), root)
+        session = "" if session == "." else os.path.join(session, "")
+        if session not in sessions:
+            sessions[session] = [session, 0, config["recording"]]
+        sessions[session][1] += 1
+    return [tuple(session) for session in sessions.values()]
+
+
+def sofa_files(root="."):
+    """paths (relative to root) of the SOFA files under root, as glob **/*.sofa"""
+    return [
+        os.path.relpath(os.path.join(path, name), root)
+        for path, record in scan(root, followlinks=True, hidden=False, root_cache=False)
+        for name in record["sofa"]
+        if not name.startswith(".")
+    ]
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""Session index: configs and compute_hrir results of all the positions of a measure folder, one file
+
+The sofa scripts need the config.yaml of each position and the delay / samples count of each
+receiver (the per receiver ir/<audio>_IR_rx_<rx>_trid_<track>.yaml files, or the position bundle):
+thousands of yaml parses on a full map before the first IR sample is read. The index
+(session_index.json in the cache folder of the measure folder, see session_config.cache_path,
+written by compute_hrir, refreshed by the sofa scripts) keeps the results with the size and mtime of
+the files they were read from, the configs are kept by session_config.ConfigCache
+(session_configs.pickle, same rule): a position is parsed again only
+when one of its files changed, new positions are added, the others are one json and one pickle read.
+"""
+
+import os
+import json
+import logging
+
+import ir_bundle
+import session_config
+import session_discovery
+from session_config import file_signature
+
+logger = logging.getLogger(__name__)
+
+#
+# DEFINES / CONSTANT / GLOBALS
+#
+_INDEX_FILENAME = "session_index.json"  # stored in the cache folder of the measure folder
+_INDEX_SYNTAX_NAME = "session_index"
+_INDEX_VERSION = 2  # 2: configs in session_config.ConfigCache
+
+
+#
+# TOOLS
+#
+def index_path(measure_folder=None):
+    return session_config.cache_path(measure_folder, _INDEX_FILENAME)
+
+
+def _int_keys(pairs=None):
+    """json object hook: integer keys (receivers ids of the results) are stored as strings by json,
+    restore them"""
+    return {int(k) if k.isdigit() else k: v for k, v in pairs}
+
+
+def receiver_filenames(config=None, rx_id=0):
+    """per receiver result files (relative to the position folder): yaml, far, wav"""
+    track_id = session_config.track_ids(config)[rx_id]
+    prefix = "ir/{}_IR_rx_{}_trid_{}".format(config["custom"]["audio_filename"], rx_id, track_id)
+    return [prefix + ".yaml", prefix + ".far", prefix + ".wav"]
+
+
+def result_files(config=None):
+    """result files of a position (relative to the position folder): the bundle, then the per
+    receiver files (only read without a bundle, but any change is a change of the results)"""
+    files = ["ir/" + ir_bundle.bundle_filename(config["custom"]["audio_filename"])]
+    for rx_id in range(config["setup"]["listeners"][0]["receivers_count"]):
+        files += receiver_filenames(config, rx_id)
+    return files
+
+
+def read_results(folder=None, config=None):
+    """compute_hrir results of a position: {"format", "complete", "receivers": {rx_id: info}}, info as
+    ir_bundle.read_results. complete: a bundle or the .far and .wav files of all the receivers (the
+    sofa scripts requirement), receivers without readable results are missing."""
+    if ir_bundle.has_bundle(folder, config):
+        receivers = ir_bundle.read_results(folder, config)
+        return {"format": "bundle", "complete": True, "receivers": {} if receivers is None else receivers}
+
+    complete = True
+    receivers = {}
+    for rx_id in range(config["setup"]["listeners"][0]["receivers_count"]):
+        yaml_file, far_file, wav_file = (os.path.join(str(folder), name) for name in receiver_filenames(config, rx_id))
+        if not (os.path.exists(far_file) and os.path.exists(wav_file)):
+            complete = False
+
+        try:
+            ir_yaml = session_config.read_yaml(yaml_file)
+            receivers[rx_id] = {
+                "ir_delay": float(ir_yaml["ir_delay"]),
+                "ir_delay_samples": int(ir_yaml["ir_delay_samples"]),
+                "dbFS_calib": float(ir_yaml["dbFS_calib"]),
+                "ir_samples": int(ir_yaml["ir_samples"]),
+                "ir_norm_hipass_window_samples": int(ir_yaml["ir_norm_hipass_window_samples"]),
+                "samplerate": float(ir_yaml["samplerate"]),
+            }
+        except Exception:
+            if os.path.exists(yaml_file):
+                logger.error("ERROR while reading {}".format(yaml_file))
+
+    return {"format": "files", "complete": complete, "receivers": receivers}
+
+
+def modified_ns(entry=None):
+    """latest modification time (ns) of the config and result files of an indexed position"""
+    signatures = [entry["config_signature"]] + list(entry.get("results_signature", {}).values())
+    return max(signature[1] for signature in signatures if signature is not None)
+
+
+#
+# INDEX
+#
+class SessionIndex:
+    """Configs and results of the positions under measure_folder (see position), loaded from the
+    index file if valid, written back by save when positions were (re)read. The positions of the
+    index are kept only if visited: walk all the folders before save."""
+
+    def __init__(self, measure_folder=None):
+        self.measure_folder = str(measure_folder)
+        self.positions = {}
+        self.visited = set()
+        self.changed = False
+        self.stats = {"indexed": 0, "config": 0, "results": 0}
+        self.configs = session_config.ConfigCache(self.measure_folder)
+
+        try:
+            with open(index_path(self.measure_folder), "r") as file:
+                index = json.load(file, object_pairs_hook=_int_keys)
+            if index["syntax"]["name"] == _INDEX_SYNTAX_NAME and index["syntax"]["version"] == _INDEX_VERSION:
+                self.positions = {entry.pop("folder"): entry for entry in index["positions"]}
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning("session index: invalid {}, rebuilding: {}".format(index_path(self.measure_folder), e))
+
+    def position(self, folder=None):
+        """{"config", "results"} of a position folder, None without config.yaml, config: the
+        session_config.PositionConfig. The config and the results are read again if their files
+        changed since they were indexed (a config parse error is raised, as yaml.safe_load)."""
+        key = os.path.relpath(str(folder), self.measure_folder)
+        self.visited.add(key)
+
+        parsed = self.configs.stats["parsed"]
+        config = self.configs.position(folder)
+        if config is None:
+            if self.positions.pop(key, None) is not None:
+                self.changed = True
+            return None
+        if self.configs.stats["parsed"] != parsed:
+            self.stats["config"] += 1
+
+        entry = self.positions.get(key)
+        if entry is None or entry["config_signature"] != config.signature:
+            entry = {"config_signature": config.signature}
+            self.positions[key] = entry
+            self.changed = True
+        entry["config"] = config
+
+        try:
+            files = result_files(entry["config"])
+        except (KeyError, TypeError):
+            files = []  # not a measure config: no results
+        results_signature = {name: file_signature(os.path.join(str(folder), name)) for name in files}
+
+        if "results" in entry and entry["results_signature"] == results_signature:
+            self.stats["indexed"] += 1
+        else:
+            entry["results"] = read_results(folder, entry["config"]) if len(files) > 0 else None
+            entry["results_signature"] = results_signature
+            self.changed = True
+            self.stats["results"] += 1
+        return entry
+
+    def save(self):
+        """write the index if positions were (re)read, without the positions not visited (removed
+        folders): a failure (read only measure folder) is not an error"""
+        self.configs.save()
+        removed = set(self.positions) - self.visited
+        if not (self.changed or removed):
+            return
+        index = {
+            "syntax": {"name": _INDEX_SYNTAX_NAME, "version": _INDEX_VERSION},
+            "positions": [
+                dict(folder=key, **{name: value for name, value in entry.items() if name != "config"})
+                for key, entry in self.positions.items()
+                if key in self.visited
+            ],
+        }
+        filename = index_path(self.measure_folder)
+        try:
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+            with open(filename + ".tmp", "w") as file:
+                json.dump(index, file, separators=(",", ":"))
+            os.replace(filename + ".tmp", filename)
+            self.changed = False
+            # index of older versions, next to the positions
+            session_config.remove_file(os.path.join(self.measure_folder, _INDEX_FILENAME))
+        except OSError as e:
+            logger.warning("session index: cannot write {}: {}".format(filename, e))
+
+    def report(self):
+        return "{} positions indexed, {} configs and {} results read".format(
+            self.stats["indexed"], self.stats["config"], self.stats["results"]
+        )
+
+
+def update_index(measure_folder=None, index=None):
+    """refresh the index (loaded if not given) of all the positions under measure_folder and save it"""
+    if index is None:
+        index = SessionIndex(measure_folder)
+    index.stats = dict.fromkeys(index.stats, 0)
+    index.configs.stats = dict.fromkeys(index.configs.stats, 0)
+    for folder in session_discovery.position_folders(measure_folder):
+        try:
+            index.position(folder)
+        except Exception as e:
+            logger.warning("session index: skipping {}: {}".format(folder, e))
+    index.save()
+    logger.info("session index: {}".format(index.report()))
+    return index
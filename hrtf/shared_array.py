@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""numpy arrays in shared memory, filled in place by the worker processes of job_scheduler
+
+The sofa scripts load thousands of .far files / bundles: decoding them (unzip, unpickle) holds the
+GIL, a thread pool does not scale. The parent allocates the whole Data_IR array in shared memory
+(SharedArray), the process mode tasks get its handle (name, shape, dtype: a few bytes pickled),
+attach it and write their rows: nothing is pickled back to the parent.
+"""
+
+import shutil
+import logging
+import contextlib
+
+import numpy as np
+
+from multiprocessing import shared_memory
+
+logger = logging.getLogger(__name__)
+
+#
+# DEFINES / CONSTANT / GLOBALS
+#
+_SHM_FOLDER = "/dev/shm"  # posix shared memory (tmpfs), bounded by its mount size
+
+
+#
+# TOOLS
+#
+def nbytes(shape=None, dtype=np.float64):
+    return int(np.prod(shape, dtype=np.int64)) * np.dtype(dtype).itemsize
+
+
+def available(shape=None, dtype=np.float64):
+    """True if an array of shape fits the free shared memory: pages are allocated when written,
+    a full tmpfs kills the writer (SIGBUS) instead of failing the allocation"""
+    try:
+        free = shutil.disk_usage(_SHM_FOLDER).free
+    except OSError:
+        return True  # no tmpfs mount to check (not linux)
+    return nbytes(shape, dtype) <= free
+
+
+class SharedArray:
+    """Zero filled array of shape in a new shared memory block: array is the parent view, handle
+    the picklable reference for attach. release (once the views are dropped) frees the block."""
+
+    def __init__(self, shape=None, dtype=np.float64):
+        self.shape = tuple(int(n) for n in shape)
+        self.dtype = np.dtype(dtype)
+        self.shm = shared_memory.SharedMemory(create=True, size=max(1, nbytes(self.shape, self.dtype)))
+        self.array = np.ndarray(self.shape, dtype=self.dtype, buffer=self.shm.buf)
+        self.array.fill(0)
+
+    def handle(self):
+        return (self.shm.name, self.shape, self.dtype.str)
+
+    def release(self):
+        """drop the parent view and free the block: the views taken from array must be dropped"""
+        self.array = None
+        try:
+            self.shm.close()
+        except BufferError:
+            logger.warning("shared array {}: views still in use, freed at exit".format(self.shm.name))
+        self.shm.unlink()
+
+
+@contextlib.contextmanager
+def attach(target=None):
+    """ndarray of target: a SharedArray handle (attached for the with block only: the worker
+    resident memory does not grow with the rows written by its previous tasks) or an ndarray
+    (thread mode and serial loads, returned as is)"""
+    if isinstance(target, np.ndarray):
+        yield target
+        return
+
+    name, shape, dtype = target
+    shm = shared_memory.SharedMemory(name=name)
+    array = None
+    try:
+        array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+        yield array
+    finally:
+        del array
+        shm.close()
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""SOFA file written measurement by measurement: Data.IR is never held in memory as a whole
+
+sof.write_sofa needs the whole Data_IR array (measures x receivers x samples, float64): many GB for
+dense maps and long IR windows, and a long stall at the end while it is compressed and written.
+SofaStreamWriter creates the same netCDF4 layout of sof.write_sofa up front (dimensions, global
+attributes, all the variables but Data.IR) from a Sofa object without IR samples, Data.IR is
+created chunked (one measurement for each chunk) and compressed as sof.write_sofa, the IR samples
+are written as they are loaded (write). The file is read and verified by sofar as any other.
+
+The layout follows sofar (1.x) write: the Sofa object dimensions and conventions (sofa._api,
+sofa._convention, sofa._dimensions) and the netCDF value formatting of sofar.io. These are sofar
+internals (tested with sofar 1.3, see readme.txt): without them (available) the files are written
+by sof.write_sofa, with its default layout and the whole Data_IR in memory.
+
+Random access: renderers and display tools fetch one or a few directions at a time, the HDF5 chunk
+is the unit of read and decompression. sof.write_sofa lets the library chunk Data.IR (tens of
+measurements for each chunk), one direction costs the decompression of all of them. The chunks
+of Data.IR (measurements x receivers, all the samples) and the filters (deflate level, shuffle)
+are selectable here (write_sofa), layout_report measures the storage size and the read latency
+of one direction of a file.
+"""
+
+import os
+import time
+import pathlib
+import logging
+
+import numpy as np
+import sofar as sof
+
+from netCDF4 import Dataset, stringtochar
+
+try:
+    from sofar.io import _format_value_for_netcdf
+except ImportError:
+    _format_value_for_netcdf = None  # see available
+
+logger = logging.getLogger(__name__)
+
+#
+# DEFINES / CONSTANT / GLOBALS
+#
+_COMPRESSION = 4  # zlib level, sof.write_sofa default (0: no compression)
+_DATA_IR = "Data_IR"
+_REPORT_PROBES = 16  # random directions read by layout_report
+
+
+#
+# TOOLS
+#
+def available(sofa=None):
+    """True if the sofar internals of SofaStreamWriter are there (sofar 1.3), for sofa if given"""
+    if _format_value_for_netcdf is None:
+        return False
+    return sofa is None or all(hasattr(sofa, name) for name in ("_api", "_convention", "_dimensions"))
+
+
+def parse_chunks(text=None, receivers=None):
+    """(measurements, receivers) of a Data.IR chunk from "measurements[,receivers]", 0 or no
+    receivers: all of them"""
+    values = [int(value) for value in str(text).split(",") if value.strip() != ""]
+    if len(values) == 0 or len(values) > 2 or values[0] < 1 or (len(values) == 2 and values[1] < 0):
+        raise ValueError("invalid chunks {}: measurements[,receivers]".format(text))
+    if len(values) == 1 or values[1] == 0:
+        return (values[0], int(receivers))
+    return (values[0], min(values[1], int(receivers)))
+
+
+def layout_params(yaml_params=None, receivers=None):
+    """{"compression", "chunks", "shuffle"} of write_sofa / SofaStreamWriter from the sofa scripts
+    params (compression, chunks, no_shuffle options)"""
+    chunks = yaml_params.get("chunks", None)
+    return {
+        "compression": int(yaml_params.get("compression", _COMPRESSION)),
+        "chunks": None if chunks in (None, "") else parse_chunks(chunks, receivers),
+        "shuffle": not yaml_params.get("no_shuffle", False),
+    }
+
+
+#
+# WRITER
+#
+class SofaStreamWriter:
+    """SOFA file of sofa (all but Data_IR set) with Data.IR of shape (measures, receivers, samples),
+    written by write(start, data). Use as a context manager: the file is closed on exit and removed
+    if the block raised (a partial Data.IR is not a valid measure). Data.IR chunks: (measures,
+    receivers) of chunks (default one measure, all the receivers), compression: zlib level of all
+    the variables, shuffle: HDF5 shuffle filter of Data.IR."""
+
+    def __init__(self, filename=None, sofa=None, shape=None, compression=_COMPRESSION, chunks=None, shuffle=True):
+        if not available(sofa):
+            raise RuntimeError("sofa stream: sofar {} not supported, see available".format(sof.__version__))
+        self.filename = str(pathlib.Path(filename).with_suffix(".sofa"))
+        self.shape = tuple(int(n) for n in shape)
+        self.written = 0
+        if chunks is None:
+            chunks = (1, self.shape[1])
+        chunks = (min(int(chunks[0]), self.shape[0]), min(int(chunks[1]), self.shape[1]), self.shape[2])
+
+        # dimensions from a one sample placeholder (verify copies Data_IR), then the real N
+        sofa.Data_IR = np.zeros(self.shape[:2] + (1,))
+        sofa.verify(mode="write")
+        dimensions = dict(sofa._api)
+        dimensions["N"] = self.shape[2]
+
+        use_zlib = compression != 0
+        all_keys = [key for key in sofa.__dict__.keys() if not key.startswith("_")]
+
+        self.file = Dataset(self.filename, "w", format="NETCDF4")
+        try:
+            for dim in dimensions:
+                self.file.createDimension(dim, dimensions[dim])
+
+            # global attributes
+            for key in [key for key in all_keys if key.startswith("GLOBAL_")]:
+                setattr(self.file, key[7:], str(getattr(sofa, key)))
+
+            # variables, same order of sof.write_sofa
+            for key in all_keys:
+                if sofa._convention[key]["type"] == "attribute":
+                    continue
+
+                shape = list(sofa._dimensions[key])
+                if key == _DATA_IR:
+                    var = self.file.createVariable(
+                        "Data.IR",
+                        "f8",
+                        shape,
+                        zlib=use_zlib,
+                        complevel=compression,
+                        shuffle=shuffle,
+                        chunksizes=chunks,
+                    )
+                    self.ir = var
+                else:
+                    value, dtype = _format_value_for_netcdf(
+                        getattr(sofa, key), key, sofa._convention[key]["type"], sofa._dimensions[key], sofa._api["S"]
+                    )
+                    var = self.file.createVariable(
+                        key.replace("Data_", "Data."), dtype, shape, zlib=use_zlib, complevel=compression
+                    )
+                    if dtype == "f8":
+                        var[:] = value
+                    else:
+                        var[:] = stringtochar(value, encoding="utf-8")
+
+                # variable attributes
+                for sub_key in [k for k in all_keys if k.startswith(f"{key}_")]:
+                    setattr(var, sub_key[len(key) + 1 :], str(getattr(sofa, sub_key)))
+        except Exception:
+            self.abort()
+            raise
+
+        # the placeholder is not the file content
+        sofa.Data_IR = []
+
+    def write(self, start=0, data=None):
+        """IR samples of the measures start..start + len(data), shape (measures, receivers, samples)"""
+        self.ir[start : start + len(data), :, :] = data
+        self.written += len(data)
+
+    def close(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+        if self.written != self.shape[0]:
+            logger.warning(
+                "sofa stream: {} measures written of {} in {}".format(self.written, self.shape[0], self.filename)
+            )
+
+    def abort(self):
+        """close and remove the partial file"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        try:
+            os.remove(self.filename)
+        except OSError:
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+#
+# RANDOM ACCESS LAYOUT
+#
+def write_sofa(filename=None, sofa=None, compression=_COMPRESSION, chunks=None, shuffle=True):
+    """sof.write_sofa(filename, sofa, compression) with the Data.IR chunks (measures, receivers) and
+    shuffle filter given (see SofaStreamWriter), sof.write_sofa itself without (or without the
+    sofar internals, see available)"""
+    if chunks is None and shuffle:
+        sof.write_sofa(filename, sofa, compression=compression)
+        return
+    if not available(sofa):
+        logger.warning("sofa stream: sofar {} not supported, default layout for {}".format(sof.__version__, filename))
+        sof.write_sofa(filename, sofa, compression=compression)
+        return
+
+    data = np.asarray(sofa.Data_IR)
+    try:
+        with SofaStreamWriter(filename, sofa, data.shape, compression=compression, chunks=chunks, shuffle=shuffle) as w:
+            w.write(0, data)
+    finally:
+        sofa.Data_IR = data
+
+
+def read_measurement(filename=None, measure=0, receiver=None):
+    """IR samples of one measure (receivers x samples), or of one receiver of it, without reading
+    the other measures of Data.IR"""
+    with Dataset(str(filename), "r") as file:
+        file.set_auto_mask(False)
+        if receiver is None:
+            return file.variables["Data.IR"][int(measure), :, :]
+        return file.variables["Data.IR"][int(measure), int(receiver), :]
+
+
+def layout_report(filename=None, probes=_REPORT_PROBES, seed=0):
+    """{"shape", "chunks", "compression", "shuffle", "file_size", "data_size", "ratio", "measure_read",
+    "receiver_read", "full_read"} of a SOFA file: sizes in bytes (data_size: Data.IR uncompressed),
+    read times in seconds, of one random direction (open and read, average of probes) and of the
+    whole Data.IR"""
+    filename = str(filename)
+    with Dataset(filename, "r") as file:
+        var = file.variables["Data.IR"]
+        shape = var.shape
+        chunking = var.chunking()
+        filters = var.filters()
+        data_size = int(np.prod(shape)) * var.dtype.itemsize
+
+    rng = np.random.default_rng(seed)
+    measures = rng.integers(0, shape[0], size=probes)
+    receivers = rng.integers(0, shape[1], size=probes)
+
+    t0 = time.perf_counter()
+    for measure in measures:
+        read_measurement(filename, measure)
+    measure_read = (time.perf_counter() - t0) / probes
+
+    t0 = time.perf_counter()
+    for measure, receiver in zip(measures, receivers):
+        read_measurement(filename, measure, receiver)
+    receiver_read = (time.perf_counter() - t0) / probes
+
+    t0 = time.perf_counter()
+    with Dataset(filename, "r") as file:
+        file.set_auto_mask(False)
+        file.variables["Data.IR"][...]
+    full_read = time.perf_counter() - t0
+
+    file_size = os.path.getsize(filename)
+    return {
+        "shape": tuple(shape),
+        "chunks": "contiguous" if chunking == "contiguous" else tuple(chunking),
+        "compression": filters["complevel"] if filters["zlib"] else 0,
+        "shuffle": bool(filters["shuffle"]),
+        "file_size": file_size,
+        "data_size": data_size,
+        "ratio": data_size / max(file_size, 1),
+        "measure_read": measure_read,
+        "receiver_read": receiver_read,
+        "full_read": full_read,
+    }
+
+
+def format_report(report=None):
+    """one line of layout_report"""
+    return (
+        "Data.IR {} chunks {} deflate {} shuffle {}: {:.1f} MB ({:.2f}x), one direction {:.2f} ms, "
+        "one receiver {:.2f} ms, all {:.2f} s".format(
+            report["shape"],
+            report["chunks"],
+            report["compression"],
+            report["shuffle"],
+            report["file_size"] / 1e6,
+            report["ratio"],
+            1e3 * report["measure_read"],
+            1e3 * report["receiver_read"],
+            report["full_read"],
+        )
+    )
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""Measurements of an existing SOFA file replaced or appended along M, the others are not read
+
+A few positions re-measured, or an elevation ring added, do not need a rebuild of the whole file:
+update_measurements writes the new values of the measurement dimension (M) variables of the changed
+positions only. Replacements are written in place, appends rewrite the file (the netCDF dimensions
+are fixed): all the variables and attributes are copied with the same chunking and compression,
+the M variables a block of measurements at a time, to a temporary file that replaces the original.
+"""
+
+import os
+import logging
+
+import numpy as np
+
+from netCDF4 import Dataset, chartostring
+
+logger = logging.getLogger(__name__)
+
+#
+# DEFINES / CONSTANT / GLOBALS
+#
+_M = "M"  # measurements dimension
+_COPY_BLOCK = 16  # measurements copied at once when the file is rewritten
+
+
+#
+# TOOLS
+#
+def read_variables(filename=None, names=None):
+    """{name: array} of the variables names of a SOFA file (netCDF names, i.e. Data.Delay), strings for
+    the char variables (descriptions). Do not ask for Data.IR, it is read whole."""
+    rv = {}
+    with Dataset(filename, "r") as file:
+        file.set_auto_mask(False)
+        for name in names:
+            var = file.variables[name]
+            value = var[:]
+            if var.dtype == np.dtype("S1"):
+                value = [str(s) for s in chartostring(value)]
+            rv[name] = value
+    return rv
+
+
+def dimensions(filename=None):
+    """{name: size} of the dimensions of a SOFA file (M, R, N, ...)"""
+    with Dataset(filename, "r") as file:
+        return {name: len(dim) for name, dim in file.dimensions.items()}
+
+
+def _measurement_variables(file=None):
+    """names of the variables of the M dimension (first)"""
+    return [name for name, var in file.variables.items() if len(var.dimensions) > 0 and var.dimensions[0] == _M]
+
+
+def _check_values(file=None, rows=None, values=None):
+    for name in _measurement_variables(file):
+        if name not in values:
+            raise ValueError("no new values for the measurements variable {}".format(name))
+        if len(values[name]) != len(rows):
+            raise ValueError("{} new values for {}, {} measurements".format(len(values[name]), name, len(rows)))
+
+
+def _copy_variable(src=None, dst=None):
+    """new variable in dst as src (type, dimensions, chunking, compression, attributes)"""
+    filters = src.filters()
+    chunking = src.chunking()
+    var = dst.createVariable(
+        src.name,
+        src.datatype,
+        src.dimensions,
+        zlib=filters["zlib"],
+        complevel=filters["complevel"],
+        shuffle=filters["shuffle"],
+        fletcher32=filters["fletcher32"],
+        contiguous=chunking == "contiguous",
+        chunksizes=None if chunking == "contiguous" else chunking,
+    )
+    var.setncatts({key: src.getncattr(key) for key in src.ncattrs()})
+    return var
+
+
+#
+# UPDATE
+#
+def update_measurements(filename=None, rows=None, values=None):
+    """Write values ({netCDF name: new rows}, for all the variables of the M dimension, the others are
+    ignored) at the measurements rows: below the file M replaced, M, M + 1, ... appended (in this order)."""
+    rows = [int(row) for row in rows]
+    measures = dimensions(filename)[_M]
+    appended = [row for row in rows if row >= measures]
+    if appended != list(range(measures, measures + len(appended))):
+        raise ValueError("appended measurements must follow the {} of {}".format(measures, filename))
+
+    if len(appended) == 0:
+        # replacements only: in place
+        with Dataset(filename, "a") as file:
+            file.set_auto_mask(False)
+            _check_values(file, rows, values)
+            for name in _measurement_variables(file):
+                var = file.variables[name]
+                for k, row in enumerate(rows):
+                    var[row, ...] = values[name][k]
+        logger.info("sofa update: {} measurements replaced in {}".format(len(rows), filename))
+        return
+
+    # appends: the file is rewritten with the new M
+    tmp_filename = filename + ".tmp"
+    new_measures = measures + len(appended)
+    try:
+        with Dataset(filename, "r") as src, Dataset(tmp_filename, "w", format="NETCDF4") as dst:
+            src.set_auto_mask(False)
+            _check_values(src, rows, values)
+
+            for name, dim in src.dimensions.items():
+                dst.createDimension(name, new_measures if name == _M else len(dim))
+            dst.setncatts({key: src.getncattr(key) for key in src.ncattrs()})
+
+            for name, src_var in src.variables.items():
+                var = _copy_variable(src_var, dst)
+                var.set_auto_mask(False)
+                if len(src_var.dimensions) == 0 or src_var.dimensions[0] != _M:
+                    var[...] = src_var[...]
+                    continue
+
+                # old measurements by blocks, then the replaced and the appended ones
+                for start in range(0, measures, _COPY_BLOCK):
+                    stop = min(measures, start + _COPY_BLOCK)
+                    var[start:stop, ...] = src_var[start:stop, ...]
+                for k, row in enumerate(rows):
+                    var[row, ...] = values[name][k]
+
+        os.replace(tmp_filename, filename)
+    except BaseException:
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+    logger.info(
+        "sofa update: {} measurements replaced, {} appended in {}".format(
+            len(rows) - len(appended), len(appended), filename
+        )
+    )
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""Per-stage wall/CPU time and peak memory records (JSON lines) for the compute scripts"""
+
+import os
+import json
+import time
+import socket
+import logging
+import datetime
+
+import job_scheduler
+
+logger = logging.getLogger(__name__)
+
+#
+# DEFINES / CONSTANT / GLOBALS
+#
+_MB = 1024.0**2
+
+
+#
+# TOOLS
+#
+def read_records(filenames=None):
+    """all the records of the given JSON lines files (invalid lines are skipped)"""
+    records = []
+    for filename in filenames:
+        with open(filename, "r") as file:
+            for line in file:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    pass
+    return records
+
+
+def percentile(values=None, q=95):
+    values = sorted(values)
+    if len(values) == 0:
+        return 0.0
+    return values[min(len(values) - 1, int(round(q / 100 * (len(values) - 1))))]
+
+
+def stage_summary(records=None, by_receiver=False):
+    """aggregate records by stage (and receiver): {(stage, rx): {count, wall_s, cpu_s, mean/p95/max_s, peak_rss_mb}}
+
+    stages keep the order of their first record, whole folder records (see StageTimer.close) are skipped.
+    """
+    summary = {}
+    for r in records:
+        if r.get("scope") == "folder":
+            continue
+        key = (r["stage"], r.get("rx") if by_receiver else None)
+        s = summary.setdefault(key, {"walls": [], "cpu_s": 0.0, "peak_rss_mb": 0.0})
+        s["walls"].append(r["wall_s"])
+        s["cpu_s"] += r["cpu_s"]
+        s["peak_rss_mb"] = max(s["peak_rss_mb"], r.get("peak_rss_mb") or 0.0)
+
+    for s in summary.values():
+        walls = s.pop("walls")
+        s["count"] = len(walls)
+        s["wall_s"] = sum(walls)
+        s["mean_s"] = s["wall_s"] / len(walls)
+        s["p95_s"] = percentile(walls, 95)
+        s["max_s"] = max(walls)
+    return summary
+
+
+#
+# TIMER
+#
+class StageTimer:
+    """Lap timer: each lap(stage) records the time elapsed since the previous lap.
+
+    Records (one JSON line each) are kept in memory and appended to filename by close(),
+    with a single write on a file opened in append mode: processes of the same run can
+    share the file. Memory is the process peak resident memory since the task start
+    (see job_scheduler.reset_peak_rss); CPU time includes all the threads of the process.
+    """
+
+    def __init__(self, filename=None, folder=None, source=None):
+        self.filename = filename
+        self.folder = str(folder)
+        self.source = source
+        self.records = []
+        self.closed = False
+        self.t_start = self.t_wall = time.perf_counter()
+        self.c_start = self.t_cpu = time.process_time()
+
+    def record(self, stage=None, rx=None, wall=0.0, cpu=0.0, scope="stage"):
+        self.records.append(
+            {
+                "scope": scope,
+                "time": datetime.datetime.now().isoformat(timespec="milliseconds"),
+                "host": socket.gethostname(),
+                "pid": os.getpid(),
+                "folder": self.folder,
+                "source": self.source,
+                "stage": stage,
+                "rx": None if rx is None else int(rx),
+                "wall_s": round(wall, 6),
+                "cpu_s": round(cpu, 6),
+                "peak_rss_mb": round(job_scheduler.peak_rss() / _MB, 1),
+            }
+        )
+
+    def lap(self, stage=None, rx=None):
+        """record stage (optional receiver) from the previous lap to now"""
+        if self.filename is None:
+            return
+        t_wall = time.perf_counter()
+        t_cpu = time.process_time()
+        self.record(stage, rx, t_wall - self.t_wall, t_cpu - self.t_cpu)
+        self.t_wall = t_wall
+        self.t_cpu = t_cpu
+
+    def close(self, stage="total"):
+        """record the whole folder time as stage (total, skipped, failed, ...) and append all the records,
+        once: the next calls do nothing (close("failed") on any exit keeps the first stage)"""
+        if self.filename is None or self.closed:
+            return
+        self.closed = True
+        self.record(stage, None, time.perf_counter() - self.t_start, time.process_time() - self.c_start, "folder")
+
+        data = "".join(json.dumps(r) + "\n" for r in self.records).encode("utf-8")
+        self.records = []
+        try:
+            fd = os.open(self.filename, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, data)
+            finally:
+                os.close(fd)
+        except OSError as e:
+            logger.error("stage timer: cannot write {}: {}".format(self.filename, e))
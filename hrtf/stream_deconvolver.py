@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Bounded-memory (uniformly partitioned overlap-save) deconvolution of long recordings
+
+Only the first samples of the impulse responses (the IR window actually kept) are computed:
+the recording is read in blocks of one filter partition, the inverse filter spectrum is
+computed once per partition and shared by all the tracks. Memory depends on the partition
+size, the IR window and the inverse filter length, not on the recording length.
+"""
+
+import logging
+
+import numpy as np
+import scipy.fft as sp_fft
+
+logger = logging.getLogger(__name__)
+
+#
+# DEFINES / CONSTANT / GLOBALS
+#
+_PARTITION_FRAMES = 65536  # inverse filter partition length (frames), one FFT block each
+
+
+#
+# TOOLS
+#
+def read_circular(read=None, frames=0, start=0, stop=0):
+    """frames start..stop of a recording of the given length, indexes wrap around (circular)"""
+    blocks = []
+    while start < stop:
+        begin = start % frames
+        end = min(frames, begin + (stop - start))
+        blocks.append(read(begin, end))
+        start += end - begin
+    return blocks[0] if len(blocks) == 1 else np.concatenate(blocks, axis=0)
+
+
+class InverseFilter:
+    """Inverse filter split in partitions, with the spectra precomputed for a window of length samples.
+
+    Each partition is transformed (real FFT) with the size needed by the overlap-save of one
+    recording block: partition + length - 1 samples, rounded up to a fast FFT size.
+    """
+
+    def __init__(self, taps=None, length=0, partition=_PARTITION_FRAMES):
+        self.taps = len(taps)
+        self.length = int(length)
+        self.partition = int(min(partition, self.taps))
+        self.fft_size = sp_fft.next_fast_len(self.partition + self.length - 1, real=True)
+
+        count = -(-self.taps // self.partition)
+        self.spectra = np.empty((count, self.fft_size // 2 + 1), dtype=np.complex128)
+        for p in range(count):
+            part = np.asarray(taps[p * self.partition : (p + 1) * self.partition], dtype=np.float64)
+            self.spectra[p] = sp_fft.rfft(part, n=self.fft_size)
+
+    def nbytes(self):
+        return self.spectra.nbytes
+
+
+#
+# DECONVOLUTION
+#
+def deconvolve_window(read=None, frames=0, end=0, inverse_filter=None):
+    """First inverse_filter.length samples of the circular convolution of a recording with the filter:
+
+        ir[n, track] = sum_i taps[i] * x[(end + n - i) % frames, track]
+
+    same samples of the full-length deconvolution (see compute_hrir.deconvolve_tracks) with the
+    taps zero padded to the recording length as [frames - end zeros, taps, zeros], i.e. the
+    reversed stimulus recorded up to frame end: only the frames end - taps + 1 .. end + length - 1
+    of the recording are read.
+
+    read(start, stop): frames start..stop of the recording (0 <= start < stop <= frames), one
+    column per track. Returns an array with one impulse response per row: (tracks, length)
+    """
+    b = inverse_filter.partition
+    length = inverse_filter.length
+    n = inverse_filter.fft_size
+
+    accumulator = None
+    segment = None
+    for p in range(len(inverse_filter.spectra)):
+        # partition p needs the recording frames end - (p + 1) * b + 1 .. end + length - p * b:
+        # the last length - 1 frames are the first ones of the previous partition block
+        start = end - (p + 1) * b + 1
+        if segment is None:
+            segment = read_circular(read, frames, start, start + b + length - 1)
+        else:
+            segment = np.concatenate((read_circular(read, frames, start, start + b), segment[: length - 1]), axis=0)
+
+        spectrum = sp_fft.rfft(segment.astype(np.float64, copy=False), n=n, axis=0)
+        spectrum *= inverse_filter.spectra[p][:, np.newaxis]
+        if accumulator is None:
+            accumulator = spectrum
+        else:
+            accumulator += spectrum
+
+    # overlap-save: the first b - 1 samples of each block are aliased
+    ir_tracks = sp_fft.irfft(accumulator, n=n, axis=0)[b - 1 : b - 1 + length]
+
+    return np.ascontiguousarray(ir_tracks.T)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+"""Bounded-window, coarse-to-fine alignment of the recorded ESS stimulus"""
+
+import logging
+
+import numpy as np
+import scipy.fft as sp_fft
+import scipy.signal as sig
+
+logger = logging.getLogger(__name__)
+
+#
+# DEFINES / CONSTANT / GLOBALS
+#
+_ALIGN_OVERSAMPLING = 4  # decimated rate is at least 2x this factor the max reference frequency
+_ALIGN_MAX_DECIMATION = 64  # upper bound for the coarse search decimation factor
+_ALIGN_REFINE_PERIODS = 1  # full-rate refine half window, in periods of the lowest reference frequency
+
+# search window, values in seconds
+_ALIGN_SEARCH_GUARD_s = 0.1  # extra search range around the paddings
+_ALIGN_TAIL_TOLERANCE_s = 0.05  # sweep tail search range around the expected position
+
+
+#
+# TOOLS
+#
+def ess_frequency(frequency_begin=20, frequency_end=20000, duration=15, time=0):
+    """Instantaneous frequency of the exponential sweep at the given time (seconds)"""
+    return frequency_begin * np.exp(time * np.log(frequency_end / frequency_begin) / duration)
+
+
+def decimation_factor(samplerate=96000, frequency_max=20000, oversampling=_ALIGN_OVERSAMPLING):
+    """Largest integer decimation factor that keeps frequency_max well below the new Nyquist"""
+    q = int(samplerate / (2 * oversampling * frequency_max))
+    return max(1, min(q, _ALIGN_MAX_DECIMATION))
+
+
+def parabolic_peak(y=None, idx=0):
+    """Sub-sample offset (-0.5..0.5) of the peak at idx, parabola through 3 points"""
+    if idx <= 0 or idx >= (len(y) - 1):
+        return 0.0
+
+    ym, y0, yp = y[idx - 1], y[idx], y[idx + 1]
+    den = ym - 2 * y0 + yp
+    if den == 0:
+        return 0.0
+
+    return float(np.clip(0.5 * (ym - yp) / den, -0.5, 0.5))
+
+
+#
+# ALIGN FUNCTIONS
+#
+def correlate_valid(segment=None, reference=None, cache=None, key=None):
+    """|cross-correlation| of reference with segment, full overlap lags only.
+
+    With a cache (see reference_cache) the conjugated reference spectrum is
+    computed once for each fft length and reused: key must identify reference.
+    """
+    if cache is None or key is None:
+        return np.abs(sig.correlate(segment, reference, mode="valid", method="fft"))
+
+    nfft = sp_fft.next_fast_len(len(segment), real=True)
+    reference_spectrum = cache.get(("spectrum", key, nfft), lambda: np.conj(np.fft.rfft(reference, n=nfft)))
+    corr = np.fft.irfft(np.fft.rfft(segment, n=nfft) * reference_spectrum, n=nfft)
+
+    return np.abs(corr[: (len(segment) - len(reference) + 1)])
+
+
+def align_reference(
+    data=None,
+    reference=None,
+    lag_min=None,
+    lag_max=None,
+    frequency_min=20,
+    frequency_max=20000,
+    samplerate=96000,
+    cache=None,
+    key=None,
+):
+    """Find where reference starts in data, searching only lags in [lag_min, lag_max].
+
+    The search is done in two steps:
+    - coarse: both signals are decimated according to the max frequency of the
+      reference (low frequency references are decimated a lot)
+    - refine: full rate correlation over a short window around the coarse peak,
+      plus parabolic interpolation for the sub-sample position
+
+    Returns (lag, lag_fraction): lag is the integer data index where the
+    reference starts, lag_fraction the sub-sample correction (-0.5..0.5).
+    The legacy full correlation peak index is lag + len(reference) - 1.
+
+    cache/key (optional): reuse the decimated reference and the reference spectra.
+    """
+    ref_len = len(reference)
+
+    # bound the search window to valid lags (full overlap only)
+    lag_last = len(data) - ref_len
+    lag_min = 0 if lag_min is None else int(max(0, lag_min))
+    lag_max = lag_last if lag_max is None else int(min(lag_last, lag_max))
+
+    if lag_min > lag_max:
+        logger.info("align_reference: empty search window, searching the whole recording")
+        lag_min, lag_max = 0, lag_last
+
+    #
+    # coarse search on decimated signals
+    #
+    q = decimation_factor(samplerate=samplerate, frequency_max=frequency_max)
+    if q > 1:
+        segment = sig.resample_poly(data[lag_min : (lag_max + ref_len)], 1, q)
+        if cache is None or key is None:
+            reference_q = sig.resample_poly(reference, 1, q)
+            key_q = None
+        else:
+            reference_q = cache.get(("decimated", key, q), lambda: sig.resample_poly(reference, 1, q))
+            key_q = ("decimated", key, q)
+        corr = correlate_valid(segment=segment, reference=reference_q, cache=cache, key=key_q)
+        lag_coarse = lag_min + int(np.argmax(corr)) * q
+
+        # full-rate window: decimation uncertainty plus one period of the lowest
+        # frequency, so that a neighbour correlation lobe cannot be picked
+        half_window = 2 * q + int(np.ceil(_ALIGN_REFINE_PERIODS * samplerate / frequency_min))
+        lag_min = max(lag_min, lag_coarse - half_window)
+        lag_max = min(lag_max, lag_coarse + half_window)
+
+    #
+    # refine at full rate
+    #
+    segment = data[lag_min : (lag_max + ref_len)]
+    corr = correlate_valid(segment=segment, reference=reference, cache=cache, key=key)
+    peak = int(np.argmax(corr))
+
+    return lag_min + peak, parabolic_peak(corr, peak)
+
+
+def align_sweep(
+    data=None,
+    head_reference=None,
+    tail_reference=None,
+    frequency_begin=20,
+    frequency_end=20000,
+    duration=15,
+    window=4,
+    padding_pre=1,
+    samplerate=96000,
+    cache=None,
+    key=None,
+    interleave=0,
+):
+    """Head/tail positions of the recorded ESS stimulus.
+
+    head_reference/tail_reference are the first/last window seconds of the sweep.
+    Positions follow the full-recording correlation convention used by compute_hrir:
+    head is the peak index minus the reference length, tail is the peak index
+    of the tail reference (last sample of the sweep).
+
+    cache/key (optional): reference_cache instance and stimulus parameters key,
+    the references spectra are then computed only once per session.
+
+    interleave (s, optional): a sweep every interleave seconds (see sweep_sequence), the
+    first one is searched up to half interleave after padding-pre.
+
+    Returns (head, tail, head_fraction)
+    """
+    fs = samplerate
+    T = duration
+
+    # the sweep starts after padding-pre (plus latency) and must end inside the recording
+    lag_max = int(len(data) - (T - _ALIGN_SEARCH_GUARD_s) * fs)
+    if interleave > 0:
+        lag_max = min(lag_max, int((padding_pre + interleave / 2) * fs))
+
+    lag, lag_fraction = align_reference(
+        data=data,
+        reference=head_reference,
+        lag_min=int((padding_pre - _ALIGN_SEARCH_GUARD_s) * fs),
+        lag_max=lag_max,
+        frequency_min=frequency_begin,
+        frequency_max=ess_frequency(frequency_begin, frequency_end, T, window),
+        samplerate=fs,
+        cache=cache,
+        key=None if key is None else (key, "head"),
+    )
+
+    # the sweep tail is expected (T - window) seconds after the head
+    tail_lag = lag + int((T - window) * fs)
+    tail_lag, _ = align_reference(
+        data=data,
+        reference=tail_reference,
+        lag_min=tail_lag - int(_ALIGN_TAIL_TOLERANCE_s * fs),
+        lag_max=tail_lag + int(_ALIGN_TAIL_TOLERANCE_s * fs),
+        frequency_min=ess_frequency(frequency_begin, frequency_end, T, T - window),
+        frequency_max=frequency_end,
+        samplerate=fs,
+        cache=cache,
+        key=None if key is None else (key, "tail"),
+    )
+
+    return (lag - 1), (tail_lag + len(tail_reference) - 1), lag_fraction
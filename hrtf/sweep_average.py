@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""Synchronous averaging of the repeated sweeps of a measure (sweep_0, sweep_1, ... see record_ess)
+
+Each repeat is aligned on its own sweep head (found on the stimulus track, see sweep_align) and the
+selected tracks are averaged block by block: only one block of each repeat is in memory at a time.
+The stimulus is the same for all the repeats, so the averaged recording is deconvolved as a single
+sweep while the uncorrelated noise drops by 10*log10(repeats) dB. Repeats far from the others (an
+impulsive noise, a movement) can be rejected before averaging, see repeat_residuals.
+"""
+
+import re
+import logging
+
+import numpy as np
+
+import track_reader
+
+logger = logging.getLogger(__name__)
+
+#
+# DEFINES / CONSTANT / GLOBALS
+#
+_AVERAGE_BLOCK_FRAMES = track_reader._READ_BLOCK_FRAMES  # frames of each repeat read per block
+_OUTLIER_MIN_REPEATS = 3  # the per-sample median needs at least 3 repeats to spot an outlier
+
+
+#
+# TOOLS
+#
+def repeat_filenames(audio_file=None, audio_file_ext="wav", repeat=1):
+    """File names of the repeats of audio_file: <name>_<n>, <name>_<n+1>, ... (record_ess naming)"""
+    match = re.fullmatch(r"(.*_)(\d+)", str(audio_file))
+    if match is None or repeat <= 1:
+        return [audio_file + "." + audio_file_ext]
+
+    first = int(match.group(2))
+    return [match.group(1) + str(first + r) + "." + audio_file_ext for r in range(int(repeat))]
+
+
+def align_repeats(filenames=None, track=0, align=None, dtype=np.float32):
+    """Sweep head of each repeat: list of (head, frames).
+
+    align(data, samplerate): sweep head (samples) of the stimulus track data, as sweep_align.align_sweep.
+    Only the stimulus track of one repeat is in memory at a time.
+    """
+    heads = []
+    for filename in filenames:
+        data, samplerate = track_reader.read_tracks(filename, tracks=[track], dtype=dtype)
+        heads.append((int(align(data[:, 0], samplerate)), len(data)))
+        del data
+    return heads
+
+
+def select_repeats(residuals=None, threshold_db=None):
+    """Indexes of the repeats to average: residual (dB) not above the median residual + threshold_db"""
+    residuals_db = 10 * np.log10(np.maximum(residuals, 1e-30))
+    if threshold_db is None or len(residuals) < _OUTLIER_MIN_REPEATS:
+        return list(range(len(residuals)))
+
+    median_db = float(np.median(residuals_db))
+    return [r for r in range(len(residuals)) if residuals_db[r] <= median_db + threshold_db]
+
+
+#
+# AVERAGE
+#
+class RepeatAverage:
+    """Average of the selected tracks of aligned recordings, read on demand (the files stay open).
+
+    Frame n of the average is the mean of frames n + offsets[r] of the repeats that have it:
+    offsets are the sweep head of each repeat minus the sweep head of the reference recording, the
+    average keeps the reference frames count (same paddings, same sweep head). Columns of the
+    returned blocks follow the order of the tracks list, as track_reader.read_tracks.
+    """
+
+    def __init__(self, filenames=None, tracks=None, offsets=None, frames=0, dtype=np.float32):
+        self.streams = []
+        try:
+            for filename in filenames:
+                self.streams.append(track_reader.TrackStream(filename, tracks=tracks, dtype=dtype))
+        except Exception:
+            self.close()
+            raise
+
+        self.tracks = [int(t) for t in tracks]
+        self.offsets = [int(o) for o in offsets]
+        self.frames = int(frames)
+        self.samplerate = self.streams[0].samplerate
+        self.dtype = dtype
+
+    def read_repeat(self, r=0, start=0, stop=0):
+        """frames start..stop of repeat r on the average time base, zeros where the repeat has no frames:
+        returns (block, valid) with valid the (first, last + 1) rows read from the recording"""
+        stream = self.streams[r]
+        begin = min(max(start + self.offsets[r], 0), stream.frames)
+        end = max(min(stop + self.offsets[r], stream.frames), begin)
+
+        block = np.zeros((stop - start, len(self.tracks)), dtype=np.float64)
+        first = begin - self.offsets[r] - start
+        if end > begin:
+            block[first : first + end - begin] = stream.read(begin, end)
+        return block, (first, first + end - begin)
+
+    def read(self, start=0, stop=0):
+        """frames start..stop of the average, shape (stop - start, len(tracks))"""
+        total = np.zeros((stop - start, len(self.tracks)), dtype=np.float64)
+        count = np.zeros(stop - start, dtype=np.float64)
+        for r in range(len(self.streams)):
+            block, (first, last) = self.read_repeat(r, start, stop)
+            total += block
+            count[first:last] += 1
+
+        total /= np.maximum(count, 1)[:, np.newaxis]
+        return total.astype(self.dtype, copy=False)
+
+    def read_all(self, blocksize=_AVERAGE_BLOCK_FRAMES):
+        """the whole average, shape (frames, len(tracks)), as track_reader.read_tracks"""
+        data = np.empty((self.frames, len(self.tracks)), dtype=self.dtype)
+        for start in range(0, self.frames, blocksize):
+            stop = min(self.frames, start + blocksize)
+            data[start:stop] = self.read(start, stop)
+        return data
+
+    def repeat_residuals(self, blocksize=_AVERAGE_BLOCK_FRAMES):
+        """Energy of each repeat minus the per-sample median of all the repeats, relative to the
+        median energy (all tracks, whole recording): one streaming pass over the repeats.
+
+        The median is not moved by a single outlier (at least 3 repeats), so an outlier repeat has a
+        residual well above the others, that are only left with their uncorrelated noise.
+        """
+        residuals = np.zeros(len(self.streams), dtype=np.float64)
+        energy = 0.0
+        for start in range(0, self.frames, blocksize):
+            stop = min(self.frames, start + blocksize)
+            blocks = np.stack([self.read_repeat(r, start, stop)[0] for r in range(len(self.streams))])
+            median = np.median(blocks, axis=0)
+            residuals += np.sum((blocks - median) ** 2, axis=(1, 2))
+            energy += float(np.sum(median**2))
+        return residuals / max(energy, 1e-30)
+
+    def close(self):
+        for stream in self.streams:
+            stream.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
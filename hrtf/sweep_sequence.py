@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""Interleaved (multiple exponential sweep) sequences: several sweeps in one recording
+
+The repeats of a measure are played every interleave seconds in the same recording, without the
+post/pre paddings between them: each sweep starts while the previous one's reverberation tail
+(and its harmonics, when the interleave is shorter than the sweep) is still decaying. The whole
+recording deconvolved with the inverse filter of one sweep gives the impulse response of each sweep
+every interleave seconds, the harmonic distortion products of the next sweep fall before it
+(T * log(order) / log(f2 / f1) seconds, see harmonic_lead): with an interleave longer than the IR
+window plus the lead of the harmonics the impulse responses are separated again and averaged.
+
+Sweeps overlapping in time are summed on the same output: their amplitude is divided by the number
+of sweeps playing at the same time (see overlap_count), so the playback never clips.
+"""
+
+import math
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+#
+# DEFINES / CONSTANT / GLOBALS
+#
+_HARMONIC_ORDER = 3  # harmonic distortion products kept out of the IR window (see min_interleave)
+
+
+#
+# TOOLS
+#
+def overlap_count(duration=15, interleave=0):
+    """sweeps playing at the same time: 1 unless the interleave is shorter than the sweep"""
+    if interleave <= 0 or interleave >= duration:
+        return 1
+    return int(math.ceil(duration / interleave))
+
+
+def sweep_amplitude(amplitude=0.8, duration=15, interleave=0):
+    """amplitude of each sweep of the sequence: the sum of the overlapping sweeps stays below amplitude"""
+    return amplitude / overlap_count(duration, interleave)
+
+
+def interleave_samples(interleave=0, samplerate=96000):
+    """sweeps start offset (samples), the same on playback and on the recording"""
+    return int(round(interleave * samplerate))
+
+
+def sequence_duration(duration=15, repeat=1, interleave=0):
+    """playback time (s) of the sweeps of one recording, paddings excluded"""
+    if interleave <= 0 or repeat <= 1:
+        return duration
+    return (repeat - 1) * interleave + duration
+
+
+def harmonic_lead(frequency_begin=20, frequency_end=20000, duration=15, order=2):
+    """time (s) before the impulse response where the harmonic distortion of the given order is found"""
+    return duration * math.log(order) / math.log(frequency_end / frequency_begin)
+
+
+def min_interleave(frequency_begin=20, frequency_end=20000, duration=15, ir_length=1.0, order=_HARMONIC_ORDER):
+    """shortest interleave (s) keeping the harmonics (up to order) of the next sweep out of the IR window"""
+    return ir_length + harmonic_lead(frequency_begin, frequency_end, duration, order)
+
+
+#
+# PLAYBACK
+#
+def sequence_block(
+    start=0,
+    frames=0,
+    samplerate=96000,
+    frequency_begin=20,
+    frequency_end=20000,
+    duration=15,
+    prepadding=2,
+    amplitude=0.8,
+    repeat=1,
+    interleave=0,
+):
+    """Frames start..start + frames of the playback: prepadding silence, then one sweep (interleave 0)
+    or repeat sweeps starting every interleave seconds, each with the given amplitude (already scaled,
+    see sweep_amplitude), then silence. Returns a (frames, 1) block."""
+    f1 = frequency_begin
+    f2 = frequency_end
+    T = duration
+    R = np.log(f2 / f1)
+
+    sweep_begin = int(prepadding * samplerate)
+    sweep_samples = int((prepadding + T) * samplerate) - sweep_begin
+    step = interleave_samples(interleave, samplerate)
+
+    block = np.zeros((frames, 1))
+    idx = start + np.arange(frames)
+    for k in range(repeat if step > 0 else 1):
+        n = idx - (sweep_begin + k * step)
+        valid = (n >= 0) & (n < sweep_samples)
+        if not np.any(valid):
+            continue
+        t = n[valid] / samplerate
+        block[valid, 0] += amplitude * np.sin((2 * np.pi * f1 * T / R) * (np.exp(t * R / T) - 1))
+
+    return block
+
+
+#
+# RECORDING
+#
+def separate_sweep(data=None, head=0, length=0, repeat=1, step=0):
+    """Recording of the first sweep (length samples from head) of a sequence of repeat sweeps starting
+    every step samples: the (time invariant) recordings of the following sweeps are removed, one step
+    at a time, as s[n] = data[head + n] - sum(s[n - k * step], k = 1 .. repeat - 1)"""
+    sweep = np.array(data[head : head + length])
+    if step <= 0 or step >= length or repeat <= 1:
+        return sweep
+
+    for begin in range(step, length, step):
+        end = min(begin + step, length)
+        for k in range(1, min(repeat - 1, begin // step) + 1):
+            sweep[begin:end] -= sweep[begin - k * step : end - k * step]
+    return sweep
+
+
+def average_slots(ir=None, step=0, repeat=1, start=0, length=0):
+    """Average of the impulse responses of the repeat sweeps (rows of the circular deconvolution ir),
+    one every step samples: samples k * step - start .. k * step - start + length of each sweep k"""
+    idx = np.arange(length) - start
+    average = np.zeros((ir.shape[0], length), dtype=np.float64)
+    for k in range(repeat):
+        average += np.take(ir, idx + k * step, axis=1, mode="wrap")
+    average /= repeat
+    return average
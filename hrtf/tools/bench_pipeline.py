@@ -0,0 +1,417 @@
+#!/usr/bin/env python3
+"""Benchmark the HRTF pipeline (compute_hrir, compute_sofa, compute_3dti_sofa) on a synthetic session.
+
+Each stage runs as a subprocess (same command line of runme_all.sh): wall time, CPU time and
+peak memory are measured (compute_hrir internal stages from its timings, see stage_timer.py), the delays found by compute_hrir are checked against the ground truth
+written by make_session.py and the results are appended to a history file (JSON lines), where
+each run is compared with the best previous run of the same session/setup.
+"""
+
+import os
+import sys
+import json
+import time
+import yaml
+import argparse
+import datetime
+import subprocess
+
+import numpy as np
+
+# hrtf scripts folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import ir_bundle  # noqa: E402
+import stage_timer  # noqa: E402
+import make_session  # noqa: E402
+import session_discovery  # noqa: E402
+
+#
+# DEFINES / CONSTANT / GLOBALS
+#
+_ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+_HISTORY_FILENAME = "bench_history.jsonl"
+_LOGS_FOLDER = "bench_logs"
+
+_STAGES = ["compute_hrir", "compute_sofa", "compute_3dti_sofa"]
+
+# compute_hrir delays are sub-sample peak positions, the legacy head detection makes them one sample
+# early: the mean error (bias) must stay at its recorded value, the error of each receiver around it
+# must be sub-sample (a one sample shift anywhere in align -> deconvolve -> peak_delays fails)
+_DELAY_BIAS_SAMPLES = -1.0
+_DELAY_BIAS_TOLERANCE_SAMPLES = 0.05
+_DELAY_TOLERANCE_SAMPLES = 0.1
+
+# a stage is a regression if slower than the best previous run by more than this factor
+_REGRESSION_TOLERANCE = 0.2
+
+
+#
+# TOOLS
+#
+def stage_command(
+    stage=None,
+    measure_folder=None,
+    cpu_process=1,
+    output_format="files",
+    timing_log=None,
+    deconvolution="full",
+    average_repeats=False,
+):
+    """command line of each stage (see runme_all.sh)"""
+    if stage == "compute_hrir":
+        return [
+            "compute_hrir.py",
+            "-v",
+            "-f",
+            "-c",
+            str(cpu_process),
+            "-of",
+            output_format,
+            "-dc",
+            deconvolution,
+            "-tl",
+            str(timing_log),
+            "-mf",
+            measure_folder,
+        ] + (["-ar"] if average_repeats else [])
+    if stage == "compute_sofa":
+        return ["compute_sofa.py", "-v", "-c", str(cpu_process), "-mf", measure_folder]
+    if stage == "compute_3dti_sofa":
+        return [
+            "compute_3dti_sofa.py",
+            "-v",
+            "-c",
+            str(cpu_process),
+            "-mf",
+            measure_folder,
+            "-irw",
+            "0.015",
+            "-z",
+            "-s",
+            "binaural",
+        ]
+    raise ValueError("unknown stage: {}".format(stage))
+
+
+def run_stage(command=None, logfile=None):
+    """run command in the hrtf folder: returns (returncode, wall time, CPU time, peak RSS MB) of the process tree"""
+    with open(logfile, "w") as log:
+        t0 = time.perf_counter()
+        process = subprocess.Popen([sys.executable] + command, cwd=_ROOT_DIR, stdout=log, stderr=subprocess.STDOUT)
+        # wait4: resources of the stage process and of its (waited) workers only
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - t0
+    process.returncode = os.waitstatus_to_exitcode(status)
+
+    return process.returncode, wall, usage.ru_utime + usage.ru_stime, usage.ru_maxrss / 1024
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=_ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def session_folders(measure_folder=None):
+    """position folders with ground truth: list of (folder, config, ground truth)"""
+    folders = []
+    for folder in sorted(session_discovery.position_folders(measure_folder)):
+        truth = make_session.read_ground_truth(folder)
+        if truth is None:
+            continue
+        with open(os.path.join(folder, "config.yaml"), "r") as file:
+            folders.append((folder, yaml.safe_load(file), truth))
+    return folders
+
+
+def session_signature(folders=None):
+    """setup that makes two runs comparable"""
+    config = folders[0][1]
+    sweep = config["custom"]["stimulus"]["sweep"]
+    return {
+        "positions": len(folders),
+        "receivers": int(config["setup"]["listeners"][0]["receivers_count"]),
+        "samplerate": int(config["custom"]["recording"]["samplerate"]),
+        "duration": sweep["duration"]["value"],
+        "padding": [sweep["padding"]["pre"]["value"], sweep["padding"]["post"]["value"]],
+        "repeats": int(sweep.get("repeat", {}).get("value", 1)),
+    }
+
+
+def read_delays(folder=None, config=None):
+    """{rx_id: ir_delay in samples} found by compute_hrir (bundle or per receiver yaml)"""
+    samplerate = float(config["custom"]["recording"]["samplerate"])
+    if ir_bundle.has_bundle(folder, config):
+        results = ir_bundle.read_results(folder, config)
+        return {} if results is None else {rx: v["ir_delay"] * samplerate for rx, v in results.items()}
+
+    delays = {}
+    for rx_id, receiver in config["setup"]["listeners"][0]["receivers"].items():
+        filename = os.path.join(
+            folder,
+            "ir",
+            "{}_IR_rx_{}_trid_{}.yaml".format(config["custom"]["audio_filename"], rx_id, receiver["track_id"]),
+        )
+        try:
+            with open(filename, "r") as file:
+                delays[int(rx_id)] = float(yaml.safe_load(file)["ir_delay"]) * samplerate
+        except (OSError, KeyError, TypeError, ValueError):
+            pass
+    return delays
+
+
+def check_delays(
+    folders=None,
+    tolerance=_DELAY_TOLERANCE_SAMPLES,
+    expected_bias=_DELAY_BIAS_SAMPLES,
+    bias_tolerance=_DELAY_BIAS_TOLERANCE_SAMPLES,
+):
+    """compare compute_hrir delays with the ground truth: errors in samples, failed: receivers missing
+    or with an error farther than tolerance from expected_bias, bias_failed: mean error farther than
+    bias_tolerance from expected_bias"""
+    errors = []
+    missing = 0
+    for folder, config, truth in folders:
+        delays = read_delays(folder, config)
+        for rx_id, receiver in truth["receivers"].items():
+            if int(rx_id) not in delays:
+                missing += 1
+                continue
+            errors.append(delays[int(rx_id)] - receiver["delay_samples"])
+
+    errors = np.asarray(errors)
+    if len(errors) == 0:
+        return {
+            "count": 0,
+            "missing": missing,
+            "failed": missing,
+            "bias": None,
+            "expected_bias": expected_bias,
+            "bias_failed": True,
+            "std": None,
+            "max_abs": None,
+            "max_residual": None,
+        }
+
+    residuals = errors - expected_bias
+    return {
+        "count": int(len(errors)),
+        "missing": int(missing),
+        "failed": int(missing + np.sum(np.abs(residuals) > tolerance)),
+        "bias": float(np.mean(errors)),
+        "expected_bias": expected_bias,
+        "bias_failed": bool(abs(np.mean(errors) - expected_bias) > bias_tolerance),
+        "std": float(np.std(errors)),
+        "max_abs": float(np.max(np.abs(errors))),
+        "max_residual": float(np.max(np.abs(residuals))),
+    }
+
+
+def read_history(filename=None):
+    history = []
+    if os.path.exists(filename):
+        with open(filename, "r") as file:
+            for line in file:
+                if line.strip() != "":
+                    history.append(json.loads(line))
+    return history
+
+
+def best_previous(history=None, record=None, stage=None):
+    """best wall time of stage in the previous runs with the same setup, None if not available"""
+    times = [
+        h["stages"][stage]["wall_s"]
+        for h in history
+        if h["session"] == record["session"]
+        and h["cpu_process"] == record["cpu_process"]
+        and h["output_format"] == record["output_format"]
+        and h.get("deconvolution", "full") == record["deconvolution"]
+        and h.get("average_repeats", False) == record["average_repeats"]
+        and stage in h["stages"]
+        and h["stages"][stage]["returncode"] == 0
+    ]
+    return min(times) if len(times) > 0 else None
+
+
+###############################################################################
+# MAIN
+###############################################################################
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "-mf", "--measure_folder", type=str, required=True, help="synthetic session folder (see make_session.py)"
+    )
+    parser.add_argument(
+        "-c", "--cpu_process", type=int, default=6, help="maximum number of CPU process to use (default: %(default)s)"
+    )
+    parser.add_argument(
+        "-st",
+        "--stages",
+        type=str,
+        default=",".join(_STAGES),
+        help="comma separated stages to run (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-of",
+        "--output_format",
+        type=str,
+        default="files",
+        help="compute_hrir results format: files, bundle, both (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-dc",
+        "--deconvolution",
+        type=str,
+        default="full",
+        help="compute_hrir deconvolution: full, stream (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-ar",
+        "--average_repeats",
+        action="store_true",
+        default=False,
+        help="compute_hrir: average the repeated sweeps (see make_session.py -r) (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-o",
+        "--history",
+        type=str,
+        default=None,
+        help="results history file (default: <measure_folder>/{})".format(_HISTORY_FILENAME),
+    )
+    parser.add_argument(
+        "-dt",
+        "--delay_tolerance",
+        type=float,
+        default=_DELAY_TOLERANCE_SAMPLES,
+        help="max delay error vs the ground truth, around the expected bias (samples) (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-db",
+        "--delay_bias",
+        type=float,
+        default=_DELAY_BIAS_SAMPLES,
+        help="expected mean delay error vs the ground truth (samples) (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-bt",
+        "--bias_tolerance",
+        type=float,
+        default=_DELAY_BIAS_TOLERANCE_SAMPLES,
+        help="max drift of the mean delay error from the expected bias (samples) (default: %(default)s)",
+    )
+    parser.add_argument("-l", "--label", type=str, default="", help="free text stored with the results")
+    parser.add_argument(
+        "-rt",
+        "--regression_tolerance",
+        type=float,
+        default=_REGRESSION_TOLERANCE,
+        help="slow-down vs the best previous run flagged as regression (default: %(default)s)",
+    )
+    args = parser.parse_args()
+
+    measure_folder = os.path.abspath(args.measure_folder)
+    stages = [s.strip() for s in args.stages.split(",") if s.strip() != ""]
+    for stage in stages:
+        if stage not in _STAGES:
+            sys.exit("\n[ERROR] unknown stage: {}".format(stage))
+
+    folders = session_folders(measure_folder)
+    if len(folders) == 0:
+        sys.exit("\n[ERROR] no synthetic measures in: {}".format(measure_folder))
+
+    history_file = args.history if args.history is not None else os.path.join(measure_folder, _HISTORY_FILENAME)
+    logs_folder = os.path.join(os.path.dirname(os.path.abspath(history_file)), _LOGS_FOLDER)
+    os.makedirs(logs_folder, exist_ok=True)
+
+    record = {
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "revision": git_revision(),
+        "label": args.label,
+        "session": session_signature(folders),
+        "cpu_process": args.cpu_process,
+        "output_format": args.output_format,
+        "deconvolution": args.deconvolution,
+        "average_repeats": args.average_repeats,
+        "stages": {},
+        "delays": None,
+        "hrir_stages": None,
+    }
+    history = read_history(history_file)
+
+    failed = 0
+    for stage in stages:
+        timing_log = os.path.join(logs_folder, "compute_hrir_stages.jsonl")
+        if stage == "compute_hrir" and os.path.exists(timing_log):
+            os.remove(timing_log)
+
+        command = stage_command(
+            stage,
+            measure_folder,
+            args.cpu_process,
+            args.output_format,
+            timing_log,
+            args.deconvolution,
+            args.average_repeats,
+        )
+        logfile = os.path.join(logs_folder, stage + ".log")
+        returncode, wall, cpu, rss = run_stage(command, logfile)
+        record["stages"][stage] = {"returncode": returncode, "wall_s": wall, "cpu_s": cpu, "peak_rss_mb": rss}
+
+        best = best_previous(history, record, stage)
+        status = "ok" if returncode == 0 else "FAILED (see {})".format(logfile)
+        if returncode != 0:
+            failed += 1
+        elif best is not None and wall > best * (1 + args.regression_tolerance):
+            status = "REGRESSION (best {:.2f} s)".format(best)
+            failed += 1
+
+        print(
+            "{:<18s} wall {:8.2f} s, cpu {:8.2f} s, peak rss {:8.1f} MB, {}".format(stage, wall, cpu, rss, status)
+        )
+
+        if stage == "compute_hrir" and os.path.exists(timing_log):
+            summary = stage_timer.stage_summary(stage_timer.read_records([timing_log]))
+            record["hrir_stages"] = {name: round(s["wall_s"], 6) for (name, _), s in summary.items()}
+            for name, wall_s in record["hrir_stages"].items():
+                print("  {:<22s} wall {:8.2f} s (sum over workers)".format(name, wall_s))
+
+        if stage == "compute_hrir" and returncode == 0:
+            record["delays"] = check_delays(folders, args.delay_tolerance, args.delay_bias, args.bias_tolerance)
+            delays = record["delays"]
+            if delays["count"] > 0:
+                print(
+                    "{:<18s} {} receivers, bias {:+.3f} (expected {:+.3f}), std {:.3f}, max error {:.3f}, "
+                    "max error around the bias {:.3f} (samples), failed: {}".format(
+                        "delays",
+                        delays["count"],
+                        delays["bias"],
+                        delays["expected_bias"],
+                        delays["std"],
+                        delays["max_abs"],
+                        delays["max_residual"],
+                        delays["failed"],
+                    )
+                )
+            if delays["failed"] > 0 or delays["count"] == 0:
+                print("{:<18s} ERROR: {} delays out of tolerance or missing".format("delays", delays["failed"]))
+                failed += 1
+            elif delays["bias_failed"]:
+                print(
+                    "{:<18s} ERROR: bias {:+.3f} drifted from {:+.3f} by more than {} (samples)".format(
+                        "delays", delays["bias"], delays["expected_bias"], args.bias_tolerance
+                    )
+                )
+                failed += 1
+
+    with open(history_file, "a") as file:
+        file.write(json.dumps(record) + "\n")
+    print("results appended to {}".format(history_file))
+
+    sys.exit(1 if failed > 0 else 0)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Benchmark the Data.IR layouts of a SOFA file: the file is written again with each chunks x deflate
+level x shuffle combination (sofa_stream.write_sofa), storage size vs read time of one direction, of
+one receiver and of the whole Data.IR (sofa_stream.layout_report), checked against the input file"""
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import itertools
+
+import numpy as np
+import sofar as sof
+
+# hrtf scripts folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import sofa_stream  # noqa: E402
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-f", "--sofa_file", type=str, required=True, help="SOFA file")
+    parser.add_argument(
+        "-ck",
+        "--chunks",
+        type=str,
+        default="sofar;1,0;1,1;8,0",
+        help="';' separated Data.IR chunks, measurements[,receivers] or sofar (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-cl", "--compression", type=str, default="0,1,4", help="comma separated zlib levels (default: %(default)s)"
+    )
+    parser.add_argument(
+        "-s", "--shuffle", type=str, default="1", help="comma separated shuffle filter, 0/1 (default: %(default)s)"
+    )
+    parser.add_argument("-p", "--probes", type=int, default=16, help="random directions read (default: %(default)s)")
+    parser.add_argument("-o", "--output_folder", type=str, default=None, help="output folder (default: temporary)")
+    args = parser.parse_args()
+
+    sofa = sof.read_sofa(args.sofa_file, verbose=False)
+    reference = np.asarray(sofa.Data_IR)
+    receivers = reference.shape[1]
+    print(
+        "{}: {} measures, {} receivers, {} samples, Data_IR {:.1f} (MB)".format(
+            args.sofa_file, reference.shape[0], reference.shape[1], reference.shape[2], reference.nbytes / 1e6
+        )
+    )
+
+    output_folder = args.output_folder or tempfile.mkdtemp(prefix="bench_sofa_layout_")
+    filename = os.path.join(output_folder, "layout.sofa")
+
+    print("chunks, deflate, shuffle, write (s), size (MB), ratio, direction (ms), receiver (ms), all (s), identical")
+    for chunks, compression, shuffle in itertools.product(
+        args.chunks.split(";"), args.compression.split(","), args.shuffle.split(",")
+    ):
+        layout = {
+            "compression": int(compression),
+            "chunks": None if chunks == "sofar" else sofa_stream.parse_chunks(chunks, receivers),
+            "shuffle": shuffle != "0",
+        }
+        if layout["chunks"] is None and not layout["shuffle"]:
+            continue  # sof.write_sofa always shuffles
+        if layout["compression"] == 0 and layout["shuffle"] and "0" in args.shuffle.split(","):
+            continue  # no filters without compression
+
+        t0 = time.perf_counter()
+        sofa_stream.write_sofa(filename, sofa, **layout)
+        elapsed = time.perf_counter() - t0
+
+        report = sofa_stream.layout_report(filename, probes=args.probes)
+        identical = np.array_equal(sofa_stream.read_measurement(filename, 0), reference[0]) and np.array_equal(
+            sofa_stream.read_measurement(filename, len(reference) - 1), reference[-1]
+        )
+        print(
+            "{}, {}, {}, {:.2f}, {:.1f}, {:.2f}, {:.2f}, {:.2f}, {:.2f}, {}".format(
+                "sofar {}".format(report["chunks"]) if chunks == "sofar" else report["chunks"],
+                report["compression"],
+                report["shuffle"],
+                elapsed,
+                report["file_size"] / 1e6,
+                report["ratio"],
+                1e3 * report["measure_read"],
+                1e3 * report["receiver_read"],
+                report["full_read"],
+                identical,
+            )
+        )
+
+    os.remove(filename)
+    if args.output_folder is None:
+        os.rmdir(output_folder)
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Benchmark the sofa scripts IR samples load: serial, thread pool and shared memory process pool
+over worker counts (compute_sofa.load_ir_samples), checked against the serial load"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+# hrtf scripts folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import session_index  # noqa: E402
+import session_discovery  # noqa: E402
+from compute_sofa import read_ir_delays, read_ir_samples, load_ir_samples  # noqa: E402
+
+
+def read_positions(measure_folder=None):
+    """(folders, configs, results) of the positions with complete compute_hrir results, os.walk order
+    as compute_sofa"""
+    index = session_index.SessionIndex(measure_folder)
+    folders, configs, results = [], [], []
+    for folder in session_discovery.position_folders(measure_folder):
+        position = index.position(folder)
+        if position is None or position["results"] is None or not position["results"]["complete"]:
+            continue
+        if position["config"].get("syntax", {}).get("name") != "audio_measure":
+            continue
+        folders.append(folder)
+        configs.append(position["config"])
+        results.append(position["results"])
+    index.save()
+    return folders, configs, results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-mf", "--measure_folder", type=str, required=True, help="folder with compute_hrir results")
+    parser.add_argument(
+        "-w", "--workers", type=str, default="1,2,4,8", help="comma separated worker counts (default: %(default)s)"
+    )
+    parser.add_argument(
+        "-m", "--modes", type=str, default="thread,process", help="comma separated pool modes (default: %(default)s)"
+    )
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="runs per configuration (default: %(default)s)")
+    args = parser.parse_args()
+
+    folders, configs, results = read_positions(args.measure_folder)
+    if len(folders) == 0:
+        sys.exit("\n[ERROR] no compute_hrir results found in: {}".format(args.measure_folder))
+
+    receivers = int(configs[0]["setup"]["listeners"][0]["receivers_count"])
+    delays = np.zeros((len(folders), receivers))
+    (err, samples_ir, samples_ir_window) = read_ir_delays(delays, configs, folders, None, results)
+    shape = (len(folders), receivers, samples_ir_window)
+    print(
+        "{}: {} positions, {} receivers, {} samples, Data_IR {:.1f} (MB), {} cpus".format(
+            args.measure_folder, shape[0], shape[1], shape[2], 8 * np.prod(shape) / 1e6, os.cpu_count()
+        )
+    )
+
+    # serial reference (and warm file cache)
+    reference = np.zeros(shape)
+    t_serial = []
+    for _ in range(args.repeat):
+        t0 = time.perf_counter()
+        read_ir_samples(data=reference, configs=configs, folders=folders)
+        t_serial.append(time.perf_counter() - t0)
+    t_serial = min(t_serial)
+
+    print("mode, workers, time (s), positions/s, speed-up, identical")
+    print("serial, 1, {:.3f}, {:.1f}, 1.00x, True".format(t_serial, shape[0] / t_serial))
+    for mode in args.modes.split(","):
+        for workers in [int(w) for w in args.workers.split(",")]:
+            elapsed = []
+            identical = True
+            for _ in range(args.repeat):
+                t0 = time.perf_counter()
+                data, shared = load_ir_samples(shape, configs, folders, processes=workers, mode=mode)
+                elapsed.append(time.perf_counter() - t0)
+                identical = identical and np.array_equal(data, reference)
+                del data
+                if shared is not None:
+                    shared.release()
+            elapsed = min(elapsed)
+            print(
+                "{}, {}, {:.3f}, {:.1f}, {:.2f}x, {}".format(
+                    mode, workers, elapsed, shape[0] / elapsed, t_serial / elapsed, identical
+                )
+            )
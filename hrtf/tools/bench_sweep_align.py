@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""Benchmark sweep alignment: full-recording correlation vs bounded coarse-to-fine search"""
+
+import os
+import sys
+import time
+import yaml
+import argparse
+
+import numpy as np
+import scipy.signal as sig
+
+# hrtf scripts folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import track_reader  # noqa: E402
+import sweep_align  # noqa: E402
+import session_discovery  # noqa: E402
+from compute_hrir import compute_ess  # noqa: E402
+
+
+def align_legacy(x, head_ref, tail_ref):
+    """head/tail as computed by the original compute_hrir code"""
+    corr = sig.correlate(x, head_ref)
+    head = np.argmax(abs(corr)) - int(len(head_ref))
+    corr = sig.correlate(x, tail_ref)
+    tail = np.argmax(abs(corr))
+    return head, tail
+
+
+def align_bounded(x, head_ref, tail_ref, f1, f2, T, Tw, padding_pre, fs):
+    """head/tail as computed by compute_hrir with sweep_align"""
+    head, tail, _ = sweep_align.align_sweep(
+        data=x,
+        head_reference=head_ref,
+        tail_reference=tail_ref,
+        frequency_begin=f1,
+        frequency_end=f2,
+        duration=T,
+        window=Tw,
+        padding_pre=padding_pre,
+        samplerate=fs,
+    )
+    return head, tail
+
+
+def bench_folder(folder, repeat=1):
+    with open(os.path.join(folder, "config.yaml"), "r") as file:
+        config = yaml.safe_load(file)
+
+    sweep = config["custom"]["stimulus"]["sweep"]
+    T = sweep["duration"]["value"]
+    f1 = sweep["frequency"]["begin"]
+    f2 = sweep["frequency"]["end"]
+    amplitude = sweep["amplitude"]["value"]
+    padding_pre = sweep["padding"]["pre"]["value"]
+    tx_track_id = config["setup"]["sources"][0]["emitters"][0]["track_id"]
+    filename = os.path.join(folder, config["custom"]["audio_filename"] + ".wav")
+
+    data, fs = track_reader.read_tracks(filename, tracks=[tx_track_id], dtype=np.float64)
+    x = data[:, 0]
+
+    Tw = min(4, T)
+    head_ref = compute_ess(f1, f2, fs, T, amplitude, Tw, tail=False)
+    tail_ref = compute_ess(f1, f2, fs, T, amplitude, Tw, tail=True)
+
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        legacy = align_legacy(x, head_ref, tail_ref)
+    t_legacy = (time.perf_counter() - t0) / repeat
+
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        bounded = align_bounded(x, head_ref, tail_ref, f1, f2, T, Tw, padding_pre, fs)
+    t_bounded = (time.perf_counter() - t0) / repeat
+
+    return legacy, bounded, t_legacy, t_bounded, len(x) / fs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-mf", "--measure_folder", type=str, required=True, help="folder with audio sweep measures")
+    parser.add_argument("-r", "--repeat", type=int, default=3, help="runs per folder (default: %(default)s)")
+    args = parser.parse_args()
+
+    folders = sorted(session_discovery.position_folders(args.measure_folder))
+    if len(folders) == 0:
+        sys.exit("\n[ERROR] no measures found in: {}".format(args.measure_folder))
+
+    print("folder, duration (s), legacy (s), bounded (s), speed-up, head, tail, match")
+    total_legacy = 0
+    total_bounded = 0
+    mismatch = 0
+    for folder in folders:
+        legacy, bounded, t_legacy, t_bounded, duration = bench_folder(folder, repeat=args.repeat)
+        total_legacy += t_legacy
+        total_bounded += t_bounded
+        match = tuple(int(v) for v in legacy) == tuple(int(v) for v in bounded)
+        mismatch += 0 if match else 1
+        print(
+            "{}, {:.1f}, {:.3f}, {:.3f}, {:.1f}x, {}/{}, {}/{}, {}".format(
+                os.path.basename(folder),
+                duration,
+                t_legacy,
+                t_bounded,
+                t_legacy / t_bounded,
+                legacy[0],
+                bounded[0],
+                legacy[1],
+                bounded[1],
+                match,
+            )
+        )
+
+    print(
+        "total: {} folders, legacy {:.3f} (s), bounded {:.3f} (s), speed-up {:.1f}x, mismatches {}".format(
+            len(folders), total_legacy, total_bounded, total_legacy / total_bounded, mismatch
+        )
+    )
@@ -0,0 +1,496 @@
+#!/usr/bin/env python3
+"""Generate a synthetic measure session (same layout of record_ess_map) with known IRs and delays.
+
+Each position folder gets a config.yaml derived from ess_params.yaml and a multi-track
+sweep_0.wav (sweep_0.wav, sweep_1.wav, ... with repeats, as record_ess; all the repeats in
+sweep_0.wav with interleaved sweeps, see sweep_sequence): the emitter track is the compute_ess
+sweep (delayed by the recording latency), each receiver track is the emitter track convolved
+with a known IR (fractional delay direct path from the source/receiver geometry, a few weaker
+reflections) plus white noise.
+The ground truth is stored in synthetic.yaml, see bench_pipeline.py.
+"""
+
+import os
+import sys
+import copy
+import math
+import yaml
+import logging
+import argparse
+
+import numpy as np
+import soundfile as sf
+import scipy.signal as sig
+
+# hrtf scripts folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import sweep_average  # noqa: E402
+import sweep_sequence  # noqa: E402
+import rotation_nlms  # noqa: E402
+from compute_hrir import compute_ess  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+#
+# DEFINES / CONSTANT / GLOBALS
+#
+_ROOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+_GROUND_TRUTH_FILENAME = "synthetic.yaml"
+_SOUND_SPEED = 343  # m/s, same of compute_hrir
+_TRACKS_COUNT = 22  # RME recording tracks
+_LATENCY_SAMPLES = 517  # recording loop latency, same on all the tracks
+_REPEAT_LATENCY_STEP = 37  # extra latency of each repeat (samples): repeats are not aligned
+_DIRECT_GAIN = 0.5  # direct path amplitude at 1m
+_FRACTIONAL_DELAY_TAPS = 63  # windowed sinc length for fractional delays
+_REFLECTIONS = [(0.0031, 0.3), (0.0057, 0.2), (0.0113, 0.1)]  # (extra delay s, relative gain)
+
+# continuous rotation (see make_rotation)
+_ROTATION_SEGMENT_s = 0.005  # receivers IRs updated every segment
+_ROTATION_SETTLE_PERIODS = 3  # table still before and after the rotation, as record_ess_map
+_ROTATION_POLL_s = 0.25  # encoder positions logging interval, as record_ess_map
+_ENCODER_STEPS = 2454840  # encoder steps per turn (see cmd_get_position.sh)
+
+
+#
+# TOOLS
+#
+def spherical_to_cartesian(azimuth=0, elevation=0, distance=1):
+    """same convention of record_ess_map: degrees, azimuth counterclockwise from x"""
+    az = math.pi / 180 * (azimuth % 360)
+    el = math.pi / 180 * (elevation % 360)
+    return np.array(
+        [distance * math.cos(el) * math.cos(az), distance * math.cos(el) * math.sin(az), distance * math.sin(el)]
+    )
+
+
+def fractional_delay(data=None, delay=0.0, gain=1.0):
+    """add gain * impulse delayed by delay samples (windowed sinc) to data, in place"""
+    half = _FRACTIONAL_DELAY_TAPS // 2
+    start = int(np.floor(delay)) - half
+    n = np.arange(start, start + _FRACTIONAL_DELAY_TAPS)
+    taps = np.sinc(n - delay) * np.hanning(_FRACTIONAL_DELAY_TAPS + 2)[1:-1]
+    valid = (n >= 0) & (n < len(data))
+    data[n[valid]] += gain * taps[valid]
+
+
+def position_config(config=None, name=None, azimuth=0, elevation=0, distance=1):
+    """config.yaml of one position: same source fields written by record_ess_map (spherical coordinates)"""
+    config = copy.deepcopy(config)
+    source = config["setup"]["sources"][0]
+
+    config["custom"]["audio_folder"] = name
+    source["position"]["coord"]["type"] = "spherical"
+    source["position"]["coord"]["units"] = ["degree", "degree", "metre"]
+    source["position"]["coord"]["value"] = [azimuth, elevation, distance]
+    source["position_copy"]["coord"]["type"] = "spherical"
+    source["position_copy"]["coord"]["units"] = ["degree", "degree", "metre"]
+    source["position_copy"]["coord"]["value"] = [azimuth, elevation, distance]
+
+    # source "focused" on the listener
+    view = -spherical_to_cartesian(azimuth, elevation, 1)
+    source["position"]["view_vect"]["type"] = "cartesian"
+    source["position"]["view_vect"]["units"] = ["meter"]
+    source["position"]["view_vect"]["value"] = [round(float(v), 9) for v in view]
+    return config
+
+
+def receiver_irs(config=None, samplerate=48000, rng=None):
+    """known IR of each receiver for the source position of config: list of (rx_id, track_id, delay_s, ir)"""
+    source = spherical_to_cartesian(*config["setup"]["sources"][0]["position"]["coord"]["value"])
+    listener = np.asarray(config["setup"]["listeners"][0]["position"]["coord"]["value"], dtype=np.float64)
+    receivers = config["setup"]["listeners"][0]["receivers"]
+
+    ir_length = int((np.linalg.norm(source) + 1.0) / _SOUND_SPEED * samplerate) + int(0.02 * samplerate)
+
+    irs = []
+    for rx_id in range(config["setup"]["listeners"][0]["receivers_count"]):
+        position = listener + np.asarray(receivers[rx_id]["position"]["coord"]["value"], dtype=np.float64)
+        path = np.linalg.norm(source - position)
+        delay_s = path / _SOUND_SPEED
+
+        ir = np.zeros(ir_length)
+        fractional_delay(ir, delay_s * samplerate, _DIRECT_GAIN / max(path, 0.1))
+        for extra_s, gain in _REFLECTIONS:
+            jitter_s = rng.uniform(-0.0005, 0.0005)
+            fractional_delay(ir, (delay_s + extra_s + jitter_s) * samplerate, gain * _DIRECT_GAIN / max(path, 0.1))
+
+        irs.append((rx_id, receivers[rx_id]["track_id"], delay_s, ir))
+    return irs
+
+
+def make_position(folder=None, config=None, noise_db=-80.0, seed=0, repeats=1, interleave=0):
+    """write config.yaml, sweep_0.wav (sweep_<n>.wav of each repeat) and synthetic.yaml of one position folder"""
+    sweep = config["custom"]["stimulus"]["sweep"]
+    fs = int(config["custom"]["recording"]["samplerate"])
+    T = sweep["duration"]["value"]
+    padding_pre = sweep["padding"]["pre"]["value"]
+    padding_post = sweep["padding"]["post"]["value"]
+    tx_track_id = config["setup"]["sources"][0]["emitters"][0]["track_id"]
+
+    rng = np.random.default_rng(seed)
+    interleave = float(interleave) if repeats > 1 else 0
+    samples = int((padding_pre + sweep_sequence.sequence_duration(T, repeats, interleave) + padding_post) * fs)
+
+    config["custom"]["stimulus"]["sweep"]["repeat"]["value"] = int(repeats)
+    config["custom"]["stimulus"]["sweep"]["interleave"] = {"value": interleave, "units": "s"}
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, "config.yaml"), "w") as file:
+        yaml.dump(config, file, default_flow_style=False, sort_keys=False)
+
+    ess = compute_ess(
+        sweep["frequency"]["begin"], sweep["frequency"]["end"], fs, T, sweep["amplitude"]["value"], T
+    )
+    irs = receiver_irs(config, fs, rng)
+    filenames = sweep_average.repeat_filenames(
+        config["custom"]["audio_filename"], config["custom"]["recording"]["format"], 1 if interleave > 0 else repeats
+    )
+
+    noise = 10 ** (noise_db / 20)
+    truth = {}
+    for r, filename in enumerate(filenames):
+        # emitter (loopback) track
+        data = np.zeros((samples, _TRACKS_COUNT), dtype=np.float32)
+        head = int(padding_pre * fs) + _LATENCY_SAMPLES + r * _REPEAT_LATENCY_STEP
+        if interleave > 0:
+            data[_LATENCY_SAMPLES:, tx_track_id] = sweep_sequence.sequence_block(
+                0,
+                samples - _LATENCY_SAMPLES,
+                fs,
+                sweep["frequency"]["begin"],
+                sweep["frequency"]["end"],
+                T,
+                padding_pre,
+                sweep_sequence.sweep_amplitude(sweep["amplitude"]["value"], T, interleave),
+                repeats,
+                interleave,
+            )[:, 0]
+        else:
+            data[head : head + len(ess), tx_track_id] = ess[: samples - head]
+
+        # receivers tracks (same IRs, new noise for each repeat)
+        for rx_id, track_id, delay_s, ir in irs:
+            y = sig.oaconvolve(data[:, tx_track_id].astype(np.float64), ir)[:samples]
+            data[:, track_id] = y + noise * rng.standard_normal(samples)
+            truth[rx_id] = {
+                "track_id": int(track_id),
+                "delay_s": float(delay_s),
+                "delay_samples": float(delay_s * fs),
+            }
+
+        sf.write(
+            os.path.join(folder, filename), data, fs, subtype=config["custom"]["recording"]["subformat"]
+        )
+
+    ground_truth = {
+        "syntax": {"name": "synthetic_measure", "version": {"major": 0, "minor": 1, "revision": 0}},
+        "samplerate": fs,
+        "latency_samples": _LATENCY_SAMPLES,
+        "noise_db": float(noise_db),
+        "repeats": int(repeats),
+        "interleave": interleave,
+        "seed": int(seed),
+        "receivers": truth,
+    }
+    with open(os.path.join(folder, _GROUND_TRUTH_FILENAME), "w") as file:
+        yaml.dump(ground_truth, file, default_flow_style=False)
+
+
+def make_rotation(
+    folder=None,
+    config=None,
+    azimuth_begin=0,
+    azimuth_end=90,
+    azimuth_step=5,
+    elevation=0,
+    distance=1,
+    speed=3.0,
+    period=1.0,
+    measure_name="synth",
+    noise_db=-80.0,
+    seed=0,
+):
+    """write config.yaml, sweep_0.wav and rotation.yaml of a continuous rotation recording (see
+    record_ess_map.run_rotation): the table stands still for a few periods, turns at speed deg/s
+    from azimuth_begin to azimuth_end (ccw) and stands still again, the receivers IRs follow the
+    azimuth (updated every _ROTATION_SEGMENT_s)"""
+    sweep = config["custom"]["stimulus"]["sweep"]
+    fs = int(config["custom"]["recording"]["samplerate"])
+    padding_pre = sweep["padding"]["pre"]["value"]
+    padding_post = sweep["padding"]["post"]["value"]
+    tx_track_id = config["setup"]["sources"][0]["emitters"][0]["track_id"]
+
+    length = rotation_nlms.period_samples(period, fs)
+    settle = _ROTATION_SETTLE_PERIODS * length / fs
+    moving = abs(azimuth_end - azimuth_begin) / speed
+    periods = int(np.ceil((2 * settle + moving) * fs / length))
+    samples = int(padding_pre * fs) + periods * length + int(padding_post * fs) + _LATENCY_SAMPLES
+
+    config["custom"]["stimulus"]["type"] = "perfect_sweep"
+    config["custom"]["rotation"] = {
+        "measure_name": measure_name,
+        "period": {"value": float(period), "units": "s"},
+        "direction": "ccw",
+        "azimuth": {"begin": azimuth_begin, "end": azimuth_end, "step": azimuth_step, "units": "degree"},
+        "elevation": elevation,
+        "distance": distance,
+        "encoder_log": "rotation.yaml",
+    }
+    os.makedirs(folder, exist_ok=True)
+    with open(os.path.join(folder, "config.yaml"), "w") as file:
+        yaml.dump(config, file, default_flow_style=False, sort_keys=False)
+
+    def azimuth_at(t):
+        """source azimuth at t (s from the first sweep period, DAC time)"""
+        progress = np.clip((np.asarray(t) - settle) / moving, 0, 1)
+        return azimuth_begin + (azimuth_end - azimuth_begin) * progress
+
+    # emitter (loopback) track: the perfect sweep in loop, delayed by the recording latency
+    data = np.zeros((samples, _TRACKS_COUNT), dtype=np.float32)
+    prepadding = int(padding_pre * fs)
+    data[_LATENCY_SAMPLES:, tx_track_id] = rotation_nlms.periodic_block(
+        rotation_nlms.perfect_sweep(length),
+        0,
+        samples - _LATENCY_SAMPLES,
+        prepadding,
+        sweep["amplitude"]["value"],
+        prepadding + periods * length,
+    )[:, 0]
+    tx = data[:, tx_track_id].astype(np.float64)
+
+    # receivers tracks: each segment of the emitter track filtered with the IRs of its azimuth
+    segment = int(_ROTATION_SEGMENT_s * fs)
+    y = None
+    for start in range(0, samples, segment):
+        t = (start + segment / 2 - _LATENCY_SAMPLES - prepadding) / fs
+        position = position_config(config, None, float(azimuth_at(t)), elevation, distance)
+        irs = receiver_irs(position, fs, np.random.default_rng(seed))
+        if y is None:
+            y = np.zeros((len(irs), samples + len(irs[0][3])))
+        chunk = tx[start : start + segment]
+        for idx, (rx_id, track_id, delay_s, ir) in enumerate(irs):
+            y[idx, start : start + len(chunk) + len(ir) - 1] += np.convolve(chunk, ir)
+
+    rng = np.random.default_rng(seed)
+    noise = 10 ** (noise_db / 20)
+    for idx, (rx_id, track_id, delay_s, ir) in enumerate(irs):
+        data[:, track_id] = y[idx, :samples] + noise * rng.standard_normal(samples)
+
+    sf.write(
+        os.path.join(folder, config["custom"]["audio_filename"] + "." + config["custom"]["recording"]["format"]),
+        data,
+        fs,
+        subtype=config["custom"]["recording"]["subformat"],
+    )
+
+    # encoder positions (table angles, ccw), logged every _ROTATION_POLL_s with the encoder resolution
+    times = np.arange(-_ROTATION_POLL_s, periods * length / fs + _ROTATION_POLL_s, _ROTATION_POLL_s)
+    angles = np.round((360 - azimuth_at(times)) * _ENCODER_STEPS / 360) * 360 / _ENCODER_STEPS
+    rotation_nlms.write_encoder_log(
+        os.path.join(folder, "rotation.yaml"), times, angles, direction="ccw", periods=periods
+    )
+
+
+def read_ground_truth(folder=None):
+    """synthetic.yaml of a position folder, None if missing"""
+    try:
+        with open(os.path.join(str(folder), _GROUND_TRUTH_FILENAME), "r") as file:
+            return yaml.safe_load(file)
+    except (OSError, yaml.YAMLError):
+        return None
+
+
+def make_session(
+    measure_folder=None,
+    ess_yaml_config=None,
+    name="synth",
+    azimuths=None,
+    elevations=None,
+    distance=1,
+    receivers=None,
+    samplerate=None,
+    duration=None,
+    padding=None,
+    noise_db=-80.0,
+    repeats=1,
+    interleave=0,
+    rotation_speed=0,
+    rotation_period=1.0,
+):
+    """write a full session: one _xAngle folder for each azimuth/elevation (one _rotation folder for each
+    elevation with a continuous rotation over the azimuths range), returns the folders list"""
+    with open(ess_yaml_config, "r") as file:
+        config = yaml.safe_load(file)
+
+    config["custom"]["project_folder"] = os.path.basename(os.path.normpath(measure_folder))
+    if samplerate is not None:
+        config["custom"]["recording"]["samplerate"] = int(samplerate)
+    if duration is not None:
+        config["custom"]["stimulus"]["sweep"]["duration"]["value"] = int(duration)
+    if padding is not None:
+        config["custom"]["stimulus"]["sweep"]["padding"]["pre"]["value"] = int(padding)
+        config["custom"]["stimulus"]["sweep"]["padding"]["post"]["value"] = int(padding)
+
+    # receivers subset (same ids order of the config)
+    listener = config["setup"]["listeners"][0]
+    if receivers is not None:
+        listener["receivers"] = {idx: listener["receivers"][rx] for idx, rx in enumerate(receivers)}
+        listener["receivers_count"] = len(receivers)
+
+    folders = []
+    seed = 0
+    for elevation in elevations:
+        if rotation_speed > 0:
+            folder_name = name + "_{}{:03d}+{:03d}_rotation".format(
+                "+" if elevation > 0 else "-", abs(elevation), int(distance)
+            )
+            folder = os.path.join(measure_folder, folder_name)
+            logger.info("make session: {}".format(folder))
+
+            make_rotation(
+                folder,
+                position_config(config, folder_name, azimuths[0], elevation, distance),
+                azimuth_begin=azimuths[0],
+                azimuth_end=azimuths[-1],
+                azimuth_step=azimuths[1] - azimuths[0] if len(azimuths) > 1 else 1,
+                elevation=elevation,
+                distance=distance,
+                speed=rotation_speed,
+                period=rotation_period,
+                measure_name=name,
+                noise_db=noise_db,
+                seed=seed,
+            )
+            folders.append(folder)
+            seed += 1
+            continue
+
+        for azimuth in azimuths:
+            azimuth = azimuth % 360
+            folder_name = name + "_+{:03d}{}{:03d}+{:03d}_xAngle".format(
+                azimuth, "+" if elevation > 0 else "-", abs(elevation), int(distance)
+            )
+            folder = os.path.join(measure_folder, folder_name)
+            logger.info("make session: {}".format(folder))
+
+            make_position(
+                folder,
+                position_config(config, folder_name, azimuth, elevation, distance),
+                noise_db=noise_db,
+                seed=seed,
+                repeats=repeats,
+                interleave=interleave,
+            )
+            folders.append(folder)
+            seed += 1
+
+    return folders
+
+
+def int_list(text):
+    """comma separated list or begin:end:step range of integers"""
+    if ":" in text:
+        begin, end, step = (int(v) for v in text.split(":"))
+        return list(range(begin, end + 1, step))
+    return [int(v) for v in text.split(",") if v.strip() != ""]
+
+
+###############################################################################
+# MAIN
+###############################################################################
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument(
+        "-mf", "--measure_folder", type=str, required=True, help="output session folder (created if missing)"
+    )
+    parser.add_argument(
+        "-yc",
+        "--ess_yaml_config",
+        type=str,
+        default=os.path.join(_ROOT_DIR, "ess_params.yaml"),
+        help="base ESS config (default: %(default)s)",
+    )
+    parser.add_argument("-n", "--name", type=str, default="synth", help="measure name prefix (default: %(default)s)")
+    parser.add_argument(
+        "-az",
+        "--azimuths",
+        type=int_list,
+        default="0:330:30",
+        help="azimuths (deg), list a,b,c or range begin:end:step (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-el",
+        "--elevations",
+        type=int_list,
+        default="0",
+        help="elevations (deg), list a,b,c or range begin:end:step (default: %(default)s)",
+    )
+    parser.add_argument("-di", "--distance", type=int, default=1, help="distance (m) (default: %(default)s)")
+    parser.add_argument(
+        "-rx",
+        "--receivers",
+        type=int_list,
+        default=None,
+        help="receivers ids of the config to keep (default: all)",
+    )
+    parser.add_argument(
+        "-sr", "--samplerate", type=int, default=None, help="samplerate (default: from ESS config)"
+    )
+    parser.add_argument(
+        "-d", "--duration", type=int, default=None, help="sweep duration (s) (default: from ESS config)"
+    )
+    parser.add_argument(
+        "-p", "--padding", type=int, default=None, help="sweep padding pre/post (s) (default: from ESS config)"
+    )
+    parser.add_argument(
+        "-nd", "--noise_db", type=float, default=-80.0, help="receivers noise level (dBFS) (default: %(default)s)"
+    )
+    parser.add_argument(
+        "-r", "--repeats", type=int, default=1, help="sweeps recorded for each position (default: %(default)s)"
+    )
+    parser.add_argument(
+        "-il",
+        "--interleave",
+        type=float,
+        default=0,
+        help="repeats in one recording, a sweep every interleave s, 0 to disable (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-rs",
+        "--rotation_speed",
+        type=float,
+        default=0,
+        help="continuous rotation over the azimuths range at this speed (deg/s), 0 to disable (default: %(default)s)",
+    )
+    parser.add_argument(
+        "-rp",
+        "--rotation_period",
+        type=float,
+        default=1.0,
+        help="continuous rotation perfect sweep period (s) (default: %(default)s)",
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", default=False, help="verbose (default: %(default)s)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    folders = make_session(
+        measure_folder=args.measure_folder,
+        ess_yaml_config=args.ess_yaml_config,
+        name=args.name,
+        azimuths=args.azimuths,
+        elevations=args.elevations,
+        distance=args.distance,
+        receivers=args.receivers,
+        samplerate=args.samplerate,
+        duration=args.duration,
+        padding=args.padding,
+        noise_db=args.noise_db,
+        repeats=args.repeats,
+        interleave=args.interleave,
+        rotation_speed=args.rotation_speed,
+        rotation_period=args.rotation_period,
+    )
+    print("{} positions written in {}".format(len(folders), args.measure_folder))
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""Summary report of the per stage timings written by compute_hrir (JSON lines, see stage_timer.py)"""
+
+import os
+import sys
+import argparse
+
+# hrtf scripts folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import stage_timer  # noqa: E402
+
+
+def print_stages(records=None, by_receiver=False):
+    summary = stage_timer.stage_summary(records, by_receiver=by_receiver)
+    total_wall = sum(s["wall_s"] for s in summary.values())
+
+    print(
+        "{:<24s} {:>4s} {:>7s} {:>11s} {:>6s} {:>10s} {:>10s} {:>10s} {:>11s} {:>6s} {:>9s}".format(
+            "stage", "rx", "count", "wall (s)", "%", "mean (ms)", "p95 (ms)", "max (ms)", "cpu (s)", "cpu %", "rss (MB)"
+        )
+    )
+    for (stage, rx), s in summary.items():
+        print(
+            "{:<24s} {:>4s} {:>7d} {:>11.2f} {:>6.1f} {:>10.1f} {:>10.1f} {:>10.1f} {:>11.2f} {:>6.0f} {:>9.0f}".format(
+                stage,
+                "-" if rx is None else str(rx),
+                s["count"],
+                s["wall_s"],
+                100 * s["wall_s"] / max(total_wall, 1e-9),
+                1000 * s["mean_s"],
+                1000 * s["p95_s"],
+                1000 * s["max_s"],
+                s["cpu_s"],
+                100 * s["cpu_s"] / max(s["wall_s"], 1e-9),
+                s["peak_rss_mb"],
+            )
+        )
+
+
+def print_folders(records=None, top=10):
+    folders = [r for r in records if r.get("scope") == "folder"]
+    computed = [r for r in folders if r["stage"] == "total"]
+    failed = [r for r in folders if r["stage"] == "failed"]
+    skipped = len(folders) - len(computed) - len(failed)
+
+    print(
+        "\nfolders: {} computed, {} skipped, {} failed, {} processes, {} hosts".format(
+            len(computed),
+            skipped,
+            len(failed),
+            len(set(r["pid"] for r in folders)),
+            len(set(r.get("host") for r in folders)),
+        )
+    )
+    for r in failed:
+        print("failed after {:.2f} s: {}".format(r["wall_s"], r["folder"]))
+    if len(computed) == 0:
+        return
+
+    walls = [r["wall_s"] for r in computed]
+    print(
+        "folder wall (s): total {:.1f}, mean {:.2f}, p95 {:.2f}, max {:.2f}, peak rss {:.0f} (MB)".format(
+            sum(walls),
+            sum(walls) / len(walls),
+            stage_timer.percentile(walls, 95),
+            max(walls),
+            max(r["peak_rss_mb"] for r in computed),
+        )
+    )
+    if len(computed) > 1:
+        span = [r["time"] for r in records]
+        print("first record: {}, last record: {}".format(min(span), max(span)))
+
+    if top > 0:
+        print("\nslowest folders:")
+        for r in sorted(computed, key=lambda r: r["wall_s"], reverse=True)[:top]:
+            print("{:>9.2f} s {:>7.0f} MB  {}".format(r["wall_s"], r["peak_rss_mb"], r["folder"]))
+
+
+###############################################################################
+# MAIN
+###############################################################################
+#
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="compute_hrir stage timings files (JSON lines)")
+    parser.add_argument(
+        "-rx", "--by_receiver", action="store_true", default=False, help="split receiver stages by receiver"
+    )
+    parser.add_argument(
+        "-t", "--top", type=int, default=10, help="number of slowest folders to list (default: %(default)s)"
+    )
+    args = parser.parse_args()
+
+    records = stage_timer.read_records(args.files)
+    if len(records) == 0:
+        sys.exit("\n[ERROR] no records in: {}".format(", ".join(args.files)))
+
+    print_stages(records, by_receiver=args.by_receiver)
+    print_folders(records, top=args.top)
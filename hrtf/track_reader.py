@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""Read only selected tracks from multi-track WAV recordings"""
+
+import os
+import struct
+import logging
+
+import numpy as np
+import soundfile as sf
+
+logger = logging.getLogger(__name__)
+
+#
+# DEFINES / CONSTANT / GLOBALS
+#
+_READ_BLOCK_FRAMES = 96000  # frames read per block (1s @96kHz)
+_PCM_24_SCALE = 1.0 / (1 << 23)  # same int->float normalization used by libsndfile
+
+_WAVE_FORMAT_PCM = 0x0001
+_WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+
+#
+# TOOLS
+#
+def wav_pcm24_layout(filename=None):
+    """Locate the raw PCM_24 frames inside a RIFF/WAVE file.
+
+    Returns (data_offset, frames, channels, samplerate) or None if the file
+    is not a plain little-endian 24bit PCM wav file.
+    """
+    try:
+        with open(filename, "rb") as file:
+            riff = file.read(12)
+            if len(riff) < 12 or riff[0:4] != b"RIFF" or riff[8:12] != b"WAVE":
+                return None
+
+            fmt = None
+            while True:
+                chunk = file.read(8)
+                if len(chunk) < 8:
+                    return None
+
+                chunk_id, chunk_size = struct.unpack("<4sI", chunk)
+
+                if chunk_id == b"fmt ":
+                    fmt = struct.unpack("<HHIIHH", file.read(16))
+                    file.seek(chunk_size - 16 + (chunk_size & 1), os.SEEK_CUR)
+                elif chunk_id == b"data":
+                    if fmt is None:
+                        return None
+                    (format_tag, channels, samplerate, _, block_align, bits) = fmt
+                    if format_tag not in [_WAVE_FORMAT_PCM, _WAVE_FORMAT_EXTENSIBLE]:
+                        return None
+                    if (bits != 24) or (block_align != 3 * channels):
+                        return None
+                    # guard against truncated files (or unpatched header size after a crash)
+                    data_offset = file.tell()
+                    data_size = min(chunk_size, os.path.getsize(filename) - data_offset)
+                    return (data_offset, data_size // block_align, channels, samplerate)
+                else:
+                    file.seek(chunk_size + (chunk_size & 1), os.SEEK_CUR)
+    except OSError:
+        return None
+
+
+#
+# READ FUNCTIONS
+#
+def read_tracks_memmap(filename=None, tracks=None, dtype=np.float32, blocksize=_READ_BLOCK_FRAMES):
+    """Read selected tracks from a memory-mapped view of the 24bit PCM frames"""
+    layout = wav_pcm24_layout(filename)
+    if layout is None:
+        return None
+
+    (data_offset, frames, channels, samplerate) = layout
+    block_align = 3 * channels
+
+    # map one extra byte before the audio frames: each 24bit sample is then read as the
+    # upper 3 bytes of a little-endian int32, the arithmetic shift removes the extra byte
+    # and keeps the sign
+    frames_raw = np.memmap(
+        filename, dtype=np.uint8, mode="r", offset=(data_offset - 1), shape=(frames * block_align + 1,)
+    )
+
+    data = np.empty((frames, len(tracks)), dtype=dtype)
+    for idx, track in enumerate(tracks):
+        samples = np.ndarray(
+            shape=(frames,), dtype="<i4", buffer=frames_raw, offset=(3 * track), strides=(block_align,)
+        )
+        for start in range(0, frames, blocksize):
+            stop = min(frames, start + blocksize)
+            data[start:stop, idx] = (samples[start:stop] >> 8) * _PCM_24_SCALE
+
+    del frames_raw
+
+    return data, samplerate
+
+
+def read_tracks_blocks(filename=None, tracks=None, dtype=np.float32, blocksize=_READ_BLOCK_FRAMES):
+    """Read selected tracks with block-wise reads (any format supported by libsndfile)"""
+    with sf.SoundFile(filename, mode="r") as file:
+        data = np.empty((file.frames, len(tracks)), dtype=dtype)
+        samplerate = file.samplerate
+
+        start = 0
+        for block in file.blocks(blocksize=blocksize, dtype=dtype, always_2d=True):
+            data[start : (start + len(block)), :] = block[:, tracks]
+            start += len(block)
+
+    return data[:start], samplerate
+
+
+def read_tracks(filename=None, tracks=None, dtype=np.float32, memmap=True, blocksize=_READ_BLOCK_FRAMES):
+    """Read only the selected tracks (channels) of an audio file.
+
+    Only the requested tracks are kept in memory, converted to dtype
+    (float32 by default): columns of the returned array follow the
+    order of the tracks list.
+
+    Returns (data, samplerate), data has shape (frames, len(tracks))
+    """
+    tracks = [int(t) for t in tracks]
+
+    if memmap:
+        rv = read_tracks_memmap(filename=filename, tracks=tracks, dtype=dtype, blocksize=blocksize)
+        if rv is not None:
+            return rv
+        logger.info("read_tracks: {} is not PCM_24 wav, using block-wise reads".format(filename))
+
+    return read_tracks_blocks(filename=filename, tracks=tracks, dtype=dtype, blocksize=blocksize)
+
+
+#
+# STREAM READS
+#
+class TrackStream:
+    """Frames ranges of the selected tracks of an audio file, read on demand (the file stays open).
+
+    Columns of the returned blocks follow the order of the tracks list, as read_tracks.
+    """
+
+    def __init__(self, filename=None, tracks=None, dtype=np.float32):
+        self.file = sf.SoundFile(filename, mode="r")
+        self.tracks = [int(t) for t in tracks]
+        self.dtype = dtype
+        self.frames = self.file.frames
+        self.samplerate = self.file.samplerate
+
+    def read(self, start=0, stop=0):
+        """frames start..stop, shape (stop - start, len(tracks))"""
+        self.file.seek(start)
+        return self.file.read(stop - start, dtype=self.dtype, always_2d=True)[:, self.tracks]
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False